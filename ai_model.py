@@ -1,46 +1,121 @@
+import os
+import threading
 import numpy as np
 import cv2
 from typing import List, Dict
+from tiled_analysis import histogram_std
 
-class DentalAIModel:
-    def __init__(self):
-        # القاموس للترجمة بين الإنجليزية والعربية
-        self.condition_translations = {
-            'cavity': 'تسوس',
-            'gum_inflammation': 'التهاب لثة',
-            'plaque': 'تراكم البلاك',
-            'healthy': 'أسنان سليمة',
-            'erosion': 'تآكل المينا',
-            'sensitivity': 'حساسية الأسنان'
-        }
-        
-    def preprocess_image(self, image):
-        """تجهيز الصورة للتحليل"""
-        # تحويل الصورة إلى المقاس المطلوب
-        image = cv2.resize(image, (224, 224))
-        return image
-    
-    def predict(self, image):
+# حجم الصورة المطلوب للنموذج
+INPUT_SIZE = 224
+
+# ترتيب مخرجات النموذج إذا لم يحدده ملف النموذج نفسه
+DEFAULT_LABELS = ['cavity', 'gum_inflammation', 'plaque', 'healthy', 'erosion', 'sensitivity']
+
+# إعدادات محرك الاستدلال مشتركة بين الخادم وعمليات المجمعات
+AI_BACKEND = os.getenv('AI_BACKEND', 'heuristic')  # heuristic أو onnx
+AI_MODEL_PATH = os.getenv('AI_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'tiny_dental.onnx'))
+AI_MODEL_QUANTIZED = os.getenv('AI_MODEL_QUANTIZED', '0') == '1'
+AI_INTRA_OP_THREADS = int(os.getenv('AI_INTRA_OP_THREADS', 0))  # 0 = اختيار onnxruntime
+AI_INTER_OP_THREADS = int(os.getenv('AI_INTER_OP_THREADS', 0))
+
+# جلسة واحدة لكل نموذج وإعدادات خيوط في كل عملية (تحميل النموذج مكلف)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def quantized_path(model_path):
+    """مسار نسخة int8 من النموذج بجانب الملف الأصلي"""
+    return os.path.splitext(model_path)[0] + '.int8.onnx'
+
+def _get_session(model_path, intra_op_threads=0, inter_op_threads=0):
+    # onnxruntime اختياري: لا يلزم تثبيته إلا عند استخدام هذا المحرك
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("محرك onnx يتطلب تثبيت الحزمة onnxruntime")
+
+    key = (os.getpid(), os.path.abspath(model_path), intra_op_threads, inter_op_threads)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = intra_op_threads
+            options.inter_op_num_threads = inter_op_threads
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+            _sessions[key] = session
+        return session
+
+# حدود الألوان في HSV (الصبغة ثم التشبع ثم القيمة)
+_YELLOW_LOWER = np.array([20, 50, 50])
+_YELLOW_UPPER = np.array([30, 255, 255])
+_RED_LOWER = np.array([0, 50, 50])
+_RED_UPPER = np.array([10, 255, 255])
+
+# calcHist ترجع العدادات كـ float32 وهي دقيقة تماماً حتى 2^24 بكسل في كل استدعاء
+_CALC_HIST_MAX_PIXELS = 1 << 24
+
+def _histogram(image, size):
+    """مدرج تكراري صحيح للصورة (على دفعات من الصفوف للصور الكبيرة جداً)"""
+    rows = max(1, _CALC_HIST_MAX_PIXELS // image.shape[1])
+    counts = 0
+    for start in range(0, image.shape[0], rows):
+        hist = cv2.calcHist([image[start:start + rows]], [0], None, [size], [0, size])
+        counts = counts + hist.ravel().astype(np.int64)
+    return counts
+
+def batch_features(images):
+    """
+    السطوع والتباين ونسبتا البكسلات الصفراء والحمراء لدفعة صور BGR بشكل (N, H, W, 3)
+    تحويل الألوان يتم للدفعة كاملة مرة واحدة، والسطوع والتباين من مدرج تكراري لكل صورة
+    بمجاميع صحيحة تماماً، لذلك نتيجة كل صورة لا تعتمد على حجم الدفعة
+    """
+    count, height, width = images.shape[:3]
+    pixels = height * width
+    # تحويل الألوان لكل بكسل على حدة، لذلك تحول الدفعة كصورة واحدة طويلة
+    flat = np.ascontiguousarray(images).reshape(count * height, width, 3)
+    gray = cv2.cvtColor(flat, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(flat, cv2.COLOR_BGR2HSV)
+
+    gray_counts = np.empty((count, 256), dtype=np.int64)
+    yellow_counts = np.empty(count, dtype=np.int64)
+    red_counts = np.empty(count, dtype=np.int64)
+    # مخزن بحجم صورة واحدة يعاد استخدامه لكل الصور بدلاً من إنشاء أقنعة جديدة
+    matches = np.empty((height, width), dtype=np.uint8)
+    for i in range(count):
+        rows = slice(i * height, (i + 1) * height)
+        gray_counts[i] = _histogram(gray[rows], 256)
+        cv2.inRange(hsv[rows], _YELLOW_LOWER, _YELLOW_UPPER, dst=matches)
+        yellow_counts[i] = cv2.countNonZero(matches)
+        cv2.inRange(hsv[rows], _RED_LOWER, _RED_UPPER, dst=matches)
+        red_counts[i] = cv2.countNonZero(matches)
+
+    brightness = gray_counts @ np.arange(256, dtype=np.int64) / pixels
+    contrast = np.array([histogram_std(counts) for counts in gray_counts])
+    yellow_ratio = yellow_counts / pixels
+    red_ratio = red_counts / pixels
+    return brightness, contrast, yellow_ratio, red_ratio
+
+class HeuristicBackend:
+    """
+    محاكاة تحليل الذكاء الاصطناعي باستخدام تحليل الصور التقليدي
+    في المستقبل سيتم استبدال هذا بنموذج تعلم عميق حقيقي
+    """
+
+    def predict_batch(self, images):
         """
-        محاكاة تحليل الذكاء الاصطناعي باستخدام تحليل الصور التقليدي
-        في المستقبل سيتم استبدال هذا بنموذج تعلم عميق حقيقي
+        قائمة الحالات المكتشفة (بالإنجليزية) ودرجة الثقة لكل صورة
+        images مصفوفة (N, H, W, 3) من preprocess_image أو قائمة صور
         """
-        # تحويل الصورة إلى تدرج الرمادي
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        # تحويل الصورة إلى HSV
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # حساب خصائص الصورة
-        brightness = np.mean(gray)
-        contrast = np.std(gray)
-        
-        # تحليل اللون للكشف عن مشاكل محتملة
-        yellow_mask = cv2.inRange(hsv, np.array([20, 50, 50]), np.array([30, 255, 255]))
-        red_mask = cv2.inRange(hsv, np.array([0, 50, 50]), np.array([10, 255, 255]))
-        
-        yellow_ratio = np.sum(yellow_mask > 0) / yellow_mask.size
-        red_ratio = np.sum(red_mask > 0) / red_mask.size
-        
+        if len(images) == 0:
+            return []
+        if not isinstance(images, np.ndarray):
+            if len({image.shape for image in images}) > 1:
+                # صور بأحجام مختلفة: كل صورة كدفعة مستقلة
+                return [self.predict_batch(image[np.newaxis])[0] for image in images]
+            images = np.stack(images)
+        return [self._predict(*row) for row in zip(*batch_features(images))]
+
+    def _predict(self, brightness, contrast, yellow_ratio, red_ratio):
         # تحديد الحالات المحتملة بناءً على التحليل
         results = []
         
@@ -79,15 +154,115 @@ class DentalAIModel:
                 'confidence': 95.0
             })
         
-        # ترجمة النتائج إلى العربية للعرض
-        translated_results = []
-        for result in results:
-            translated_results.append({
-                'condition': self.condition_translations[result['condition']],
-                'confidence': result['confidence']
-            })
+        return results
+
+class OnnxBackend:
+    """
+    نموذج تعلم عميق بصيغة ONNX يعمل على المعالج باستخدام onnxruntime
+    المدخل دفعة NCHW من الصور (RGB بين 0 و 1) والمخرج احتمال كل حالة
+    """
+
+    def __init__(self, model_path=None, intra_op_threads=None, inter_op_threads=None,
+                 quantized=None, threshold=0.5):
+        model_path = model_path or AI_MODEL_PATH
+        if AI_MODEL_QUANTIZED if quantized is None else quantized:
+            model_path = quantized_path(model_path)
+        self.model_path = model_path
+        self.intra_op_threads = AI_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+        self.inter_op_threads = AI_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+        # الحد الأدنى للاحتمال لاعتبار الحالة مكتشفة
+        self.threshold = threshold
+
+    @property
+    def session(self):
+        return _get_session(self.model_path, self.intra_op_threads, self.inter_op_threads)
+
+    @property
+    def labels(self):
+        # ترتيب المخرجات محفوظ في بيانات النموذج الوصفية
+        labels = self.session.get_modelmeta().custom_metadata_map.get('labels')
+        return labels.split(',') if labels else DEFAULT_LABELS
+
+    def to_batch(self, images):
+        """تجميع الصور (BGR) في مصفوفة NCHW واحدة لتمريرة واحدة عبر النموذج"""
+        batch = np.empty((len(images), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        for i, image in enumerate(images):
+            if image.shape[:2] != (INPUT_SIZE, INPUT_SIZE):
+                image = cv2.resize(image, (INPUT_SIZE, INPUT_SIZE))
+            # BGR -> RGB وتحويل HWC إلى CHW
+            batch[i] = image[:, :, ::-1].transpose(2, 0, 1)
+        batch *= 1.0 / 255
+        return batch
+
+    def predict_batch(self, images):
+        """قائمة الحالات المكتشفة (بالإنجليزية) ودرجة الثقة لكل صورة"""
+        if len(images) == 0:
+            return []
+        session = self.session
+        labels = self.labels
+        probabilities = session.run(None, {session.get_inputs()[0].name: self.to_batch(images)})[0]
+
+        predictions = []
+        for row in probabilities:
+            results = [
+                {'condition': label, 'confidence': float(probability) * 100}
+                for label, probability in zip(labels, row)
+                if label != 'healthy' and probability >= self.threshold
+            ]
+            if not results:
+                results.append({
+                    'condition': 'healthy',
+                    'confidence': float(row[labels.index('healthy')]) * 100 if 'healthy' in labels else 95.0
+                })
+            predictions.append(results)
+        return predictions
+
+def create_backend(name=None):
+    """إنشاء محرك الاستدلال حسب الاسم أو إعداد AI_BACKEND"""
+    name = name or AI_BACKEND
+    if name == 'heuristic':
+        return HeuristicBackend()
+    if name == 'onnx':
+        return OnnxBackend()
+    raise ValueError(f"محرك استدلال غير معروف: {name}")
+
+class DentalAIModel:
+    def __init__(self, backend=None):
+        # القاموس للترجمة بين الإنجليزية والعربية
+        self.condition_translations = {
+            'cavity': 'تسوس',
+            'gum_inflammation': 'التهاب لثة',
+            'plaque': 'تراكم البلاك',
+            'healthy': 'أسنان سليمة',
+            'erosion': 'تآكل المينا',
+            'sensitivity': 'حساسية الأسنان'
+        }
+        # محرك الاستدلال (الافتراضي حسب إعداد AI_BACKEND)
+        self.backend = backend or create_backend()
         
-        return translated_results
+    def preprocess_image(self, image):
+        """تجهيز الصورة للتحليل"""
+        # تحويل الصورة إلى المقاس المطلوب
+        image = cv2.resize(image, (INPUT_SIZE, INPUT_SIZE))
+        return image
+    
+    def predict(self, image):
+        """تحليل صورة واحدة وإرجاع الحالات المكتشفة بالعربية مع درجة الثقة"""
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images):
+        """تحليل مجموعة صور في تمريرة واحدة عبر محرك الاستدلال"""
+        # ترجمة النتائج إلى العربية للعرض
+        return [
+            [
+                {
+                    'condition': self.condition_translations[result['condition']],
+                    'confidence': result['confidence']
+                }
+                for result in results
+            ]
+            for results in self.backend.predict_batch(images)
+        ]
     
     def get_recommendations(self, predictions: List[Dict]) -> List[str]:
         """توليد توصيات بناءً على التحليل"""
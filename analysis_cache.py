@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(data, version):
+    """إنشاء مفتاح التخزين المؤقت من محتوى الصورة ونسخة المحلل"""
+    return f"{version}:{hashlib.sha256(data).hexdigest()}"
+
+
+class AnalysisCache:
+    """
+    ذاكرة تخزين مؤقت لنتائج تحليل الصور الخام بطبقتين:
+    طبقة LRU داخل العملية وطبقة SQLite على القرص مشتركة بين عمال gunicorn
+    """
+
+    def __init__(self, path, memory_entries=1024, max_bytes=64 * 1024 * 1024,
+                 max_age=7 * 24 * 3600, evict_every=100):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = self._connection()
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS analysis_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created REAL NOT NULL,
+                        accessed REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS analysis_cache_accessed ON analysis_cache (accessed)")
+
+    def _connection(self):
+        # اتصال منفصل لكل خيط لأن كائنات sqlite3 لا تشارك بين الخيوط
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """إرجاع الدرجات المخزنة أو None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return dict(value)
+                del self._memory[key]
+
+        if self.path:
+            try:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT value, created FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    with conn:
+                        conn.execute("UPDATE analysis_cache SET accessed = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    with self._lock:
+                        self._remember(key, row[1], value)
+                        self.disk_hits += 1
+                    return dict(value)
+            except sqlite3.Error as e:
+                print(f"Error reading analysis cache: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """تخزين الدرجات الخام في الطبقتين"""
+        now = time.time()
+        value = dict(value)
+        with self._lock:
+            self._remember(key, now, value)
+            self.stores += 1
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+
+        if not self.path:
+            return
+        try:
+            payload = json.dumps(value)
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            print(f"Error writing analysis cache: {str(e)}")
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        """حذف العناصر المنتهية الصلاحية ثم الأقدم استخداماً حتى يصبح الحجم ضمن الحد"""
+        if not self.path:
+            return
+        conn = self._connection()
+        removed = 0
+        with conn:
+            cursor = conn.execute("DELETE FROM analysis_cache WHERE created < ?", (time.time() - self.max_age,))
+            removed += cursor.rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # حذف الأقدم استخداماً حتى الوصول إلى 90% من الحد
+                excess = total - int(self.max_bytes * 0.9)
+                cursor = conn.execute("""
+                    DELETE FROM analysis_cache WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, size, SUM(size) OVER (
+                                ORDER BY accessed, key ROWS UNBOUNDED PRECEDING
+                            ) AS running
+                            FROM analysis_cache
+                        ) WHERE running - size < ?
+                    )
+                """, (excess,))
+                removed += cursor.rowcount
+        with self._lock:
+            self.evictions += removed
+
+    def stats(self):
+        """إحصائيات الإصابة والإخفاق"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
@@ -1,10 +1,23 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
+import hashlib
+import json
 import os
+import re
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from dental_analyzer import DentalAnalyzer
+from analysis_cache import AnalysisCache, content_key
+from dicom_loader import load_dicom
+from jobs import JobQueue
+from thumbnails import ThumbnailStore, image_id
+from quality_gate import QualityGate
+from report_renderer import QueueFullError, ReportRenderPool
+from report_store import get_report_store
+from score_handles import ScoreHandleStore
+import metrics
 from patient import Patient
-from report_generator import ReportGenerator
+from report_generator import get_report_generator
 import cv2
 import numpy as np
 
@@ -16,24 +29,217 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['REPORTS_FOLDER'] = 'reports'
+app.config['CACHE_FOLDER'] = 'cache'
+app.config['ANALYSIS_WORKERS'] = int(os.getenv('ANALYSIS_WORKERS', os.cpu_count() or 1))
+app.config['ANALYSIS_MAX_PIXELS'] = int(os.getenv('ANALYSIS_MAX_PIXELS', 0)) or None  # None = الدقة الكاملة
+app.config['ANALYSIS_TILE_SIZE'] = int(os.getenv('ANALYSIS_TILE_SIZE', 0)) or None  # None = بدون تقسيم
+app.config['ANALYSIS_TILE_WORKERS'] = int(os.getenv('ANALYSIS_TILE_WORKERS', 1))
+app.config['ANALYSIS_PROCESSES'] = int(os.getenv('ANALYSIS_PROCESSES', 0))  # 0 = خيوط في نفس العملية
+app.config['QUALITY_GATE'] = os.getenv('QUALITY_GATE', 'flag')  # flag أو reject أو off
+app.config['QUALITY_MIN_SIDE'] = int(os.getenv('QUALITY_MIN_SIDE', 128))
+app.config['QUALITY_MIN_SHARPNESS'] = float(os.getenv('QUALITY_MIN_SHARPNESS', 0.05))
+app.config['QUALITY_MIN_BRIGHTNESS'] = float(os.getenv('QUALITY_MIN_BRIGHTNESS', 25))
+app.config['QUALITY_MAX_BRIGHTNESS'] = float(os.getenv('QUALITY_MAX_BRIGHTNESS', 230))
+app.config['QUALITY_MAX_CLIPPED'] = float(os.getenv('QUALITY_MAX_CLIPPED', 0.6))
+app.config['QUALITY_MIN_COVERAGE'] = float(os.getenv('QUALITY_MIN_COVERAGE', 0.1))
+app.config['ANALYSIS_CACHE_ENTRIES'] = int(os.getenv('ANALYSIS_CACHE_ENTRIES', 1024))
+app.config['ANALYSIS_CACHE_MAX_BYTES'] = int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['ANALYSIS_CACHE_MAX_AGE'] = int(os.getenv('ANALYSIS_CACHE_MAX_AGE', 7 * 24 * 3600))  # بالثواني
+app.config['SCORE_HANDLES_ENTRIES'] = int(os.getenv('SCORE_HANDLES_ENTRIES', 100000))
+app.config['SCORE_HANDLES_MEMORY_ENTRIES'] = int(os.getenv('SCORE_HANDLES_MEMORY_ENTRIES', 4096))
+app.config['SCORE_HANDLES_TTL'] = int(os.getenv('SCORE_HANDLES_TTL', 2 * 3600))  # بالثواني
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', os.cpu_count() or 1))
+app.config['JOB_TTL'] = int(os.getenv('JOB_TTL', 24 * 3600))  # بالثواني
+app.config['REPORT_WORKERS'] = int(os.getenv('REPORT_WORKERS', 2))
+app.config['REPORT_MAX_PENDING'] = int(os.getenv('REPORT_MAX_PENDING', 16))
+app.config['REPORT_TIMEOUT'] = int(os.getenv('REPORT_TIMEOUT', 120))  # بالثواني
+app.config['THUMBNAILS_FOLDER'] = os.getenv('THUMBNAILS_DIR', os.path.join(app.config['CACHE_FOLDER'], 'thumbnails'))
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', os.path.join(app.config['CACHE_FOLDER'], 'metrics'))
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'dcm'}
 
+# أسماء التقارير تنتهي ببصمة المحتوى، لذلك يمكن استخدامها كـ ETag ثابت
+REPORT_DIGEST_PATTERN = re.compile(r'_([0-9a-f]{16})\.pdf$')
+
 # التأكد من وجود المجلدات الضرورية
-for folder in [app.config['UPLOAD_FOLDER'], app.config['REPORTS_FOLDER']]:
+for folder in [app.config['UPLOAD_FOLDER'], app.config['REPORTS_FOLDER'], app.config['CACHE_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
+# لقطات مقاييس الأداء لكل عامل في مجلد مشترك حتى يدمجها /metrics
+metrics.REGISTRY.configure(app.config['METRICS_DIR'])
+
+# ذاكرة التخزين المؤقت لنتائج التحليل (مشتركة بين عمال gunicorn عبر SQLite)
+analysis_cache = AnalysisCache(
+    os.path.join(app.config['CACHE_FOLDER'], 'analysis_cache.sqlite3'),
+    memory_entries=app.config['ANALYSIS_CACHE_ENTRIES'],
+    max_bytes=app.config['ANALYSIS_CACHE_MAX_BYTES'],
+    max_age=app.config['ANALYSIS_CACHE_MAX_AGE']
+)
+
+# معرفات الدرجات الخام لكل صورة محللة (لإعادة الحساب عبر /rescore دون رفع الصور)
+score_store = ScoreHandleStore(
+    os.path.join(app.config['CACHE_FOLDER'], 'score_handles.sqlite3'),
+    memory_entries=app.config['SCORE_HANDLES_MEMORY_ENTRIES'],
+    max_entries=app.config['SCORE_HANDLES_ENTRIES'],
+    ttl=app.config['SCORE_HANDLES_TTL']
+)
+
+# الصور المصغرة التي يتم تضمينها في التقارير
+thumbnail_store = ThumbnailStore(app.config['THUMBNAILS_FOLDER'])
+# حذف الصور المصغرة القديمة في الخلفية (يبدأ مع أول طلب في كل عملية)
+app.before_request(thumbnail_store.start)
+
+# فحص جودة الصور قبل التحليل الكامل (رفض الصور الضبابية أو سيئة الإضاءة أو الخالية من التفاصيل)
+quality_gate = QualityGate(
+    mode=app.config['QUALITY_GATE'],
+    min_side=app.config['QUALITY_MIN_SIDE'],
+    min_sharpness=app.config['QUALITY_MIN_SHARPNESS'],
+    min_brightness=app.config['QUALITY_MIN_BRIGHTNESS'],
+    max_brightness=app.config['QUALITY_MAX_BRIGHTNESS'],
+    max_clipped=app.config['QUALITY_MAX_CLIPPED'],
+    min_coverage=app.config['QUALITY_MIN_COVERAGE']
+)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def patient_from_form(patient_data):
+    """إنشاء كائن المريض من بيانات نموذج الرفع"""
+    try:
+        return Patient(
+            name=patient_data.get('name', ''),
+            age=int(patient_data.get('age', 0)) if patient_data.get('age') else 0,
+            gender=patient_data.get('gender', ''),
+            phone=patient_data.get('phone', ''),
+            email=patient_data.get('email', ''),
+            visit_reasons=patient_data.get('visit_reasons', '').split(',') if patient_data.get('visit_reasons') else [],
+            symptoms=patient_data.get('symptoms', '').split(',') if patient_data.get('symptoms') else [],
+            medical_history=patient_data.get('medical_history', '').split(',') if patient_data.get('medical_history') else []
+        )
+    except Exception as e:
+        print(f"Error creating patient object: {str(e)}")
+        return Patient("", 0, "", "", "")
+
+def patient_from_json(data):
+    """إنشاء كائن المريض من بيانات JSON (القوائم كمصفوفات أو نصوص مفصولة بفواصل)"""
+    def as_list(value):
+        if isinstance(value, str):
+            return value.split(',') if value else []
+        items = list(value or [])
+        if not all(isinstance(item, str) for item in items):
+            raise TypeError('list items must be strings')
+        return items
+
+    return Patient(
+        name=data.get('name', ''),
+        age=int(data.get('age') or 0),
+        gender=data.get('gender', ''),
+        phone=data.get('phone', ''),
+        email=data.get('email', ''),
+        visit_reasons=as_list(data.get('visit_reasons')),
+        symptoms=as_list(data.get('symptoms')),
+        medical_history=as_list(data.get('medical_history'))
+    )
+
+def pdf_response(pdf_bytes, filename):
+    """إرسال PDF من الذاكرة مع ETag و Last-Modified ودعم طلبات Range"""
+    response = Response(pdf_bytes, mimetype='application/pdf')
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    response.set_etag(hashlib.sha256(pdf_bytes).hexdigest())
+    response.last_modified = datetime.now(timezone.utc)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(pdf_bytes))
+
+def create_analyzer():
+    return DentalAnalyzer(
+        max_workers=app.config['ANALYSIS_WORKERS'],
+        max_pixels=app.config['ANALYSIS_MAX_PIXELS'],
+        tile_size=app.config['ANALYSIS_TILE_SIZE'],
+        tile_workers=app.config['ANALYSIS_TILE_WORKERS'],
+        cache=analysis_cache,
+        quality_gate=quality_gate,
+        processes=app.config['ANALYSIS_PROCESSES'],
+        score_store=score_store
+    )
+
+def iter_analysis(uploads, patient, analyzer):
+    """تحليل الملفات المرفوعة وإرجاع (الترتيب، النتيجة) فور اكتمال كل ملف"""
+    pending = []
+    
+    for index, (filename, data) in enumerate(uploads):
+        try:
+            thumbnail_id = image_id(data)
+            
+            # استخدام النتائج المخزنة إذا تم تحليل نفس الصورة من قبل
+            cache_key = content_key(data, analyzer.cache_version)
+            raw_scores = analysis_cache.get(cache_key)
+            if raw_scores is not None:
+                if not thumbnail_store.exists(thumbnail_id):
+                    thumbnail_store.save(thumbnail_id, decode_image(data, filename))
+                analysis_result = analyzer.score_patient(raw_scores, patient)
+                analyzer.attach_score_handle(analysis_result, raw_scores, cache_key)
+                analysis_result['filename'] = filename
+                analysis_result['image_id'] = thumbnail_id
+                analysis_result['image_type'] = 'xray' if filename.lower().endswith('.dcm') else 'normal'
+                yield index, analysis_result
+                continue
+            
+            # قراءة الصورة من الذاكرة مباشرة
+            with metrics.timer('decode'):
+                image = decode_image(data, filename)
+            with metrics.timer('thumbnail'):
+                thumbnail_store.save(thumbnail_id, image)
+            pending.append((index, filename, image, cache_key, thumbnail_id))
+            
+        except Exception as e:
+            print(f"Error processing file {filename}: {str(e)}")
+            yield index, {
+                'filename': filename,
+                'error': str(e),
+                'scores': {},
+                'recommendations': ['حدث خطأ أثناء تحليل هذه الصورة'],
+                'image_type': 'error'
+            }
+    
+    # تحليل الصور بالتوازي مع معلومات المريض
+    batch = analyzer.iter_batch(
+        [image for _, _, image, _, _ in pending],
+        patient,
+        cache_keys=[cache_key for _, _, _, cache_key, _ in pending]
+    )
+    for batch_index, analysis_result in batch:
+        index, filename, _, _, thumbnail_id = pending[batch_index]
+        analysis_result['filename'] = filename
+        analysis_result['image_id'] = thumbnail_id
+        if 'error' in analysis_result:
+            analysis_result['image_type'] = 'error'
+        else:
+            analysis_result['image_type'] = 'xray' if filename.lower().endswith('.dcm') else 'normal'
+        yield index, analysis_result
+
+def analyze_upload(filename, data, patient_data):
+    """تحليل ملف واحد من طابور المهام (نفس خطوات /analyze)"""
+    patient = patient_from_form(patient_data)
+    _, analysis_result = next(iter_analysis([(filename, data)], patient, create_analyzer()))
+    return analysis_result
+
+def decode_image(data, filename):
+    """فك ترميز الصورة المرفوعة من الذاكرة مباشرة دون حفظها في مجلد الرفع"""
+    if filename.lower().endswith('.dcm'):
+        image = load_dicom(data)
+    else:
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+
+    if image is None:
+        raise ValueError("فشل في قراءة الصورة")
+
+    return image
+
 def analyze_image(image_path):
     try:
         # قراءة الصورة
         if image_path.lower().endswith('.dcm'):
-            import pydicom
-            ds = pydicom.dcmread(image_path)
-            image = ds.pixel_array
-            image = ((image - image.min()) * 255.0 / (image.max() - image.min())).astype(np.uint8)
+            image = load_dicom(image_path)
         else:
             image = cv2.imread(image_path)
             
@@ -55,6 +261,30 @@ def analyze_image(image_path):
             'image_type': 'error'
         }
 
+# طابور مهام التحليل غير المتزامن (العمال يبدأون عند أول مهمة في كل عملية)
+job_queue = JobQueue(
+    os.path.join(app.config['CACHE_FOLDER'], 'jobs.sqlite3'),
+    analyze_upload,
+    workers=app.config['JOB_WORKERS'],
+    ttl=app.config['JOB_TTL']
+)
+
+# ترجمة قالب تقرير HTML مرة واحدة عند بدء العملية (Jinja يحتفظ بالقالب المترجم)
+app.jinja_env.get_template('report_template.html')
+
+# مخزن ملفات التقارير (الحذف الدوري يبدأ مع أول طلب في كل عملية)
+report_store = get_report_store(app.config['REPORTS_FOLDER'])
+app.before_request(report_store.start)
+
+# مجمع عمليات إنشاء التقارير في الخلفية (ينشأ عند أول طلب في كل عملية)
+report_pool = ReportRenderPool(
+    app.config['REPORTS_FOLDER'],
+    os.path.join(app.config['CACHE_FOLDER'], 'report_tickets'),
+    workers=app.config['REPORT_WORKERS'],
+    max_pending=app.config['REPORT_MAX_PENDING'],
+    timeout=app.config['REPORT_TIMEOUT']
+)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -71,98 +301,146 @@ def analyze():
     # استخراج معلومات المريض من الطلب
     patient_data = request.form.to_dict()
     
-    try:
-        patient = Patient(
-            name=patient_data.get('name', ''),
-            age=int(patient_data.get('age', 0)) if patient_data.get('age') else 0,
-            gender=patient_data.get('gender', ''),
-            phone=patient_data.get('phone', ''),
-            email=patient_data.get('email', ''),
-            visit_reasons=patient_data.get('visit_reasons', '').split(',') if patient_data.get('visit_reasons') else [],
-            symptoms=patient_data.get('symptoms', '').split(',') if patient_data.get('symptoms') else [],
-            medical_history=patient_data.get('medical_history', '').split(',') if patient_data.get('medical_history') else []
-        )
-    except Exception as e:
-        print(f"Error creating patient object: {str(e)}")
-        patient = Patient("", 0, "", "", "")
+    # قراءة الملفات المسموح بها من الطلب
+    uploads = [
+        (secure_filename(file.filename), file.read())
+        for file in files if file and allowed_file(file.filename)
+    ]
+    
+    # وضع المهام غير المتزامنة: إضافة الصور إلى الطابور وإرجاع معرف المهمة
+    if request.args.get('async') in ('1', 'true'):
+        job_id = job_queue.submit(uploads, patient_data)
+        return jsonify({'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    
+    patient = patient_from_form(patient_data)
+    analyzer = create_analyzer()
+    
+    # وضع البث: إرسال نتيجة كل صورة كسطر JSON فور اكتمالها (NDJSON)
+    if request.args.get('stream') in ('1', 'true'):
+        def generate():
+            yield json.dumps({'total': len(uploads)}) + '\n'
+            for index, analysis_result in iter_analysis(uploads, patient, analyzer):
+                yield json.dumps({'index': index, 'result': analysis_result}) + '\n'
+        
+        return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    
+    results = [None] * len(uploads)
+    for index, analysis_result in iter_analysis(uploads, patient, analyzer):
+        results[index] = analysis_result
 
-    results = []
-    analyzer = DentalAnalyzer()
+    return jsonify({'results': results})
+
+@app.route('/rescore', methods=['POST'])
+def rescore():
+    """إعادة حساب الدرجات والتوصيات لصور محللة سابقاً بمعلومات مريض جديدة (دون رفع الصور)"""
+    data = request.get_json(silent=True)
+    handles = data.get('handles') if isinstance(data, dict) else None
+    if not isinstance(handles, list) or not handles or not all(isinstance(handle, str) for handle in handles):
+        return jsonify({'error': 'يجب إرسال قائمة معرفات الدرجات (handles)'}), 400
     
-    for file in files:
-        if file and allowed_file(file.filename):
-            try:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                
-                # قراءة الصورة
-                if filepath.lower().endswith('.dcm'):
-                    import pydicom
-                    ds = pydicom.dcmread(filepath)
-                    image = ds.pixel_array
-                    image = ((image - image.min()) * 255.0 / (image.max() - image.min())).astype(np.uint8)
-                else:
-                    image = cv2.imread(filepath)
-                
-                if image is None:
-                    raise ValueError("فشل في قراءة الصورة")
-                
-                # تحليل الصورة مع معلومات المريض
-                analysis_result = analyzer.analyze_image_and_symptoms(image, patient)
-                analysis_result['filename'] = filename
-                analysis_result['image_type'] = 'xray' if filepath.lower().endswith('.dcm') else 'normal'
-                
-                results.append(analysis_result)
-                
-            except Exception as e:
-                print(f"Error processing file {file.filename}: {str(e)}")
+    try:
+        patient_data = data.get('patient', data)
+        if not isinstance(patient_data, dict):
+            raise TypeError('patient must be a JSON object')
+        patient = patient_from_json(patient_data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'معلومات المريض غير صالحة: {str(e)}'}), 400
+    
+    with metrics.timer('rescore'):
+        raw_scores = score_store.get_many(handles)
+        found = [raw for raw in raw_scores if raw is not None]
+        if found:
+            analyzer = create_analyzer()
+            adjusted, recommendations = analyzer.rescore(found, [patient] * len(found))
+            rescored = iter(zip(adjusted, recommendations))
+        
+        results = []
+        for handle, raw in zip(handles, raw_scores):
+            if raw is None:
+                # المعرف منتهي الصلاحية أو غير موجود: يجب رفع الصورة مرة أخرى
                 results.append({
-                    'filename': file.filename,
-                    'error': str(e),
-                    'scores': {},
-                    'recommendations': ['حدث خطأ أثناء تحليل هذه الصورة'],
-                    'image_type': 'error'
+                    'score_handle': handle,
+                    'error': 'انتهت صلاحية نتيجة التحليل، يرجى رفع الصورة مرة أخرى',
+                    'expired': True
                 })
-            finally:
-                # تنظيف الملف المؤقت
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                    except:
-                        pass
-
+                continue
+            row, row_recommendations = next(rescored)
+            results.append({
+                'score_handle': handle,
+                'scores': analyzer.rules.to_scores(row),
+                'recommendations': row_recommendations
+            })
+    
     return jsonify({'results': results})
 
+@app.route('/score_handles/stats')
+def score_handles_stats():
+    return jsonify(score_store.stats())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'المهمة غير موجودة'}), 404
+    return jsonify(status)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.exposition(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/analysis_cache/stats')
+def analysis_cache_stats():
+    return jsonify(analysis_cache.stats())
+
+@app.route('/reports/stats')
+def report_store_stats():
+    return jsonify(report_store.stats())
+
+@app.route('/thumbnails/stats')
+def thumbnail_store_stats():
+    return jsonify(thumbnail_store.stats())
+
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
     try:
         data = request.get_json()
         
-        # إنشاء كائن المريض
-        patient = Patient(
-            name=data['name'],
-            age=int(data['age']),
-            gender=data['gender'],
-            phone=data['phone'],
-            email=data.get('email', ''),
-            visit_reasons=data.get('visit_reasons', []),
-            symptoms=data.get('symptoms', []),
-            medical_history=data.get('medical_history', [])
-        )
+        # تقرير HTML: المتصفح يتولى تشكيل النص العربي واتجاهه، ولا حاجة لإنشاء PDF
+        if request.args.get('format') == 'html':
+            with metrics.timer('report_html'):
+                html = render_template(
+                    'report_template.html',
+                    patient=data,
+                    analysis_results=data.get('analysis_results', []),
+                    report_date=datetime.now().strftime('%Y-%m-%d %H:%M'),
+                    current_year=datetime.now().year
+                )
+            return html
         
-        # إضافة التشخيص وخطة العلاج والملاحظات
-        if data.get('diagnosis'):
-            patient.add_diagnosis(data['diagnosis'])
+        # الوضع غير المتزامن: إرسال التقرير إلى مجمع العمليات وإرجاع رقم التذكرة
+        if request.args.get('async') in ('1', 'true'):
+            try:
+                ticket = report_pool.submit(data)
+            except QueueFullError as e:
+                return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
+            return jsonify({'success': True, 'ticket': ticket, 'status_url': f'/report_jobs/{ticket}'}), 202
         
-        if data.get('treatment_plan'):
-            patient.add_treatment_plan(data['treatment_plan'])
-            
-        if data.get('future_notes'):
-            patient.add_future_note(data['future_notes'])
+        # إنشاء كائن المريض
+        patient = Patient.from_report_data(data)
         
         # إنشاء التقرير
-        report_generator = ReportGenerator()
+        report_generator = get_report_generator()
+        
+        # وضع الذاكرة: إرجاع ملف PDF مباشرة دون حفظه على القرص
+        if request.args.get('inline') in ('1', 'true'):
+            pdf_bytes = report_generator.render_report(
+                patient=patient,
+                analysis_results=data.get('analysis_results', [])
+            )
+            if not pdf_bytes:
+                raise ValueError("فشل في إنشاء التقرير")
+            return pdf_response(pdf_bytes, report_generator.report_filename(pdf_bytes))
+        
         report_filename = report_generator.generate_report(
             patient=patient,
             analysis_results=data.get('analysis_results', []),
@@ -184,11 +462,48 @@ def generate_report():
             'error': f'حدث خطأ أثناء إنشاء التقرير: {str(e)}'
         }), 500
 
+@app.route('/report_jobs/<ticket>')
+def report_job_status(ticket):
+    state = report_pool.status(ticket)
+    if state is None:
+        return jsonify({'error': 'التذكرة غير موجودة'}), 404
+    
+    response = {'ticket': ticket, 'status': state['status']}
+    if state['status'] == 'done':
+        response['report_url'] = f'/download_report/{state["filename"]}'
+        response['download_url'] = f'/report_jobs/{ticket}/download'
+    elif state['status'] == 'error':
+        response['error'] = state['error']
+    return jsonify(response)
+
+@app.route('/report_jobs/<ticket>/download')
+def report_job_download(ticket):
+    state = report_pool.status(ticket)
+    if state is None:
+        return jsonify({'error': 'التذكرة غير موجودة'}), 404
+    if state['status'] == 'error':
+        return jsonify({'error': state['error']}), 500
+    if state['status'] != 'done':
+        # التقرير لم يجهز بعد
+        return jsonify({'ticket': ticket, 'status': state['status']}), 202, {'Retry-After': '1'}
+    return download_report(state['filename'])
+
 @app.route('/download_report/<filename>')
 def download_report(filename):
-    return send_file(
-        os.path.join(app.config['REPORTS_FOLDER'], filename),
-        as_attachment=True
+    # البحث في فهرس التقارير عن المجلد الفرعي للملف
+    path = report_store.lookup(filename)
+    if path is None:
+        return jsonify({'error': 'التقرير غير موجود'}), 404
+    
+    # التقارير ذات البصمة لا تتغير أبداً، لذلك يمكن تخزينها مؤقتاً لدى العميل والوسطاء
+    digest = REPORT_DIGEST_PATTERN.search(filename)
+    return send_from_directory(
+        app.config['REPORTS_FOLDER'],
+        path,
+        as_attachment=True,
+        conditional=True,
+        etag=digest.group(1) if digest else True,
+        max_age=365 * 24 * 3600 if digest else None
     )
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+"""
+إنشاء تقارير PDF لدفعة من الزيارات دون تشغيل الخادم
+
+كل سطر في ملف الإدخال كائن JSON بنفس شكل طلب /generate_report، ويمكن أن يحتوي على
+الحقل 'clinic' لتجميع التقارير في ملف واحد لكل عيادة عند استخدام --merge.
+
+الاستخدام:
+    python batch_reports.py visits.jsonl                     # ملف PDF لكل زيارة في مجلد reports
+    python batch_reports.py visits.jsonl --merge             # ملف PDF مدمج لكل عيادة
+    python batch_reports.py visits.jsonl --workers 8 -o out  # تحديد عدد العمليات ومجلد الإخراج
+
+يتم حفظ السجلات المكتملة في ملف نقطة استئناف، وإعادة تشغيل نفس الأمر بعد فشل
+أو إيقاف تتخطى ما تم إنشاؤه سابقاً (استخدم --restart للبدء من جديد).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from werkzeug.utils import secure_filename
+
+import report_generator
+from patient import Patient
+
+DEFAULT_CLINIC = 'default'
+CHECKPOINT_NAME = '.batch_checkpoint.jsonl'
+
+
+def read_records(path):
+    """قراءة سجلات الإدخال مع مفتاح ثابت لكل سجل (رقم السطر وبصمة محتواه)"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            digest = hashlib.sha256(line.encode('utf-8')).hexdigest()[:16]
+            key = f'{line_number}:{digest}'
+            try:
+                records.append((key, json.loads(line)))
+            except ValueError as e:
+                records.append((key, {'_error': f'سطر JSON غير صالح: {str(e)}'}))
+    return records
+
+
+def read_checkpoint(path):
+    """مفاتيح الوحدات المكتملة في تشغيل سابق"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # سطر غير مكتمل من تشغيل توقف أثناء الكتابة
+                continue
+            done.add(entry['key'])
+    return done
+
+
+def render_record(record, output_dir):
+    """إنشاء تقرير زيارة واحدة وإرجاع اسم الملف (يعمل داخل عمليات المجمع)"""
+    if '_error' in record:
+        raise ValueError(record['_error'])
+    patient = Patient.from_report_data(record)
+    output_path = report_generator.get_report_generator().generate_report(
+        patient=patient,
+        analysis_results=record.get('analysis_results', []),
+        output_dir=output_dir
+    )
+    if not output_path:
+        raise ValueError("فشل في إنشاء التقرير")
+    return os.path.basename(output_path)
+
+
+def render_clinic(clinic, records, output_dir):
+    """دمج تقارير زيارات عيادة واحدة في ملف PDF واحد وإرجاع اسمه"""
+    reports = [(Patient.from_report_data(record), record.get('analysis_results', [])) for record in records]
+
+    pdf_bytes = report_generator.get_report_generator().render_reports(reports)
+    if pdf_bytes is None:
+        raise ValueError("فشل في إنشاء التقرير المدمج")
+
+    # secure_filename يحذف الحروف العربية، لذلك تضاف بصمة الاسم لتمييز العيادات
+    name_digest = hashlib.sha256(clinic.encode('utf-8')).hexdigest()[:8]
+    safe_name = secure_filename(clinic)
+    prefix = f'clinic_{safe_name}_{name_digest}' if safe_name else f'clinic_{name_digest}'
+    filename = f"{prefix}_{time.strftime('%Y%m%d')}.pdf"
+    output_path = os.path.join(output_dir, filename)
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(temp_path, output_path)
+    return filename
+
+
+def build_units(records, merge):
+    """
+    وحدات العمل: سجل واحد لكل وحدة، أو كل سجلات العيادة في وحدة واحدة عند الدمج
+    كل وحدة (المفتاح، الدالة، المعاملات، عدد التقارير)
+    """
+    if not merge:
+        return [(key, render_record, (record,), 1) for key, record in records]
+
+    units = []
+    clinics = {}
+    for key, record in records:
+        if '_error' in record:
+            # السطر التالف يفشل وحده دون أن يمنع إنشاء ملف العيادة
+            units.append((key, render_record, (record,), 1))
+            continue
+        clinic = str(record.get('clinic') or DEFAULT_CLINIC)
+        clinics.setdefault(clinic, []).append((key, record))
+
+    for clinic, entries in clinics.items():
+        # مفتاح العيادة يتغير إذا تغيرت سجلاتها، فيعاد إنشاء الملف المدمج
+        digest = hashlib.sha256('\n'.join(key for key, _ in entries).encode('utf-8')).hexdigest()[:16]
+        units.append((f'clinic:{clinic}:{digest}', render_clinic, (clinic, [record for _, record in entries]), len(entries)))
+    return units
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='إنشاء تقارير PDF لدفعة من الزيارات')
+    parser.add_argument('input', help='ملف JSONL بسجلات المرضى ونتائج التحليل')
+    parser.add_argument('-o', '--output-dir', default='reports', help='مجلد حفظ التقارير')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='عدد عمليات الإنشاء')
+    parser.add_argument('--merge', action='store_true', help='ملف PDF واحد لكل عيادة (حسب الحقل clinic)')
+    parser.add_argument('--checkpoint', help=f'ملف نقطة الاستئناف (الافتراضي {CHECKPOINT_NAME} في مجلد الإخراج)')
+    parser.add_argument('--restart', action='store_true', help='تجاهل نقطة الاستئناف والبدء من جديد')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.output_dir, CHECKPOINT_NAME)
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    records = read_records(args.input)
+    done = read_checkpoint(checkpoint_path)
+    units = build_units(records, args.merge)
+    pending = [unit for unit in units if unit[0] not in done]
+    skipped = len(units) - len(pending)
+
+    print(f"{len(records)} سجل، {len(units)} وحدة، {skipped} مكتملة سابقاً، {len(pending)} للإنشاء باستخدام {args.workers} عملية")
+
+    start = time.perf_counter()
+    rendered = failed = reports = 0
+    if pending:
+        # كل عملية تحمل الخطوط والأنماط مرة واحدة عند بدئها
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=report_generator.warm_up) as executor, \
+                open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            futures = {
+                executor.submit(func, *func_args, args.output_dir): (key, count)
+                for key, func, func_args, count in pending
+            }
+            for future in as_completed(futures):
+                key, count = futures[future]
+                try:
+                    filename = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Error rendering {key}: {str(e)}")
+                else:
+                    rendered += 1
+                    reports += count
+                    checkpoint.write(json.dumps({'key': key, 'filename': filename}) + '\n')
+                    checkpoint.flush()
+
+                completed = rendered + failed
+                if completed % 50 == 0 or completed == len(pending):
+                    elapsed = time.perf_counter() - start
+                    print(f"[{completed}/{len(pending)}] {reports / elapsed:.1f} تقرير/ثانية")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nتم إنشاء {rendered} ملف ({reports} تقرير) في {elapsed:.1f} ثانية، فشل {failed}، تم تخطي {skipped}")
+    if failed:
+        print("أعد تشغيل نفس الأمر لإعادة محاولة السجلات الفاشلة فقط")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
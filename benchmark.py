@@ -0,0 +1,437 @@
+"""
+قياس أداء مسارات التحليل وقراءة DICOM وإنشاء التقارير
+
+الاستخدام:
+    python benchmark.py                              # تشغيل كل القياسات وطباعة النتائج
+    python benchmark.py --save-baseline              # حفظ النتائج كخط أساس
+    python benchmark.py --compare                    # مقارنة التشغيل الحالي بخط الأساس
+    python benchmark.py --only analyze_image --quick # تشغيل جزء من القياسات بأحجام صغيرة
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from ai_model import DentalAIModel, HeuristicBackend, OnnxBackend
+from analysis_cache import AnalysisCache
+from dental_analyzer import DentalAnalyzer
+from dicom_loader import load_dicom, to_uint8
+from patient import Patient
+from report_generator import get_report_generator
+from report_store import get_report_store
+from score_handles import ScoreHandleStore
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+MEGAPIXELS = [1, 5, 12, 20]
+QUICK_MEGAPIXELS = [1, 5]
+
+
+def synthetic_image(megapixels, seed=0, channels=3):
+    """صورة تركيبية تشبه صور الفم (تدرجات ودوائر فاتحة على خلفية مشوشة)"""
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+
+    small = (rng.random((max(height // 16, 1), max(width // 16, 1), channels)) * 255).astype(np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = image.reshape(height, width, channels)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(width // 60 + 1, width // 10 + 2))
+        color = tuple(int(c) for c in rng.integers(150, 255, size=channels))
+        cv2.circle(image, center, radius, color, -1)
+    noise = rng.integers(0, 12, size=image.shape, dtype=np.uint8)
+    cv2.add(image, noise, dst=image)
+    return image if channels > 1 else image[:, :, 0]
+
+
+def synthetic_dicom(megapixels, bits=16, seed=0):
+    """ملف DICOM تركيبي أحادي اللون بعمق 8 أو 16 بت"""
+    image = synthetic_image(megapixels, seed=seed, channels=1)
+    if bits == 16:
+        pixels = image.astype(np.uint16) * 16
+    else:
+        pixels = image
+
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = pixels.shape
+    ds.BitsAllocated = bits
+    ds.BitsStored = 12 if bits == 16 else 8
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = 0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    if bits == 16:
+        ds.WindowCenter = 2048
+        ds.WindowWidth = 4096
+    ds.PixelData = pixels.tobytes()
+
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, ds, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def synthetic_patient(items=40):
+    """مريض بقوائم أعراض وتاريخ طبي طويلة"""
+    patient = Patient(
+        name="مريض تجريبي للقياس",
+        age=45,
+        gender="ذكر",
+        phone="0500000000",
+        email="bench@example.com",
+        visit_reasons=[f"ألم في السن رقم {i}" for i in range(items)],
+        symptoms=["ألم", "نزيف", "حساسية", "تورم", "رائحة", "تغير لون"] * (items // 6 + 1),
+        medical_history=[f"حالة مرضية سابقة رقم {i}" for i in range(items)]
+    )
+    patient.add_diagnosis("تسوس عميق في الضرس العلوي الأيمن، والتهاب في اللثة المحيطة")
+    patient.add_treatment_plan("1. حشو الضرس المتسوس\n2. تنظيف وتلميع الأسنان\n3. علاج اللثة بالليزر")
+    patient.add_future_note("متابعة حالة اللثة بعد أسبوعين")
+    return patient
+
+
+def synthetic_results(count=12):
+    """نتائج تحليل تركيبية بنفس شكل استجابة /analyze"""
+    analyzer = DentalAnalyzer()
+    results = []
+    for index in range(count):
+        scores = {condition: ((index * 7 + offset * 13) % 100) / 100.0
+                  for offset, condition in enumerate(analyzer.conditions)}
+        results.append({
+            'filename': f'image_{index:03d}.jpg',
+            'image_type': 'xray' if index % 3 == 0 else 'normal',
+            'scores': scores,
+            'recommendations': analyzer._generate_basic_recommendations(scores)
+        })
+    return results
+
+
+def measure(func, repeat, warmup=1, items=1):
+    """
+    تشغيل func عدة مرات وإرجاع زمن p50/p95 والإنتاجية وذروة الذاكرة
+    الأزمنة تقاس دون tracemalloc (يبطئ الشيفرة المكتوبة بـ Python)، والذاكرة في تشغيل منفصل
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    p50 = statistics.median(timings)
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    return {
+        'runs': repeat,
+        'p50_ms': p50 * 1000,
+        'p95_ms': p95 * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'throughput_per_s': items / p50 if p50 else 0.0,
+        'peak_mb': peak / (1024 * 1024)
+    }
+
+
+# بيانات القياس المشتركة تنشأ عند أول قياس يحتاجها فقط
+@lru_cache(maxsize=None)
+def _image(megapixels):
+    return synthetic_image(megapixels, seed=megapixels)
+
+
+@lru_cache(maxsize=None)
+def _analyzer():
+    return DentalAnalyzer(max_workers=1)
+
+
+@lru_cache(maxsize=None)
+def _model_batch():
+    model = DentalAIModel(HeuristicBackend())
+    return [model.preprocess_image(synthetic_image(1, seed=seed)) for seed in range(16)]
+
+
+@lru_cache(maxsize=None)
+def _dicom(bits, quick):
+    data = synthetic_dicom(4 if quick else 12, bits=bits, seed=bits)
+    ds = pydicom.dcmread(io.BytesIO(data))
+    return data, ds, ds.pixel_array
+
+
+@lru_cache(maxsize=None)
+def _output_dir():
+    # تعطيل إعادة استخدام التقارير المتطابقة حتى يقيس كل استدعاء إنشاء التقرير الكامل
+    output_dir = tempfile.mkdtemp(prefix='dental_bench_')
+    get_report_store(output_dir).cache_entries = 0
+    return output_dir
+
+
+def build_benchmarks(quick=False):
+    """
+    قائمة (الاسم، دالة التجهيز): التجهيز يتم فقط للقياسات المختارة
+    دالة التجهيز ترجع (الدالة المقاسة، عدد العناصر لكل استدعاء)
+    """
+    benchmarks = []
+    megapixels = QUICK_MEGAPIXELS if quick else MEGAPIXELS
+
+    for mp in megapixels:
+        def decode_jpeg(mp=mp):
+            jpeg = cv2.imencode('.jpg', _image(mp), [cv2.IMWRITE_JPEG_QUALITY, 90])[1]
+            return lambda: cv2.imdecode(jpeg, cv2.IMREAD_COLOR), 1
+
+        def decode_png(mp=mp):
+            png = cv2.imencode('.png', _image(mp))[1]
+            return lambda: cv2.imdecode(png, cv2.IMREAD_COLOR), 1
+
+        def analyze_image(mp=mp):
+            image, analyzer = _image(mp), _analyzer()
+            return lambda: analyzer.analyze_image(image), 1
+
+        benchmarks.append((f'decode_jpeg_{mp}mp', decode_jpeg))
+        benchmarks.append((f'decode_png_{mp}mp', decode_png))
+        benchmarks.append((f'analyze_image_{mp}mp', analyze_image))
+
+    def ai_predict():
+        model, batch = DentalAIModel(HeuristicBackend()), _model_batch()
+        return lambda: [model.predict(i) for i in batch], len(batch)
+
+    def ai_predict_batch():
+        model, stack = DentalAIModel(HeuristicBackend()), np.stack(_model_batch())
+        return lambda: model.predict_batch(stack), len(stack)
+
+    benchmarks.append(('ai_predict_224', ai_predict))
+    benchmarks.append(('ai_predict_batch_224', ai_predict_batch))
+
+    # محرك onnx اختياري: يقاس فقط إذا كانت الحزمة مثبتة
+    if importlib.util.find_spec('onnxruntime') is not None:
+        for quantized in (False, True):
+            def ai_predict_onnx(quantized=quantized):
+                model, batch = DentalAIModel(OnnxBackend(quantized=quantized)), _model_batch()
+                return lambda: model.predict_batch(batch), len(batch)
+
+            name = 'ai_predict_onnx_int8_batch' if quantized else 'ai_predict_onnx_batch'
+            benchmarks.append((name, ai_predict_onnx))
+
+    # إعادة حساب الدرجات والتوصيات لسجلات سابقة بعد تغيير القواعد
+    records = 10000 if quick else 100000
+
+    def rescore():
+        analyzer = _analyzer()
+        scores = [result['scores'] for result in synthetic_results(100)]
+        raw = np.tile(analyzer.rules.to_matrix(scores), (records // len(scores), 1))
+        patients = [synthetic_patient(items) for items in (0, 1, 2, 3, 6)] * (records // 5)
+        return lambda: analyzer.rescore(raw, patients), records
+
+    benchmarks.append((f'rescore_{records}_records', rescore))
+
+    for bits in (8, 16):
+        def dicom_load(bits=bits):
+            data = _dicom(bits, quick)[0]
+            return lambda: load_dicom(data), 1
+
+        def dicom_normalize(bits=bits):
+            _, ds, pixels = _dicom(bits, quick)
+            return lambda: to_uint8(pixels, ds), 1
+
+        benchmarks.append((f'dicom_load_{bits}bit', dicom_load))
+        benchmarks.append((f'dicom_normalize_{bits}bit', dicom_normalize))
+
+    for count in (1, 12):
+        def generate_report(count=count):
+            patient, results, output_dir = synthetic_patient(), synthetic_results(count), _output_dir()
+            return lambda: get_report_generator().generate_report(patient, results, output_dir), 1
+
+        benchmarks.append((f'generate_report_{count}_images', generate_report))
+
+    benchmarks.extend(build_endpoint_benchmarks(quick))
+    return benchmarks
+
+
+@lru_cache(maxsize=None)
+def _endpoint_client():
+    """عميل الاختبار في Flask (استيراد التطبيق يتم فقط عند قياس المسارات)"""
+    import app as app_module
+
+    # تعطيل ذاكرة التخزين المؤقت حتى يقيس كل طلب التحليل وإنشاء التقرير الكامل
+    app_module.analysis_cache = AnalysisCache(None, memory_entries=0)
+    app_module.score_store = ScoreHandleStore(None)
+    app_module.app.config['REPORTS_FOLDER'] = _output_dir()
+    return app_module.app.test_client()
+
+
+def build_endpoint_benchmarks(quick=False):
+    """قياس /analyze و /rescore و /generate_report من خلال عميل الاختبار في Flask"""
+    mp = 1 if quick else 5
+
+    def post_analyze_factory():
+        client = _endpoint_client()
+        uploads = [
+            cv2.imencode('.jpg', synthetic_image(mp, seed=100 + index), [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+            for index in range(4)
+        ]
+
+        def post_analyze():
+            data = {
+                'images[]': [(io.BytesIO(upload), f'image_{index}.jpg') for index, upload in enumerate(uploads)],
+                'age': '45',
+                'symptoms': 'ألم,نزيف',
+                'visit_reasons': 'ألم'
+            }
+            response = client.post('/analyze', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200, response.status_code
+            return response.get_json()['results']
+
+        return post_analyze, len(uploads)
+
+    def analyze():
+        return post_analyze_factory()
+
+    def rescore():
+        # إعادة الحساب بمعلومات مريض جديدة لنتائج تحليل سابق
+        client = _endpoint_client()
+        post_analyze, _ = post_analyze_factory()
+        payload = {
+            'handles': [result['score_handle'] for result in post_analyze()],
+            'age': 70,
+            'symptoms': ['نزيف', 'رائحة'],
+            'visit_reasons': ['ألم شديد', 'نزيف']
+        }
+
+        def post_rescore():
+            response = client.post('/rescore', json=payload)
+            assert response.status_code == 200, response.status_code
+
+        return post_rescore, len(payload['handles'])
+
+    def generate_report():
+        client = _endpoint_client()
+        patient = synthetic_patient()
+        payload = {
+            'name': patient.name,
+            'age': patient.age,
+            'gender': patient.gender,
+            'phone': patient.phone,
+            'email': patient.email,
+            'visit_reasons': patient.visit_reasons,
+            'symptoms': patient.symptoms,
+            'medical_history': patient.medical_history,
+            'diagnosis': 'تسوس عميق',
+            'treatment_plan': 'حشو الضرس',
+            'future_notes': 'متابعة بعد أسبوعين',
+            'analysis_results': synthetic_results(12)
+        }
+
+        def post_report():
+            response = client.post('/generate_report', json=payload)
+            assert response.status_code == 200, response.status_code
+
+        return post_report, 1
+
+    return [
+        (f'endpoint_analyze_4x{mp}mp', analyze),
+        ('endpoint_rescore_4_images', rescore),
+        ('endpoint_generate_report_12_images', generate_report)
+    ]
+
+
+def compare(results, baseline, threshold):
+    """مقارنة p50 مع خط الأساس وإرجاع قائمة التراجعات"""
+    regressions = []
+    print(f"\n{'benchmark':40s} {'baseline':>12s} {'current':>12s} {'change':>9s}")
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            print(f"{name:40s} {'-':>12s} {current['p50_ms']:10.2f}ms {'new':>9s}")
+            continue
+        change = (current['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] if previous['p50_ms'] else 0.0
+        flag = ' !' if change > threshold else ''
+        print(f"{name:40s} {previous['p50_ms']:10.2f}ms {current['p50_ms']:10.2f}ms {change:+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='قياس أداء تطبيق تحليل الأسنان')
+    parser.add_argument('--repeat', type=int, default=5, help='عدد مرات التشغيل لكل قياس')
+    parser.add_argument('--quick', action='store_true', help='استخدام أحجام صغيرة فقط')
+    parser.add_argument('--only', default='', help='تشغيل القياسات التي يحتوي اسمها على هذا النص فقط')
+    parser.add_argument('--output', help='حفظ نتائج هذا التشغيل في ملف JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='ملف خط الأساس')
+    parser.add_argument('--save-baseline', action='store_true', help='حفظ النتائج كخط أساس')
+    parser.add_argument('--compare', action='store_true', help='المقارنة مع خط الأساس')
+    parser.add_argument('--threshold', type=float, default=0.10, help='نسبة التراجع المسموح بها في p50')
+    args = parser.parse_args(argv)
+
+    # التطبيق يستخدم مسارات نسبية لمجلدات الرفع والتخزين المؤقت
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'benchmarks': {}
+    }
+
+    for name, setup in build_benchmarks(quick=args.quick):
+        if args.only and args.only not in name:
+            continue
+        func, items = setup()
+        stats = measure(func, args.repeat, items=items)
+        results['benchmarks'][name] = stats
+        print(f"{name:40s} p50 {stats['p50_ms']:9.2f}ms  p95 {stats['p95_ms']:9.2f}ms  "
+              f"{stats['throughput_per_s']:8.2f}/s  peak {stats['peak_mb']:8.1f}MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nتم حفظ خط الأساس في: {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"لا يوجد خط أساس في: {args.baseline}")
+            return 2
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nتراجع في الأداء: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
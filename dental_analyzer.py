@@ -1,8 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import cv2
 import numpy as np
+from image_transport import attach, get_image_pool
+import metrics
+from metrics import timer
+from scoring_rules import get_rule_table
+from tiled_analysis import LAPLACIAN_OFFSET, extract_features_tiled, histogram, histogram_std
+
+# نسخة المحلل، يجب زيادتها عند أي تغيير في طريقة حساب الدرجات الخام
+# لأنها جزء من مفتاح ذاكرة التخزين المؤقت للنتائج
+ANALYZER_VERSION = '1'
+
+# مجمع خيوط مشترك لتحليل مجموعات الصور (يعاد استخدامه بين الطلبات)
+# دوال OpenCV تحرر قفل المفسر لذلك تعمل الخيوط على جميع الأنوية
+_executors = {}
+_executors_lock = threading.Lock()
+
+def _get_executor(max_workers, name='dental-analyzer'):
+    # مجمع منفصل لكل اسم حتى لا تنتظر مهام مجمع ما مهام فرعية في نفس المجمع
+    with _executors_lock:
+        executor = _executors.get((name, max_workers))
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            _executors[(name, max_workers)] = executor
+        return executor
+
+# مجمع عمليات للتحليل (اختياري): الصور تنقل عبر الذاكرة المشتركة والنتائج فقط تعود
+_process_executors = {}
+
+def _get_process_executor(processes):
+    # مجمع لكل عملية، و spawn يتجنب نسخ خيوط العامل الحالي
+    with _executors_lock:
+        key = (os.getpid(), processes)
+        executor = _process_executors.get(key)
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=metrics.configure_worker,
+                initargs=(metrics.REGISTRY.directory,)
+            )
+            _process_executors[key] = executor
+        return executor
+
+def _discard_process_executor(executor):
+    # توقفت إحدى العمليات بشكل مفاجئ: إنشاء مجمع جديد عند الطلب التالي
+    with _executors_lock:
+        for key, value in list(_process_executors.items()):
+            if value is executor:
+                del _process_executors[key]
+
+def _analyze_shared(descriptor, options):
+    """تحليل صورة من الذاكرة المشتركة داخل عملية المجمع (يرجع الدرجات دون بيانات الصورة)"""
+    return DentalAnalyzer(max_workers=1, **options).analyze_image(attach(descriptor))
 
 class DentalAnalyzer:
-    def __init__(self):
+    def __init__(self, max_workers=None, max_pixels=None, cache=None, tile_size=None, tile_workers=1,
+                 quality_gate=None, processes=0, rules=None, score_store=None):
+        # عدد العمال المستخدم في تحليل مجموعة الصور
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # الحد الأقصى لعدد البكسلات أثناء التحليل (None = الدقة الكاملة)
+        self.max_pixels = max_pixels
+        # تحليل الصور الأكبر من هذا الحجم على شكل مربعات (None = الصورة كاملة دائماً)
+        # النتائج مطابقة تماماً للتحليل الكامل لذلك لا يدخل في نسخة التخزين المؤقت
+        self.tile_size = tile_size
+        # عدد الخيوط لمعالجة مربعات الصورة الواحدة
+        self.tile_workers = tile_workers
+        # ذاكرة التخزين المؤقت للدرجات الخام (اختيارية)
+        self.cache = cache
+        # فحص جودة الصورة قبل التحليل الكامل (اختياري)
+        self.quality_gate = quality_gate
+        # عدد عمليات التحليل (0 = خيوط في نفس العملية)
+        self.processes = processes
+        # جدول قواعد تعديل الدرجات والتوصيات (من SCORING_RULES_PATH افتراضياً)
+        self.rules = rules or get_rule_table()
+        # مخزن الدرجات الخام لإعادة حسابها بمعرف دون رفع الصور (None = بدون معرفات)
+        self.score_store = score_store
+        
         self.conditions = {
             'cavity': 'تسوس',
             'gum_inflammation': 'التهاب لثة',
@@ -11,97 +89,197 @@ class DentalAnalyzer:
             'sensitivity': 'حساسية الأسنان',
             'overall_health': 'الصحة العامة'
         }
-        
-        self.symptom_conditions = {
-            'ألم': ['cavity', 'sensitivity'],
-            'نزيف': ['gum_inflammation'],
-            'حساسية': ['sensitivity', 'erosion'],
-            'تورم': ['gum_inflammation'],
-            'رائحة': ['plaque', 'gum_inflammation'],
-            'تغير لون': ['cavity', 'erosion']
-        }
 
-    def analyze_image_and_symptoms(self, image, patient):
+    @property
+    def cache_version(self):
+        """نسخة النتائج الخام المستخدمة في مفتاح التخزين المؤقت"""
+        return f"{ANALYZER_VERSION}-{self.max_pixels or 'full'}"
+
+    def analyze_image_and_symptoms(self, image, patient, cache_key=None):
         # تحليل الصورة
-        image_analysis = self.analyze_image(image)
+        return self._complete_analysis(self.analyze_image(image), patient, cache_key)
+
+    def _complete_analysis(self, image_analysis, patient, cache_key=None):
+        """تخزين الدرجات الخام ثم تعديلها حسب معلومات المريض"""
+        # الصور المرفوضة في فحص الجودة لا تحلل ولا تعدل درجاتها
+        if image_analysis.get('rejected'):
+            return image_analysis
         
-        # تعديل النتائج بناءً على الأعراض والتاريخ المرضي
-        adjusted_scores = self._adjust_scores_based_on_patient(
-            image_analysis['scores'],
-            patient
-        )
+        # تخزين الدرجات الخام لإعادة استخدامها عند رفع نفس الصورة مرة أخرى
+        if self.cache is not None and cache_key is not None and 'error' not in image_analysis:
+            self.cache.set(cache_key, image_analysis['scores'])
         
-        # توليد توصيات محدثة
-        recommendations = self._generate_recommendations(
-            adjusted_scores,
-            patient
-        )
+        result = self.score_patient(image_analysis['scores'], patient)
+        if 'error' not in image_analysis:
+            self.attach_score_handle(result, image_analysis['scores'], cache_key)
+        # درجات كل منطقة في التحليل بالمربعات (لتحديد أماكن المشاكل لاحقاً)
+        if 'regions' in image_analysis:
+            result['regions'] = image_analysis['regions']
+        if 'quality' in image_analysis:
+            result['quality'] = image_analysis['quality']
+        return result
+
+    def score_patient(self, raw_scores, patient):
+        """تعديل الدرجات الخام وتوليد التوصيات بناءً على معلومات المريض"""
+        with timer('patient_adjustment'):
+            # تعديل النتائج بناءً على الأعراض والتاريخ المرضي
+            adjusted_scores = self._adjust_scores_based_on_patient(
+                raw_scores,
+                patient
+            )
+            
+            # توليد توصيات محدثة
+            recommendations = self._generate_recommendations(
+                adjusted_scores,
+                patient
+            )
         
         return {
             'scores': adjusted_scores,
             'recommendations': recommendations
         }
 
-    def analyze_image(self, image):
+    def attach_score_handle(self, result, raw_scores, cache_key=None):
+        """
+        حفظ الدرجات الخام في مخزن المعرفات وإضافة المعرف إلى النتيجة
+        (الصور التي لها cache_key تعيد نفس المعرف ما دام صالحاً)
+        """
+        if self.score_store is not None:
+            result['score_handle'] = self.score_store.put(raw_scores, key=cache_key)
+        return result
+
+    def analyze_batch(self, images, patient, cache_keys=None):
+        """تحليل مجموعة من الصور بالتوازي مع الحفاظ على ترتيب الرفع"""
+        results = [None] * len(images)
+        for index, result in self.iter_batch(images, patient, cache_keys):
+            results[index] = result
+        return results
+
+    def iter_batch(self, images, patient, cache_keys=None):
+        """تحليل مجموعة من الصور بالتوازي وإرجاع (الترتيب، النتيجة) فور اكتمال كل صورة"""
+        cache_keys = cache_keys or [None] * len(images)
+        if self.processes and images:
+            yield from self._iter_batch_processes(images, patient, cache_keys)
+            return
+        if len(images) <= 1 or self.max_workers <= 1:
+            for index, image in enumerate(images):
+                yield index, self._analyze_safely(image, patient, cache_keys[index])
+            return
+        
+        executor = _get_executor(self.max_workers)
+        futures = {
+            executor.submit(self._analyze_safely, image, patient, cache_key): index
+            for index, (image, cache_key) in enumerate(zip(images, cache_keys))
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def _iter_batch_processes(self, images, patient, cache_keys):
+        """
+        تحليل الصور في مجمع عمليات: كل صورة تكتب مرة واحدة في مقطع ذاكرة مشتركة
+        ويرسل وصفها فقط، ويعاد المقطع إلى المجموعة فور انتهاء العامل منه
+        """
+        transport = get_image_pool()
+        options = {
+            'max_pixels': self.max_pixels,
+            'tile_size': self.tile_size,
+            'tile_workers': self.tile_workers,
+            'quality_gate': self.quality_gate
+        }
+        futures = {}
+        for index, image in enumerate(images):
+            with timer('shared_image_put'):
+                descriptor = transport.put(image)
+            try:
+                executor = _get_process_executor(self.processes)
+                try:
+                    future = executor.submit(_analyze_shared, descriptor, options)
+                except BrokenProcessPool:
+                    _discard_process_executor(executor)
+                    executor = _get_process_executor(self.processes)
+                    future = executor.submit(_analyze_shared, descriptor, options)
+            except Exception:
+                transport.release(descriptor)
+                raise
+            future.add_done_callback(lambda _, descriptor=descriptor: transport.release(descriptor))
+            # المجمع الذي نفذ الطلب فعلاً (قد يختلف بين الصور إذا أعيد إنشاؤه)
+            futures[future] = (index, executor)
+        
+        for future in as_completed(futures):
+            index, executor = futures[future]
+            try:
+                result = self._complete_analysis(future.result(), patient, cache_keys[index])
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _discard_process_executor(executor)
+                result = self._batch_error(e)
+            yield index, result
+
+    def _analyze_safely(self, image, patient, cache_key=None):
         try:
-            # تحويل الصورة إلى تدرج الرمادي
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
+            return self.analyze_image_and_symptoms(image, patient, cache_key)
+        except Exception as e:
+            return self._batch_error(e)
 
-            # تحسين جودة الصورة
-            gray = cv2.equalizeHist(gray)
-            
-            # تطبيق مرشح لتقليل الضوضاء
-            gray = cv2.GaussianBlur(gray, (5, 5), 0)
-            
-            # حساب الدرجات لكل حالة
-            scores = {}
-            
-            # تحليل التسوس
-            _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cavity_score = min(len(contours) / 100.0, 1.0)
-            scores['cavity'] = cavity_score
-            
-            # تحليل التهاب اللثة
-            edges = cv2.Canny(gray, 100, 200)
-            inflammation_score = np.sum(edges > 0) / (gray.shape[0] * gray.shape[1])
-            scores['gum_inflammation'] = min(inflammation_score * 2, 1.0)
-            
-            # تحليل تراكم البلاك
-            blur = cv2.GaussianBlur(gray, (15, 15), 0)
-            plaque_score = np.std(gray - blur) / 128.0
-            scores['plaque'] = min(plaque_score * 2, 1.0)
-            
-            # تحليل تآكل المينا
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            erosion_score = np.std(laplacian) / 128.0
-            scores['erosion'] = min(erosion_score * 2, 1.0)
+    def _batch_error(self, e):
+        print(f"Error in analyze_batch: {str(e)}")
+        return {
+            'error': str(e),
+            'scores': {},
+            'recommendations': ['حدث خطأ أثناء تحليل هذه الصورة']
+        }
+
+    def analyze_image(self, image):
+        try:
+            # فحص سريع على نسخة مصغرة قبل العمل بالدقة الكاملة
+            quality = None
+            if self.quality_gate is not None and self.quality_gate.enabled:
+                with timer('quality_gate'):
+                    quality = self.quality_gate.check(image)
+                if not quality['passed'] and self.quality_gate.rejects:
+                    return {
+                        'error': 'جودة الصورة غير كافية للتحليل',
+                        'rejected': True,
+                        'quality': quality,
+                        'scores': {},
+                        'recommendations': [reason['message'] for reason in quality['reasons']] + [
+                            'يرجى إعادة تصوير الأسنان بإضاءة جيدة وتركيز واضح'
+                        ]
+                    }
             
-            # تقدير الحساسية
-            sensitivity_score = (cavity_score + erosion_score) / 2
-            scores['sensitivity'] = sensitivity_score
+            # تحويل الصورة إلى تدرج الرمادي وتحسين جودتها
+            gray = self._prepare_gray(image)
             
-            # تقييم الصحة العامة
-            overall_health = 1.0 - np.mean([
-                cavity_score,
-                inflammation_score,
-                plaque_score,
-                erosion_score,
-                sensitivity_score
-            ])
-            scores['overall_health'] = overall_health
+            # استخراج الخصائص الخام ثم حساب الدرجات لكل حالة
+            if self.tile_size and max(gray.shape) > self.tile_size:
+                features, regions = self._extract_features_tiled(gray)
+            else:
+                features, regions = self._extract_features(gray), None
+            scores = self._scores_from_features(features)
             
-            return {
+            result = {
                 'scores': scores,
                 'recommendations': self._generate_basic_recommendations(scores)
             }
+            if regions is not None:
+                result['regions'] = [
+                    {
+                        'x': region['x'],
+                        'y': region['y'],
+                        'width': region['width'],
+                        'height': region['height'],
+                        'scores': self._scores_from_features(region['features'])
+                    }
+                    for region in regions
+                ]
+            if quality is not None:
+                result['quality'] = quality
+            return result
             
         except Exception as e:
             print(f"Error in analyze_image: {str(e)}")
             return {
+                'error': str(e),
                 'scores': {
                     'cavity': 0.0,
                     'gum_inflammation': 0.0,
@@ -113,47 +291,116 @@ class DentalAnalyzer:
                 'recommendations': ['عذراً، حدث خطأ أثناء تحليل الصورة. يرجى التأكد من جودة الصورة وإعادة المحاولة.']
             }
 
+    def _prepare_gray(self, image):
+        """تحويل الصورة إلى تدرج الرمادي مع تحسين التباين وتقليل الضوضاء"""
+        if len(image.shape) == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = image
+        
+        # تصغير الصور الكبيرة جداً إذا تم تحديد حد أقصى لدقة العمل
+        if self.max_pixels and gray.shape[0] * gray.shape[1] > self.max_pixels:
+            scale = (self.max_pixels / float(gray.shape[0] * gray.shape[1])) ** 0.5
+            size = (max(int(gray.shape[1] * scale), 1), max(int(gray.shape[0] * scale), 1))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        
+        # تحسين جودة الصورة
+        with timer('equalize'):
+            gray = cv2.equalizeHist(gray)
+        
+        # تطبيق مرشح لتقليل الضوضاء (في نفس المصفوفة)
+        with timer('blur'):
+            return cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
+
+    def _extract_features(self, gray):
+        """
+        استخراج الخصائص الخام من الصورة في مرحلة واحدة مع إعادة استخدام المصفوفات المؤقتة
+        يتم العد بدون أقنعة منطقية وحساب الانحراف المعياري من مدرجات تكرارية صحيحة
+        (نفس طريقة التحليل بالمربعات حتى تتطابق النتائج تماماً)
+        """
+        pixels = gray.shape[0] * gray.shape[1]
+        
+        # تحليل التسوس: عتبة أوتسو ثم عد المحيطات الخارجية
+        with timer('otsu_contours'):
+            _, work = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            contours, _ = cv2.findContours(work, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contour_count = len(contours)
+            del contours
+        
+        # تحليل التهاب اللثة: كثافة الحواف (نفس المصفوفة المؤقتة)
+        with timer('canny'):
+            cv2.Canny(gray, 100, 200, edges=work)
+            edge_density = cv2.countNonZero(work) / pixels
+        
+        # تحليل البلاك: الفرق عن التمويه الواسع بحساب uint8 (مع الالتفاف كما في السابق)
+        with timer('plaque'):
+            cv2.GaussianBlur(gray, (15, 15), 0, dst=work)
+            np.subtract(gray, work, out=work)
+            residual_std = histogram_std(histogram(work, 256))
+            del work
+        
+        # تحليل تآكل المينا: لابلاسيان بدقة int16 (دقيق تماماً لصور uint8)
+        with timer('laplacian'):
+            laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+            laplacian_std = histogram_std(histogram(laplacian, 2 * LAPLACIAN_OFFSET + 1, LAPLACIAN_OFFSET), LAPLACIAN_OFFSET)
+            del laplacian
+        
+        return {
+            'contour_count': contour_count,
+            'edge_density': edge_density,
+            'residual_std': float(residual_std),
+            'laplacian_std': float(laplacian_std)
+        }
+
+    def _extract_features_tiled(self, gray):
+        """
+        نفس خصائص _extract_features بمعالجة مربعات متداخلة (الذاكرة المؤقتة بحجم المربع)
+        مع خصائص كل مربع على حدة
+        """
+        executor = _get_executor(self.tile_workers, 'dental-tiles') if self.tile_workers > 1 else None
+        with timer('tiled_features'):
+            return extract_features_tiled(gray, self.tile_size, executor)
+
+    def _scores_from_features(self, features):
+        """تحويل الخصائص الخام إلى درجات الحالات"""
+        scores = {}
+        
+        # تحليل التسوس
+        cavity_score = min(features['contour_count'] / 100.0, 1.0)
+        scores['cavity'] = cavity_score
+        
+        # تحليل التهاب اللثة
+        inflammation_score = features['edge_density']
+        scores['gum_inflammation'] = min(inflammation_score * 2, 1.0)
+        
+        # تحليل تراكم البلاك
+        plaque_score = features['residual_std'] / 128.0
+        scores['plaque'] = min(plaque_score * 2, 1.0)
+        
+        # تحليل تآكل المينا
+        erosion_score = features['laplacian_std'] / 128.0
+        scores['erosion'] = min(erosion_score * 2, 1.0)
+        
+        # تقدير الحساسية
+        sensitivity_score = (cavity_score + erosion_score) / 2
+        scores['sensitivity'] = sensitivity_score
+        
+        # تقييم الصحة العامة
+        overall_health = 1.0 - np.mean([
+            cavity_score,
+            inflammation_score,
+            plaque_score,
+            erosion_score,
+            sensitivity_score
+        ])
+        scores['overall_health'] = float(overall_health)
+        
+        return scores
+
     def _adjust_scores_based_on_patient(self, scores, patient):
-        adjusted_scores = scores.copy()
-        
-        # تعديل النتائج بناءً على الأعراض
-        for symptom in patient.symptoms:
-            if symptom in self.symptom_conditions:
-                related_conditions = self.symptom_conditions[symptom]
-                for condition in related_conditions:
-                    # تخفيض درجة الصحة للحالات المرتبطة بالأعراض
-                    adjusted_scores[condition] = min(
-                        adjusted_scores[condition] * 0.8,
-                        adjusted_scores[condition]
-                    )
-        
-        # تعديل النتائج بناءً على العمر
-        if patient.age > 60:
-            # زيادة احتمالية مشاكل اللثة وتآكل المينا للمرضى الأكبر سناً
-            adjusted_scores['gum_inflammation'] *= 0.9
-            adjusted_scores['erosion'] *= 0.9
-        elif patient.age < 18:
-            # زيادة احتمالية التسوس للمرضى الأصغر سناً
-            adjusted_scores['cavity'] *= 0.9
-        
-        # تعديل النتائج بناءً على أسباب الزيارة
-        for reason in patient.visit_reasons:
-            if 'ألم' in reason.lower():
-                adjusted_scores['cavity'] *= 0.8
-                adjusted_scores['sensitivity'] *= 0.8
-            elif 'نزيف' in reason.lower():
-                adjusted_scores['gum_inflammation'] *= 0.7
-            elif 'رائحة' in reason.lower():
-                adjusted_scores['plaque'] *= 0.8
-                adjusted_scores['gum_inflammation'] *= 0.8
-        
-        # إعادة حساب الصحة العامة
-        adjusted_scores['overall_health'] = sum(
-            score for condition, score in adjusted_scores.items()
-            if condition != 'overall_health'
-        ) / (len(adjusted_scores) - 1)
-        
-        return adjusted_scores
+        # تعديل النتائج بناءً على الأعراض والعمر وأسباب الزيارة حسب جدول القواعد
+        adjusted = self.rules.adjust(self.rules.to_matrix([scores]), [patient])
+        return self.rules.to_scores(adjusted[0])
 
     def _normalize_score(self, value, min_threshold, max_threshold):
         if value < min_threshold:
@@ -172,68 +419,18 @@ class DentalAnalyzer:
         return sum(health_indicators) / len(health_indicators)
 
     def _generate_recommendations(self, scores, patient=None):
-        recommendations = []
-        
-        # توصيات بناءً على نتائج التحليل
-        if scores['cavity'] < 0.7:
-            recommendations.append("ينصح بزيارة طبيب الأسنان للكشف عن التسوس المحتمل")
-        
-        if scores['gum_inflammation'] < 0.7:
-            recommendations.append("يُنصح باستخدام غسول الفم المضاد للبكتيريا وتحسين نظافة الفم")
-        
-        if scores['plaque'] < 0.6:
-            recommendations.append("يجب تحسين تنظيف الأسنان باستخدام الفرشاة والخيط السني بانتظام")
-        
-        if scores['erosion'] < 0.7:
-            recommendations.append("تجنب المشروبات الحمضية وتناول الأطعمة القاسية")
-        
-        if scores['sensitivity'] < 0.7:
-            recommendations.append("استخدم معجون أسنان مخصص للأسنان الحساسة")
-        
-        if scores['overall_health'] < 0.6:
-            recommendations.append("يُنصح بزيارة طبيب الأسنان لفحص شامل وتنظيف احترافي")
-            
-        # إضافة توصيات خاصة بناءً على معلومات المريض
-        if patient:
-            if patient.age > 60:
-                recommendations.append("نظراً لعمرك، يُنصح بزيارة طبيب الأسنان كل 4-6 أشهر للفحص الدوري")
-            elif patient.age < 18:
-                recommendations.append("يُنصح بتجنب الحلويات والمشروبات الغازية وتنظيف الأسنان بعد كل وجبة")
-            
-            for symptom in patient.symptoms:
-                if 'ألم' in symptom.lower():
-                    recommendations.append("يُنصح بتجنب الأطعمة والمشروبات شديدة البرودة أو السخونة")
-                elif 'نزيف' in symptom.lower():
-                    recommendations.append("استخدم فرشاة أسنان ناعمة وتجنب الضغط الشديد أثناء التنظيف")
-        
-        if not recommendations:
-            recommendations.append("صحة أسنانك جيدة! حافظ على روتين العناية اليومي")
-        
-        return recommendations
+        # توصيات بناءً على نتائج التحليل ومعلومات المريض
+        patients = [patient] if patient else None
+        return self.rules.recommend(self.rules.to_matrix([scores]), patients)[0]
 
     def _generate_basic_recommendations(self, scores):
-        recommendations = []
-        
-        # توصيات بناءً على نتائج التحليل
-        if scores['cavity'] < 0.7:
-            recommendations.append("ينصح بزيارة طبيب الأسنان للكشف عن التسوس المحتمل")
-        
-        if scores['gum_inflammation'] < 0.7:
-            recommendations.append("يُنصح باستخدام غسول الفم المضاد للبكتيريا وتحسين نظافة الفم")
-        
-        if scores['plaque'] < 0.6:
-            recommendations.append("يجب تحسين تنظيف الأسنان باستخدام الفرشاة والخيط السني بانتظام")
-        
-        if scores['erosion'] < 0.7:
-            recommendations.append("تجنب المشروبات الحمضية وتناول الأطعمة القاسية")
-        
-        if scores['sensitivity'] < 0.7:
-            recommendations.append("استخدم معجون أسنان مخصص للأسنان الحساسة")
-        
-        if scores['overall_health'] < 0.6:
-            recommendations.append("يُنصح بزيارة طبيب الأسنان لفحص شامل وتنظيف احترافي")
-        
-        if not recommendations:
-            recommendations.append("صحة أسنانك جيدة! حافظ على روتين العناية اليومي")
-        
-        return recommendations
+        return self._generate_recommendations(scores)
+
+    def rescore(self, raw_scores, patients):
+        """
+        تعديل الدرجات الخام وتوليد التوصيات لعدد كبير من السجلات (مثلاً بعد تغيير القواعد)
+        raw_scores قائمة قواميس أو مصفوفة بأعمدة self.rules.columns
+        """
+        if not isinstance(raw_scores, np.ndarray):
+            raw_scores = self.rules.to_matrix(raw_scores)
+        return self.rules.rescore(raw_scores, patients)
@@ -0,0 +1,133 @@
+import io
+import cv2
+import numpy as np
+import pydicom
+
+try:
+    # pydicom >= 3.0: قراءة إطار واحد من الملف دون فك ترميز باقي البيانات
+    from pydicom.pixels import apply_modality_lut, apply_voi_lut, pixel_array as _read_pixels
+except ImportError:
+    from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
+    _read_pixels = None
+
+# عدد الصفوف التي تتم معالجتها في كل دفعة عند تطبيق جدول التحويل
+# (يحدد حجم المصفوفات المؤقتة بدلاً من حجم الصورة كاملة)
+LUT_CHUNK_ROWS = 256
+
+
+def _as_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def read_dicom_header(source):
+    """قراءة ترويسة DICOM فقط (بدون بيانات البكسل) والتحقق من أنها تصف صورة"""
+    source = _as_source(source)
+    try:
+        ds = pydicom.dcmread(source, stop_before_pixels=True)
+    except Exception as e:
+        raise ValueError(f"ملف DICOM غير صالح: {str(e)}")
+    finally:
+        _rewind(source)
+
+    for tag in ('Rows', 'Columns', 'BitsAllocated'):
+        if not getattr(ds, tag, None):
+            raise ValueError("ملف DICOM لا يحتوي على صورة")
+
+    return ds
+
+
+def build_lut(ds, pixel_min, pixel_max):
+    """
+    بناء جدول تحويل إلى uint8 لنطاق القيم الموجود في الصورة فقط
+    مع تطبيق Rescale Slope/Intercept و VOI LUT أو Window Center/Width إن وجدت
+    """
+    values = np.arange(pixel_min, pixel_max + 1, dtype=np.int64)
+    mapped = apply_modality_lut(values, ds)
+    mapped = apply_voi_lut(mapped, ds).astype(np.float64)
+
+    low, high = mapped.min(), mapped.max()
+    if high == low:
+        # إطار مسطح: تجنب القسمة على صفر
+        lut = np.zeros(values.shape, dtype=np.uint8)
+    else:
+        lut = ((mapped - low) * 255.0 / (high - low)).astype(np.uint8)
+
+    # MONOCHROME1 يعني أن القيم الأعلى أغمق
+    if getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1':
+        lut = 255 - lut
+
+    return lut
+
+
+def to_uint8(pixels, ds):
+    """تحويل بكسلات DICOM إلى uint8 عبر جدول تحويل محسوب مسبقاً"""
+    if pixels.dtype.kind not in 'iu' or pixels.dtype.itemsize > 2:
+        # بيانات عائمة أو 32 بت: تطبيع خطي بدقة float32
+        image = pixels.astype(np.float32)
+        low, high = float(image.min()), float(image.max())
+        if high == low:
+            return np.zeros(image.shape, dtype=np.uint8)
+        image -= low
+        image *= 255.0 / (high - low)
+        return image.astype(np.uint8)
+
+    pixel_min, pixel_max = int(pixels.min()), int(pixels.max())
+    lut = build_lut(ds, pixel_min, pixel_max)
+
+    # جدول كامل بحجم نطاق النوع حتى يمكن فهرسته مباشرة بالقيم الخام
+    unsigned = np.dtype(f'u{pixels.dtype.itemsize}')
+    full_lut = np.zeros(1 << (8 * pixels.dtype.itemsize), dtype=np.uint8)
+    full_lut[np.arange(pixel_min, pixel_max + 1) & (full_lut.size - 1)] = lut
+    raw = pixels.view(unsigned)
+
+    if raw.dtype == np.uint8:
+        return cv2.LUT(raw, full_lut) if raw.ndim == 2 else full_lut[raw]
+
+    # الفهرسة على دفعات من الصفوف لتحديد حجم مصفوفات الفهارس المؤقتة
+    image = np.empty(raw.shape, dtype=np.uint8)
+    for start in range(0, raw.shape[0], LUT_CHUNK_ROWS):
+        image[start:start + LUT_CHUNK_ROWS] = full_lut[raw[start:start + LUT_CHUNK_ROWS]]
+    return image
+
+
+def load_dicom(source, frame=None):
+    """
+    تحميل صورة DICOM كمصفوفة uint8 جاهزة للتحليل
+    source يمكن أن يكون مساراً أو بايتات أو ملفاً مفتوحاً، وفي الملفات متعددة الإطارات
+    تتم قراءة إطار واحد فقط (الإطار الأوسط افتراضياً)
+    """
+    source = _as_source(source)
+    ds = read_dicom_header(source)
+
+    frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    index = None
+    if frames > 1:
+        index = frames // 2 if frame is None else frame
+
+    try:
+        if _read_pixels is not None:
+            pixels = _read_pixels(source, index=index)
+        else:
+            # pydicom 2: تأجيل تحميل العناصر الكبيرة حتى الحاجة إليها
+            pixels = pydicom.dcmread(source, defer_size='1 MB').pixel_array
+            if index is not None:
+                pixels = pixels[index]
+    except Exception as e:
+        raise ValueError(f"فشل في قراءة بيانات البكسل: {str(e)}")
+    finally:
+        _rewind(source)
+
+    image = to_uint8(pixels, ds)
+
+    if image.ndim == 3 and image.shape[-1] == 3:
+        # pydicom يعيد الصور الملونة بترتيب RGB
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    return image
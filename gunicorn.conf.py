@@ -1,3 +1,14 @@
+import os
+
 workers = 4
 bind = "0.0.0.0:10000"
 timeout = 120
+
+def on_starting(server):
+    # حذف لقطات المقاييس من التشغيل السابق قبل بدء العمال
+    import metrics
+    metrics.clear_directory(os.getenv('METRICS_DIR', os.path.join('cache', 'metrics')))
+    
+    # تحميل خطوط التقارير في العملية الرئيسية حتى يرثها العمال عبر fork (copy-on-write)
+    import report_generator
+    report_generator.warm_up()
@@ -0,0 +1,172 @@
+"""
+نقل الصور المفكوكة إلى عمليات التحليل عبر الذاكرة المشتركة بدلاً من pickle
+
+العملية الرئيسية تكتب كل صورة مرة واحدة في مقطع من مجموعة مقاطع يعاد استخدامها،
+وترسل إلى العامل وصفاً صغيراً (اسم المقطع والأبعاد ونوع البيانات) فقط. العامل يقرأ
+الصورة مباشرة من المقطع دون نسخ ويرجع الدرجات فقط.
+
+دورة حياة المقاطع:
+- المالك (العملية التي أنشأت المجموعة) هو الوحيد الذي يحذف المقاطع (unlink)
+- put يحجز مقطعاً و release يعيده إلى المجموعة بعد انتهاء العامل منه
+- المقاطع الحرة الزائدة عن max_free_bytes تحذف فوراً، و close (أو الخروج من العملية) يحذف الباقي
+- العمال يحتفظون بعدد محدود من المقاطع المفتوحة لتجنب إعادة فتحها لكل صورة
+"""
+import atexit
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# وصف الصورة المرسل إلى العامل بدلاً من بياناتها
+SharedImage = namedtuple('SharedImage', ['name', 'shape', 'dtype'])
+
+# أحجام المقاطع تقرب إلى مضاعفات هذا الحجم حتى يعاد استخدامها لصور بأحجام متقاربة
+SEGMENT_ALIGNMENT = 1024 * 1024
+
+# أقصى حجم للمقاطع الحرة المحتفظ بها لإعادة الاستخدام
+MAX_FREE_BYTES = int(os.getenv('SHARED_IMAGES_MAX_FREE_BYTES', 256 * 1024 * 1024))
+
+# عدد المقاطع المفتوحة في كل عامل
+WORKER_ATTACHED_SEGMENTS = 16
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+_attached = OrderedDict()
+_attached_lock = threading.Lock()
+
+
+class SharedImagePool:
+    """مجموعة مقاطع ذاكرة مشتركة تملكها العملية الحالية لإرسال الصور إلى العمال"""
+
+    def __init__(self, max_free_bytes=MAX_FREE_BYTES):
+        self.max_free_bytes = max_free_bytes
+        self._segments = {}  # الاسم -> SharedMemory لكل المقاطع (المحجوزة والحرة)
+        self._free = []  # أسماء المقاطع الحرة
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def put(self, image):
+        """نسخ الصورة إلى مقطع مشترك وإرجاع وصفها (يجب استدعاء release بعد انتهاء العامل)"""
+        image = np.asarray(image)
+        nbytes = max(image.nbytes, 1)
+        segment = self._acquire(nbytes)
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=segment.buf)
+        view[...] = image
+        del view
+        return SharedImage(segment.name, image.shape, image.dtype.str)
+
+    def _acquire(self, nbytes):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("مجموعة الذاكرة المشتركة مغلقة")
+            # أصغر مقطع حر يتسع للصورة (دون هدر أكثر من ضعف الحجم)
+            best = None
+            for name in self._free:
+                size = self._segments[name].size
+                if nbytes <= size <= 2 * nbytes + SEGMENT_ALIGNMENT and (best is None or size < self._segments[best].size):
+                    best = name
+            if best is not None:
+                self._free.remove(best)
+                self._free_bytes -= self._segments[best].size
+                return self._segments[best]
+
+        size = -(-nbytes // SEGMENT_ALIGNMENT) * SEGMENT_ALIGNMENT
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        with self._lock:
+            self._segments[segment.name] = segment
+        return segment
+
+    def release(self, descriptor):
+        """إعادة مقطع الصورة إلى المجموعة (وحذف المقاطع الحرة الزائدة عن الحد)"""
+        with self._lock:
+            segment = self._segments.get(descriptor.name)
+            if segment is None or descriptor.name in self._free:
+                return
+            self._free.append(descriptor.name)
+            self._free_bytes += segment.size
+            # حذف الأقدم تحريراً حتى يصبح الحجم الحر ضمن الحد
+            removed = []
+            while self._free_bytes > self.max_free_bytes and self._free:
+                name = self._free.pop(0)
+                removed.append(self._segments.pop(name))
+                self._free_bytes -= removed[-1].size
+        for segment in removed:
+            _destroy(segment)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'segments': len(self._segments),
+                'in_use': len(self._segments) - len(self._free),
+                'bytes': sum(segment.size for segment in self._segments.values()),
+                'free_bytes': self._free_bytes
+            }
+
+    def close(self):
+        """حذف كل المقاطع (بما فيها المحجوزة، لذلك يستدعى بعد انتهاء كل العمال)"""
+        with self._lock:
+            self._closed = True
+            segments = list(self._segments.values())
+            self._segments.clear()
+            self._free.clear()
+            self._free_bytes = 0
+        for segment in segments:
+            _destroy(segment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _destroy(segment):
+    # الحذف أولاً حتى لا يبقى المقطع إذا فشل الإغلاق، والذاكرة تحرر عند إغلاق آخر عملية له
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        segment.close()
+    except BufferError as e:
+        print(f"Error closing shared image {segment.name}: {str(e)}")
+
+
+def get_image_pool():
+    """مجموعة المقاطع المشتركة للعملية الحالية (تحذف مقاطعها عند خروج العملية)"""
+    pid = os.getpid()
+    with _pools_lock:
+        pool = _pools.get(pid)
+        if pool is None:
+            pool = _pools[pid] = SharedImagePool()
+            atexit.register(pool.close)
+        return pool
+
+
+def attach(descriptor):
+    """
+    الصورة من وصفها كمصفوفة تقرأ من المقطع المشترك مباشرة (داخل العامل)
+    المصفوفة صالحة فقط حتى يعيد المالك المقطع إلى المجموعة
+    """
+    with _attached_lock:
+        segment = _attached.pop(descriptor.name, None)
+        if segment is None:
+            # العمال عمليات ابن تشارك المالك متتبع الموارد، لذلك التسجيل هنا لا يكرر المقطع
+            # ولا يحذفه عند خروج العامل (الحذف للمالك وحده)
+            segment = shared_memory.SharedMemory(name=descriptor.name)
+        _attached[descriptor.name] = segment
+
+        # إغلاق أقدم المقاطع المفتوحة (تبقى موجودة حتى يحذفها المالك)
+        while len(_attached) > WORKER_ATTACHED_SEGMENTS:
+            _, oldest = _attached.popitem(last=False)
+            try:
+                oldest.close()
+            except BufferError:
+                # ما زالت هناك مصفوفة تستخدمه: يغلق عند تحرير آخر مرجع
+                pass
+
+    return np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=segment.buf)
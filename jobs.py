@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobQueue:
+    """
+    طابور مهام تحليل غير متزامن محفوظ في SQLite
+    الحالة مشتركة بين عمال gunicorn، وكل عملية تشغل مجمع خيوط محلي يسحب الملفات من الطابور
+    """
+
+    def __init__(self, path, handler, workers=2, stale_after=300, ttl=24 * 3600, poll_interval=0.5):
+        self.path = path
+        # handler(filename, data, patient_data) -> نتيجة تحليل بنفس شكل /analyze
+        self.handler = handler
+        self.workers = workers
+        self.stale_after = stale_after
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+        self._local = threading.local()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    patient TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_files (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    data BLOB,
+                    result TEXT,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (job_id, position)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS job_files_status ON job_files (status, updated)")
+
+    def _connection(self):
+        # اتصال لكل خيط ولكل عملية (لا يجوز استخدام اتصال SQLite بعد fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, files, patient_data):
+        """إضافة مهمة جديدة وإرجاع معرفها، files قائمة من (اسم الملف، البايتات)"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, patient, created) VALUES (?, ?, ?)",
+                (job_id, json.dumps(patient_data), now)
+            )
+            conn.executemany(
+                "INSERT INTO job_files (job_id, position, filename, status, data, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                [(job_id, position, filename, data, now) for position, (filename, data) in enumerate(files)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id):
+        """حالة المهمة ونتائج كل ملف بترتيب الرفع، أو None إذا لم توجد"""
+        conn = self._connection()
+        job = conn.execute("SELECT created FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+
+        rows = conn.execute(
+            "SELECT filename, status, result FROM job_files WHERE job_id = ? ORDER BY position",
+            (job_id,)
+        ).fetchall()
+
+        files = []
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'error': 0}
+        for filename, status, result in rows:
+            counts[status] += 1
+            entry = json.loads(result) if result else {'filename': filename}
+            entry['status'] = status
+            files.append(entry)
+
+        if counts['done'] + counts['error'] == len(rows):
+            job_status = 'done'
+        elif counts['queued'] == len(rows):
+            job_status = 'queued'
+        else:
+            job_status = 'running'
+
+        return {
+            'job_id': job_id,
+            'status': job_status,
+            'total': len(rows),
+            'completed': counts['done'] + counts['error'],
+            'results': files
+        }
+
+    def start(self):
+        """تشغيل خيوط العمال في العملية الحالية (مرة واحدة لكل عملية)"""
+        with self._threads_lock:
+            if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+                return
+            # بعد fork لا تنتقل الخيوط إلى العملية الابن
+            self._pid = os.getpid()
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _claim(self):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # إعادة الملفات العالقة لعامل توقف إلى الطابور
+            conn.execute(
+                "UPDATE job_files SET status = 'queued' WHERE status = 'running' AND updated < ?",
+                (now - self.stale_after,)
+            )
+            row = conn.execute("""
+                SELECT f.job_id, f.position, f.filename, f.data, j.patient
+                FROM job_files f JOIN jobs j ON j.id = f.job_id
+                WHERE f.status = 'queued'
+                ORDER BY f.updated, f.position
+                LIMIT 1
+            """).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job_files SET status = 'running', updated = ? WHERE job_id = ? AND position = ?",
+                    (now, row[0], row[1])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, position, status, result):
+        conn = self._connection()
+        conn.execute(
+            "UPDATE job_files SET status = ?, result = ?, data = NULL, updated = ? WHERE job_id = ? AND position = ?",
+            (status, json.dumps(result), time.time(), job_id, position)
+        )
+
+    def purge(self):
+        """حذف المهام الأقدم من مدة الاحتفاظ"""
+        conn = self._connection()
+        cutoff = time.time() - self.ttl
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM job_files WHERE job_id IN (SELECT id FROM jobs WHERE created < ?)", (cutoff,))
+            conn.execute("DELETE FROM jobs WHERE created < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.time()
+
+                row = self._claim()
+                if row is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+
+                job_id, position, filename, data, patient = row
+                try:
+                    result = self.handler(filename, data, json.loads(patient))
+                    self._finish(job_id, position, 'error' if 'error' in result else 'done', result)
+                except Exception as e:
+                    print(f"Error processing job {job_id} file {filename}: {str(e)}")
+                    self._finish(job_id, position, 'error', {
+                        'filename': filename,
+                        'error': str(e),
+                        'scores': {},
+                        'recommendations': ['حدث خطأ أثناء تحليل هذه الصورة'],
+                        'image_type': 'error'
+                    })
+            except sqlite3.Error as e:
+                print(f"Error in job worker: {str(e)}")
+                time.sleep(self.poll_interval)
@@ -0,0 +1,173 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# حدود فئات المدرج التكراري بالثواني
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_NAME = 'dental_stage_duration_seconds'
+
+
+class MetricsRegistry:
+    """
+    مدرجات تكرارية لأزمنة مراحل المعالجة داخل العملية الحالية
+    كل عامل gunicorn يحفظ لقطة دورية في مجلد مشترك ويتم دمج اللقطات عند الطلب
+    """
+
+    def __init__(self, directory=None, flush_interval=10.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._stages = {}
+        self._lock = threading.Lock()
+        # كتابة لقطة واحدة فقط في كل مرة (كل الخيوط تكتب نفس الملف)
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._dirty = False
+        self._flusher = None
+
+    def configure(self, directory=None, flush_interval=None):
+        self.directory = directory
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # حفظ آخر القياسات عند خروج العامل
+            atexit.register(self.flush)
+
+    def observe(self, stage, seconds):
+        """تسجيل زمن مرحلة واحدة"""
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            self._dirty = True
+            # حجز الحفظ في نفس القفل حتى لا تحفظ عدة خيوط في نفس الوقت
+            now = time.monotonic()
+            flush = self.directory and now - self._last_flush > self.flush_interval
+            if flush:
+                self._last_flush = now
+        if flush:
+            self.flush()
+
+    @contextmanager
+    def timer(self, stage):
+        """قياس زمن كتلة من الشيفرة وتسجيله تحت اسم المرحلة"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                for stage, h in self._stages.items()
+            }
+
+    def flush(self):
+        """حفظ لقطة هذه العملية في المجلد المشترك"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.monotonic()
+                self._dirty = False
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {str(e)}")
+
+    def start_flusher(self):
+        """
+        حفظ اللقطة كل flush_interval في خيط خلفي إذا وجدت قياسات جديدة
+        (للعمليات التي قد تبقى خاملة بعد آخر قياس مثل عمليات المجمعات)
+        """
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                dirty = self._dirty
+            if dirty:
+                self.flush()
+
+    def collect(self):
+        """دمج لقطات جميع العمال (أو لقطة هذه العملية فقط إذا لم يحدد مجلد)"""
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for stage, histogram in snapshot.items():
+                target = merged.setdefault(stage, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+                for index, value in enumerate(histogram['buckets']):
+                    target['buckets'][index] += value
+                target['sum'] += histogram['sum']
+                target['count'] += histogram['count']
+        return merged
+
+    def exposition(self):
+        """المقاييس بصيغة نص Prometheus"""
+        lines = [
+            f'# HELP {METRIC_NAME} Time spent in each processing stage.',
+            f'# TYPE {METRIC_NAME} histogram'
+        ]
+        for stage, histogram in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, value in zip(BUCKETS + (float('inf'),), histogram['buckets']):
+                cumulative += value
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def configure_worker(directory):
+    """
+    إعداد السجل داخل عمليات المجمعات (spawn لا ينقل إعدادات العملية الأم)
+    حتى تظهر أزمنة التحليل وإنشاء التقارير في تلك العمليات في /metrics
+    """
+    if directory:
+        REGISTRY.configure(directory)
+        REGISTRY.start_flusher()
+
+
+def clear_directory(directory):
+    """حذف لقطات التشغيل السابق (يستدعى مرة واحدة عند بدء gunicorn)"""
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# السجل الافتراضي المشترك داخل العملية
+REGISTRY = MetricsRegistry()
+timer = REGISTRY.timer
+observe = REGISTRY.observe
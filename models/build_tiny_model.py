@@ -0,0 +1,51 @@
+"""
+إنشاء نموذج ONNX صغير بأوزان عشوائية لاختبار محرك الاستدلال دون اتصال بالإنترنت
+
+النموذج: متوسط كل قناة -> طبقة خطية -> sigmoid، بنفس مدخلات ومخرجات النموذج الحقيقي
+(دفعة NCHW بحجم 224x224 واحتمال لكل حالة بترتيب DEFAULT_LABELS).
+
+الاستخدام (يتطلب الحزمتين onnx و onnxruntime):
+    python models/build_tiny_model.py
+"""
+import os
+import sys
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ai_model import AI_MODEL_PATH, DEFAULT_LABELS, INPUT_SIZE, quantized_path
+
+
+def build(path, seed=0):
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(0, 4, (len(DEFAULT_LABELS), 3)).astype(np.float32)
+    bias = rng.normal(0, 1, len(DEFAULT_LABELS)).astype(np.float32)
+
+    graph = helper.make_graph(
+        [
+            helper.make_node('GlobalAveragePool', ['images'], ['pooled']),
+            helper.make_node('Flatten', ['pooled'], ['features']),
+            helper.make_node('Gemm', ['features', 'weights', 'bias'], ['logits'], transB=1),
+            helper.make_node('Sigmoid', ['logits'], ['probabilities'])
+        ],
+        'tiny_dental',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['batch', 3, INPUT_SIZE, INPUT_SIZE])],
+        [helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, ['batch', len(DEFAULT_LABELS)])],
+        [numpy_helper.from_array(weights, 'weights'), numpy_helper.from_array(bias, 'bias')]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    helper.set_model_props(model, {'labels': ','.join(DEFAULT_LABELS)})
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+    # نسخة int8 (تكميم ديناميكي للأوزان)
+    quantize_dynamic(path, quantized_path(path), weight_type=QuantType.QInt8)
+
+
+if __name__ == '__main__':
+    build(AI_MODEL_PATH)
+    print(f"تم إنشاء {AI_MODEL_PATH} و {quantized_path(AI_MODEL_PATH)}")
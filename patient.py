@@ -15,6 +15,32 @@ class Patient:
         self.treatment_plans = []
         self.future_notes = []
         
+    @classmethod
+    def from_report_data(cls, data):
+        """إنشاء كائن المريض من بيانات طلب إنشاء التقرير"""
+        patient = cls(
+            name=data['name'],
+            age=int(data['age']),
+            gender=data['gender'],
+            phone=data['phone'],
+            email=data.get('email', ''),
+            visit_reasons=data.get('visit_reasons', []),
+            symptoms=data.get('symptoms', []),
+            medical_history=data.get('medical_history', [])
+        )
+        
+        # إضافة التشخيص وخطة العلاج والملاحظات
+        if data.get('diagnosis'):
+            patient.add_diagnosis(data['diagnosis'])
+        
+        if data.get('treatment_plan'):
+            patient.add_treatment_plan(data['treatment_plan'])
+            
+        if data.get('future_notes'):
+            patient.add_future_note(data['future_notes'])
+        
+        return patient
+        
     def add_visit_reason(self, reason):
         if reason and reason not in self.visit_reasons:
             self.visit_reasons.append(reason)
@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+
+# أكبر بعد للصورة المصغرة التي يعمل عليها الفحص (بضعة أجزاء من الثانية حتى للصور الكبيرة)
+GATE_SIDE = 256
+
+# حجم المنطقة بالدقة الكاملة التي يقاس فيها الوضوح (حول أكثر كتلة تفاصيل في الصورة المصغرة)
+SHARPNESS_WINDOW = 256
+
+# حجم الكتلة في الصورة المصغرة عند حساب نسبة المساحة التي تحتوي على تفاصيل
+COVERAGE_BLOCK = 8
+# أقل انحراف معياري داخل الكتلة لاعتبارها تحتوي على تفاصيل وليست خلفية متجانسة
+COVERAGE_MIN_STD = 4.0
+
+# قيم البكسلات المعتبرة مشبعة (سوداء أو بيضاء بالكامل)
+CLIPPED_DARK = 2
+CLIPPED_BRIGHT = 253
+
+GATE_MODES = ('off', 'flag', 'reject')
+
+
+def downscale(image, max_side=GATE_SIDE):
+    """صورة مصغرة بتدرج الرمادي (التصغير قبل تحويل الألوان أسرع للصور الكبيرة)"""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        # أخذ عينات كل بضعة بكسلات أولاً حتى لا يمر INTER_AREA على كل بكسلات الصورة الكبيرة
+        step = int(1 / scale) // 2
+        if step > 1:
+            image = np.ascontiguousarray(image[::step, ::step])
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return to_gray(image)
+
+
+def to_gray(image):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if image.dtype != np.uint8:
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    return image
+
+
+def measure(image):
+    """مقاييس الجودة: الدقة والوضوح والإضاءة ونسبة المساحة التي تحتوي على تفاصيل"""
+    height, width = image.shape[:2]
+    gray = downscale(image)
+    pixels = gray.size
+
+    # الإضاءة ونسبة البكسلات المشبعة من المدرج التكراري
+    counts = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    brightness = float(np.dot(counts, np.arange(256))) / pixels
+    dark = float(counts[:CLIPPED_DARK + 1].sum()) / pixels
+    bright = float(counts[CLIPPED_BRIGHT:].sum()) / pixels
+
+    # التغطية: نسبة الكتل غير المتجانسة (الانحراف المعياري من متوسطي القيم ومربعاتها)
+    blocks = (max(1, gray.shape[1] // COVERAGE_BLOCK), max(1, gray.shape[0] // COVERAGE_BLOCK))
+    values = gray.astype(np.float32)
+    mean = cv2.resize(values, blocks, interpolation=cv2.INTER_AREA)
+    squares = cv2.resize(values * values, blocks, interpolation=cv2.INTER_AREA)
+    variance = np.maximum(squares - mean * mean, 0)
+    coverage = float(np.count_nonzero(variance > COVERAGE_MIN_STD ** 2)) / variance.size
+
+    # الوضوح: الانحراف المعياري للابلاسيان بالدقة الكاملة حول أكثر كتلة تفاصيل
+    # (التصغير يخفي الضبابية، والمناطق المتجانسة تبدو ضبابية دائماً)
+    row, column = np.unravel_index(int(np.argmax(variance)), variance.shape)
+    center_y = int((row + 0.5) * height / variance.shape[0])
+    center_x = int((column + 0.5) * width / variance.shape[1])
+    top = min(max(center_y - SHARPNESS_WINDOW // 2, 0), max(height - SHARPNESS_WINDOW, 0))
+    left = min(max(center_x - SHARPNESS_WINDOW // 2, 0), max(width - SHARPNESS_WINDOW, 0))
+    window = to_gray(image[top:top + SHARPNESS_WINDOW, left:left + SHARPNESS_WINDOW])
+    _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(window, cv2.CV_32F))
+    _, window_std = cv2.meanStdDev(window)
+    # النسبة إلى تباين المنطقة حتى لا تعتبر الصور المظلمة أو قليلة التباين ضبابية
+    sharpness = float(laplacian_std[0, 0]) / max(float(window_std[0, 0]), 1.0)
+
+    return {
+        'width': width,
+        'height': height,
+        'sharpness': sharpness,
+        'brightness': brightness,
+        'dark_clipped': dark,
+        'bright_clipped': bright,
+        'coverage': coverage
+    }
+
+
+class QualityGate:
+    """
+    فحص سريع لجودة الصورة على نسخة مصغرة قبل التحليل الكامل
+    mode: 'flag' لتحليل الصور مع إرفاق الأسباب، 'reject' لرفض الصور غير الصالحة دون تحليلها،
+    'off' لتعطيل الفحص. الرفض ليس الافتراضي لأن صور الأشعة ذات الخلفية السوداء الكبيرة
+    تتجاوز حد البكسلات المظلمة رغم صلاحيتها للتحليل
+    """
+
+    def __init__(self, mode='flag', min_side=128, min_sharpness=0.05, min_brightness=25.0,
+                 max_brightness=230.0, max_clipped=0.6, min_coverage=0.1):
+        if mode not in GATE_MODES:
+            raise ValueError(f"وضع فحص الجودة غير معروف: {mode}")
+        self.mode = mode
+        self.min_side = min_side
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.min_coverage = min_coverage
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @property
+    def rejects(self):
+        return self.mode == 'reject'
+
+    def check(self, image):
+        """نتيجة الفحص: هل الصورة صالحة، وأسباب الرفض (رمز ورسالة)، والمقاييس"""
+        metrics = measure(image)
+        reasons = []
+
+        if min(metrics['width'], metrics['height']) < self.min_side:
+            reasons.append({
+                'code': 'low_resolution',
+                'message': f"دقة الصورة منخفضة جداً ({metrics['width']}x{metrics['height']})"
+            })
+        if metrics['sharpness'] < self.min_sharpness:
+            reasons.append({'code': 'blurry', 'message': 'الصورة غير واضحة (ضبابية)'})
+        if metrics['brightness'] < self.min_brightness or metrics['dark_clipped'] > self.max_clipped:
+            reasons.append({'code': 'underexposed', 'message': 'الصورة مظلمة جداً'})
+        if metrics['brightness'] > self.max_brightness or metrics['bright_clipped'] > self.max_clipped:
+            reasons.append({'code': 'overexposed', 'message': 'الصورة ساطعة جداً'})
+        if metrics['coverage'] < self.min_coverage:
+            reasons.append({
+                'code': 'low_coverage',
+                'message': 'الصورة لا تحتوي على تفاصيل كافية (قد لا تكون صورة أسنان)'
+            })
+
+        return {
+            'passed': not reasons,
+            'reasons': reasons,
+            'metrics': {name: round(value, 4) if isinstance(value, float) else value
+                        for name, value in metrics.items()}
+        }
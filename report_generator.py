@@ -1,77 +1,219 @@
+import hashlib
+import io
+import json
 import os
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image
 import arabic_reshaper
 from bidi.algorithm import get_display
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from metrics import observe, timer
+from report_store import get_report_store
+from thumbnails import ThumbnailStore
+
+# مسار الخطوط بالنسبة لهذا الملف حتى لا يعتمد على مجلد التشغيل
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+
+# الخطوط والأنماط يتم تحميلها مرة واحدة لكل عملية ومشاركتها بين جميع التقارير
+_init_lock = threading.Lock()
+# بناء PDF في reportlab يعدل حالة الخطوط المشتركة لذلك يتم بناء تقرير واحد في كل مرة داخل العملية
+_build_lock = threading.Lock()
+_fonts_registered = False
+_styles = None
+_shared_generator = None
+
+# نسخة تصميم التقرير، يجب زيادتها عند تغيير محتوى أو شكل التقرير لإبطال التقارير المخزنة
+REPORT_TEMPLATE_VERSION = '1'
+
+# الصور المصغرة للصور المحللة (نفس المجلد الذي يحفظ فيه التطبيق الصور المصغرة)
+THUMBNAILS_DIR = os.getenv('THUMBNAILS_DIR', os.path.join('cache', 'thumbnails'))
+
+# الحد الأقصى لحجم التقرير بالبايت، وعند تجاوزه يعاد الإنشاء بصور أصغر ثم بدون صور
+REPORT_MAX_BYTES = int(os.getenv('REPORT_MAX_BYTES', 512 * 1024))
+
+# مستويات الصور المصغرة (أقصى بعد بالبكسل، جودة JPEG) من الأفضل إلى الأصغر
+THUMBNAIL_LEVELS = [(512, 75), (320, 60), (200, 45)]
+
+# أبعاد عرض الصورة في التقرير بالنقاط
+THUMBNAIL_WIDTH = 240
+THUMBNAIL_HEIGHT = 180
+
+# حفظ الصور والخطوط بصيغة ثنائية بدلاً من ASCII85 (يوفر حوالي ربع حجمها)
+rl_config.useA85 = 0
+
+# الحد الأقصى لعدد النصوص المعالجة المحفوظة في الذاكرة
+SHAPING_CACHE_SIZE = 4096
+
+# أسماء الحالات وتقييمات الدرجات (الحد الأدنى، التقييم، اللون)
+CONDITION_NAMES = {
+    'cavity': 'تسوس',
+    'gum_inflammation': 'التهاب لثة',
+    'plaque': 'تراكم البلاك',
+    'erosion': 'تآكل المينا',
+    'sensitivity': 'حساسية الأسنان',
+    'overall_health': 'الصحة العامة'
+}
+
+ASSESSMENTS = [
+    (80, "خطير", colors.red),
+    (60, "متوسط", colors.orange),
+    (40, "مقبول", colors.yellow),
+    (float("-inf"), "جيد", colors.green)
+]
+
+# النصوص الثابتة في التقرير، تتم معالجتها مرة واحدة عند تحميل الوحدة
+STATIC_TEXTS = [
+    "عيادة دكتور محمد", "أخصائي طب وجراحة الفم والأسنان", "معلومات المريض",
+    "الاسم:", "العمر:", "الجنس:", "رقم الهاتف:", "البريد الإلكتروني:",
+    "سبب الزيارة والأعراض", "سبب الزيارة:", "الأعراض:", "التاريخ الطبي",
+    "نتائج التحليل والتشخيص", "الحالة", "الدرجة", "التقييم", "التوصيات:",
+    "خطة العلاج", "ملاحظات المتابعة",
+    "تم إنشاء هذا التقرير بواسطة نظام التحليل الذكي للأسنان", "تاريخ التقرير:",
+    "ملاحظة: هذا التقرير إرشادي ويجب مراجعة الطبيب المختص للتشخيص النهائي"
+] + list(CONDITION_NAMES.values()) + [label for _, label, _ in ASSESSMENTS]
+
+@lru_cache(maxsize=SHAPING_CACHE_SIZE)
+def shape_arabic_text(text):
+    """تشكيل الحروف العربية وترتيب اتجاه النص للعرض (مع حفظ النتائج المتكررة)"""
+    # معالجة النص العربي
+    reshaped_text = arabic_reshaper.reshape(text)
+    # تحويل اتجاه النص
+    return get_display(reshaped_text)
+
+for _text in STATIC_TEXTS:
+    shape_arabic_text(_text)
+
+def register_fonts():
+    """تسجيل الخطوط العربية مرة واحدة لكل عملية"""
+    global _fonts_registered
+    with _init_lock:
+        if not _fonts_registered:
+            pdfmetrics.registerFont(TTFont('Arabic', os.path.join(FONTS_DIR, 'NotoSansArabic-Regular.ttf')))
+            pdfmetrics.registerFont(TTFont('ArabicBold', os.path.join(FONTS_DIR, 'NotoSansArabic-Bold.ttf')))
+            _fonts_registered = True
+
+def _create_styles():
+    """إنشاء أنماط النص"""
+    styles = {}
+    
+    styles['arabic_style'] = ParagraphStyle(
+        'Arabic',
+        fontName='Arabic',
+        fontSize=11,
+        leading=16,
+        alignment=1,  # center alignment
+        rightIndent=0,
+        leftIndent=0,
+        spaceBefore=0,
+        spaceAfter=0,
+        textColor=colors.black,
+    )
+    
+    styles['arabic_bold_style'] = ParagraphStyle(
+        'ArabicBold',
+        fontName='ArabicBold',
+        fontSize=14,
+        leading=20,
+        alignment=1,  # center alignment
+        rightIndent=0,
+        leftIndent=0,
+        spaceBefore=6,
+        spaceAfter=6,
+        textColor=colors.black,
+    )
+    
+    styles['header_style'] = ParagraphStyle(
+        'Header',
+        fontName='ArabicBold',
+        fontSize=18,
+        leading=22,
+        alignment=1,  # center alignment
+        rightIndent=0,
+        leftIndent=0,
+        spaceBefore=12,
+        spaceAfter=12,
+        textColor=colors.HexColor('#1B4F72'),  # أزرق داكن
+    )
+    
+    styles['section_header_style'] = ParagraphStyle(
+        'SectionHeader',
+        fontName='ArabicBold',
+        fontSize=14,
+        leading=18,
+        alignment=1,  # center alignment
+        rightIndent=0,
+        leftIndent=0,
+        spaceBefore=8,
+        spaceAfter=8,
+        textColor=colors.HexColor('#2874A6'),  # أزرق فاتح
+        borderColor=colors.HexColor('#2874A6'),
+        borderWidth=1,
+        borderPadding=5,
+    )
+    
+    # نمط لكل تقييم بلونه
+    styles['assessment_styles'] = {
+        label: ParagraphStyle('Assessment', parent=styles['arabic_style'], textColor=color)
+        for _, label, color in ASSESSMENTS
+    }
+    
+    styles['footer_style'] = ParagraphStyle(
+        'Footer',
+        parent=styles['arabic_style'],
+        alignment=1,  # center alignment
+        textColor=colors.grey
+    )
+    
+    return styles
+
+def get_styles():
+    global _styles
+    with _init_lock:
+        if _styles is None:
+            _styles = _create_styles()
+        return _styles
+
+def get_report_generator():
+    """مولد التقارير المشترك داخل العملية (آمن للاستخدام من عدة خيوط)"""
+    global _shared_generator
+    if _shared_generator is None:
+        generator = ReportGenerator()
+        with _init_lock:
+            if _shared_generator is None:
+                _shared_generator = generator
+    return _shared_generator
+
+def warm_up():
+    """تحميل الخطوط والأنماط مسبقاً (يستدعى في عملية gunicorn الرئيسية قبل إنشاء العمال)"""
+    return get_report_generator()
 
 class ReportGenerator:
-    def __init__(self):
+    def __init__(self, thumbnails=None, max_bytes=None):
         """تهيئة مولد التقارير"""
-        # تهيئة الخطوط العربية
-        pdfmetrics.registerFont(TTFont('Arabic', 'static/fonts/NotoSansArabic-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('ArabicBold', 'static/fonts/NotoSansArabic-Bold.ttf'))
-        
-        # إنشاء أنماط النص
-        self.arabic_style = ParagraphStyle(
-            'Arabic',
-            fontName='Arabic',
-            fontSize=11,
-            leading=16,
-            alignment=1,  # center alignment
-            rightIndent=0,
-            leftIndent=0,
-            spaceBefore=0,
-            spaceAfter=0,
-            textColor=colors.black,
-        )
+        self.thumbnails = thumbnails or ThumbnailStore(THUMBNAILS_DIR)
+        self.max_bytes = max_bytes or REPORT_MAX_BYTES
         
-        self.arabic_bold_style = ParagraphStyle(
-            'ArabicBold',
-            fontName='ArabicBold',
-            fontSize=14,
-            leading=20,
-            alignment=1,  # center alignment
-            rightIndent=0,
-            leftIndent=0,
-            spaceBefore=6,
-            spaceAfter=6,
-            textColor=colors.black,
-        )
-        
-        self.header_style = ParagraphStyle(
-            'Header',
-            fontName='ArabicBold',
-            fontSize=18,
-            leading=22,
-            alignment=1,  # center alignment
-            rightIndent=0,
-            leftIndent=0,
-            spaceBefore=12,
-            spaceAfter=12,
-            textColor=colors.HexColor('#1B4F72'),  # أزرق داكن
-        )
+        # تهيئة الخطوط العربية (مرة واحدة لكل عملية)
+        register_fonts()
         
-        self.section_header_style = ParagraphStyle(
-            'SectionHeader',
-            fontName='ArabicBold',
-            fontSize=14,
-            leading=18,
-            alignment=1,  # center alignment
-            rightIndent=0,
-            leftIndent=0,
-            spaceBefore=8,
-            spaceAfter=8,
-            textColor=colors.HexColor('#2874A6'),  # أزرق فاتح
-            borderColor=colors.HexColor('#2874A6'),
-            borderWidth=1,
-            borderPadding=5,
-        )
+        # أنماط النص المشتركة
+        styles = get_styles()
+        self.arabic_style = styles['arabic_style']
+        self.arabic_bold_style = styles['arabic_bold_style']
+        self.header_style = styles['header_style']
+        self.section_header_style = styles['section_header_style']
+        self.assessment_styles = styles['assessment_styles']
+        self.footer_style = styles['footer_style']
         
     def _process_arabic_text(self, text):
         """معالجة النص العربي للعرض الصحيح"""
@@ -80,17 +222,20 @@ class ReportGenerator:
         try:
             # تحويل النص إلى UTF-8
             text = str(text)
-            # معالجة النص العربي
-            reshaped_text = arabic_reshaper.reshape(text)
-            # تحويل اتجاه النص
-            bidi_text = get_display(reshaped_text)
-            return bidi_text
+            return shape_arabic_text(text)
         except Exception as e:
             print(f"Error processing Arabic text: {str(e)}")
             return text
 
+    def _process_bullets(self, items):
+        """دمج عناصر القائمة في نص واحد بنقاط ثم معالجته مرة واحدة"""
+        items = [str(item) for item in items if item]
+        if not items:
+            return ""
+        return self._process_arabic_text(" • " + "\n • ".join(items))
+
     def _process_patient_data(self, patient):
-        """معالجة بيانات المريض للعرض الصحيح في PDF"""
+        """معالجة بيانات المريض للعرض الصحيح في PDF (كل نص يعالج مرة واحدة فقط)"""
         data = {
             'name': self._process_arabic_text(patient.name),
             'age': patient.age,
@@ -98,9 +243,9 @@ class ReportGenerator:
             'phone': patient.phone,
             'email': patient.email,
             'visit_date': patient.visit_date.strftime('%Y-%m-%d %H:%M'),
-            'visit_reasons': [self._process_arabic_text(reason) for reason in patient.visit_reasons if reason],
-            'symptoms': [self._process_arabic_text(symptom) for symptom in patient.symptoms if symptom],
-            'medical_history': [self._process_arabic_text(item) for item in patient.medical_history if item],
+            'visit_reasons': self._process_bullets(patient.visit_reasons),
+            'symptoms': self._process_bullets(patient.symptoms),
+            'medical_history': self._process_bullets(patient.medical_history),
             'diagnoses': [],
             'treatment_plans': [],
             'future_notes': []
@@ -134,253 +279,363 @@ class ReportGenerator:
         processed_results = []
         for result in results:
             processed_result = {
-                'filename': self._process_arabic_text(result['filename']),
+                'title': self._process_arabic_text(f"تحليل الصورة: {result['filename']}"),
                 'image_type': result['image_type'],
-                'scores': result['scores'],
+                'image_id': result.get('image_id'),
+                'scores': [],
                 'recommendations': [
-                    self._process_arabic_text(rec) for rec in result['recommendations']
+                    self._process_arabic_text(f"• {rec}") for rec in result['recommendations']
                 ]
             }
+            
+            for condition, score in result['scores'].items():
+                # تحديد التقييم بناءً على الدرجة
+                score_value = int(score * 100)
+                assessment = next(label for threshold, label, _ in ASSESSMENTS if score_value >= threshold)
+                processed_result['scores'].append({
+                    'condition': self._process_arabic_text(CONDITION_NAMES.get(condition, condition)),
+                    'score': score_value,
+                    'assessment': self._process_arabic_text(assessment),
+                    'style': self.assessment_styles[assessment]
+                })
+            
             processed_results.append(processed_result)
         return processed_results
     
     def generate_report(self, patient, analysis_results, output_dir):
-        """إنشاء تقرير PDF"""
+        """
+        إنشاء تقرير PDF وحفظه في مخزن التقارير باسم فريد مشتق من محتواه، وإرجاع مساره
+        إذا تم إنشاء تقرير لنفس البيانات من قبل يعاد مساره مباشرة
+        """
+        store = get_report_store(output_dir)
+        cache_key = self.report_cache_key(patient, analysis_results)
         try:
-            # معالجة البيانات للعرض الصحيح
-            processed_patient = self._process_patient_data(patient)
-            processed_results = self._process_analysis_results(analysis_results)
-            
-            # إنشاء اسم الملف
-            filename = f"dental_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            output_path = os.path.join(output_dir, filename)
-            
-            # إعداد مستند PDF
-            doc = SimpleDocTemplate(
-                output_path,
-                pagesize=A4,
-                rightMargin=40,
-                leftMargin=40,
-                topMargin=40,
-                bottomMargin=40,
-                encoding='UTF-8'
+            cached_path = store.cached(cache_key)
+            if cached_path:
+                return cached_path
+        except Exception as e:
+            print(f"Error reading report cache: {str(e)}")
+        
+        pdf_bytes = self.render_report(patient, analysis_results)
+        if pdf_bytes is None:
+            return None
+        
+        try:
+            return store.save(self.report_filename(pdf_bytes), pdf_bytes, patient=patient.name, cache_key=cache_key)
+        except Exception as e:
+            print(f"Error saving PDF report: {str(e)}")
+            return None
+
+    def report_cache_key(self, patient, analysis_results):
+        """
+        بصمة ثابتة لبيانات التقرير: حقول المريض ونتائج التحليل ونسخة التصميم
+        (بدون تواريخ الزيارة والإضافة لأنها تتغير مع كل طلب)
+        """
+        canonical = {
+            'version': REPORT_TEMPLATE_VERSION,
+            'max_bytes': self.max_bytes,
+            'patient': {
+                'name': patient.name,
+                'age': patient.age,
+                'gender': patient.gender,
+                'phone': patient.phone,
+                'email': patient.email,
+                'visit_reasons': patient.visit_reasons,
+                'symptoms': patient.symptoms,
+                'medical_history': patient.medical_history,
+                'diagnoses': [diagnosis['findings'] for diagnosis in patient.diagnoses],
+                'treatment_plans': [plan['plan'] for plan in patient.treatment_plans],
+                'future_notes': [note['note'] for note in patient.future_notes]
+            },
+            'analysis_results': analysis_results
+        }
+        payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def report_filename(pdf_bytes):
+        """اسم ملف التقرير: التاريخ والوقت متبوعان ببصمة المحتوى (لا يتكرر بين العمال)"""
+        digest = hashlib.sha256(pdf_bytes).hexdigest()[:16]
+        return f"dental_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{digest}.pdf"
+
+    def render_report(self, patient, analysis_results):
+        """إنشاء تقرير PDF في الذاكرة وإرجاع محتواه كبايتات"""
+        try:
+            return self._render_within_budget(
+                lambda level: self.build_story(patient, analysis_results, level),
+                self.max_bytes,
+                [result.get('image_id') for result in analysis_results]
             )
+        except Exception as e:
+            print(f"Error generating PDF report: {str(e)}")
+            return None
+
+    def render_reports(self, reports):
+        """
+        دمج عدة تقارير في ملف PDF واحد (كل تقرير يبدأ في صفحة جديدة)
+        reports قائمة من (المريض، نتائج التحليل)
+        """
+        try:
+            def build(level):
+                story = []
+                for patient, analysis_results in reports:
+                    if story:
+                        story.append(PageBreak())
+                    story.extend(self.build_story(patient, analysis_results, level))
+                return story
             
-            # إنشاء محتوى التقرير
-            story = []
-            
-            # إضافة الشعار والعنوان
-            story.append(Paragraph(self._process_arabic_text("عيادة دكتور محمد"), self.header_style))
-            story.append(Paragraph(self._process_arabic_text("أخصائي طب وجراحة الفم والأسنان"), self.arabic_bold_style))
-            story.append(Spacer(1, 20))
-            
-            # إضافة معلومات التقرير
-            report_info = self._process_arabic_text(f"تقرير التشخيص الطبي - {processed_patient['visit_date']}")
-            story.append(Paragraph(report_info, self.section_header_style))
-            story.append(Spacer(1, 20))
-            
-            # إضافة معلومات المريض
-            story.append(Paragraph(self._process_arabic_text("معلومات المريض"), self.section_header_style))
+            image_ids = [result.get('image_id') for _, analysis_results in reports for result in analysis_results]
+            return self._render_within_budget(build, self.max_bytes * len(reports), image_ids)
+        except Exception as e:
+            print(f"Error generating merged PDF report: {str(e)}")
+            return None
+
+    def _render_within_budget(self, build, max_bytes, image_ids=()):
+        """
+        إنشاء PDF بأفضل مستوى للصور المصغرة يبقي الحجم ضمن الحد الأقصى
+        build(level) تعيد محتوى التقرير، والمستوى الأخير يعني بدون صور
+        """
+        # البدء من المستوى المقدر من أحجام الصور، وإعادة البناء بمستوى أقل فقط إذا تجاوز النص الحد
+        for level in range(self._estimate_level(image_ids, max_bytes), len(THUMBNAIL_LEVELS) + 1):
+            story = build(level)
+            # doc.build يستهلك عناصر القائمة لذلك يتم الفحص قبل البناء
+            has_images = any(isinstance(item, Image) for item in story)
+            pdf_bytes = self._build_pdf(story)
+            if len(pdf_bytes) <= max_bytes or not has_images:
+                return pdf_bytes
+        return pdf_bytes
+
+    def _estimate_level(self, image_ids, max_bytes):
+        """
+        أول مستوى يمكن أن يبقى ضمن الحد دون بناء الملف: بايتات JPEG تضمن في الملف كما هي
+        (مرة واحدة لكل صورة) فمجموعها حد أدنى لحجم التقرير
+        """
+        image_ids = {image_id for image_id in image_ids if image_id}
+        for level, (max_side, quality) in enumerate(THUMBNAIL_LEVELS):
+            size = 0
+            for image_id in image_ids:
+                data = self.thumbnails.load(image_id, max_side, quality)
+                size += len(data) if data else 0
+            if size <= max_bytes:
+                return level
+        return len(THUMBNAIL_LEVELS)
+
+    def _thumbnail(self, image_id, level):
+        """صورة مصغرة للتقرير بأبعاد عرض محدودة، أو None إذا لم تتوفر"""
+        if not image_id or level >= len(THUMBNAIL_LEVELS):
+            return None
+        
+        max_side, quality = THUMBNAIL_LEVELS[level]
+        data = self.thumbnails.load(image_id, max_side, quality)
+        if data is None:
+            return None
+        
+        # الصور المتطابقة لها نفس البايتات فيحفظها reportlab ككائن واحد في الملف
+        width, height = ImageReader(io.BytesIO(data)).getSize()
+        scale = min(THUMBNAIL_WIDTH / width, THUMBNAIL_HEIGHT / height)
+        return Image(io.BytesIO(data), width=width * scale, height=height * scale)
+
+    def _build_pdf(self, story):
+        # إعداد مستند PDF في الذاكرة (ضغط محتوى الصفحات، والخطوط تضمن كمجموعات جزئية)
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            rightMargin=40,
+            leftMargin=40,
+            topMargin=40,
+            bottomMargin=40,
+            encoding='UTF-8',
+            pageCompression=1
+        )
+        
+        # إنشاء التقرير
+        with timer('report_build'), _build_lock:
+            doc.build(story)
+        
+        return buffer.getvalue()
+
+    def build_story(self, patient, analysis_results, thumbnail_level=0):
+        """عناصر محتوى تقرير مريض واحد"""
+        # معالجة البيانات للعرض الصحيح
+        with timer('report_text_shaping'):
+            processed_patient = self._process_patient_data(patient)
+            processed_results = self._process_analysis_results(analysis_results)
+        
+        # إنشاء محتوى التقرير
+        story_start = time.perf_counter()
+        story = []
+        
+        # إضافة الشعار والعنوان
+        story.append(Paragraph(self._process_arabic_text("عيادة دكتور محمد"), self.header_style))
+        story.append(Paragraph(self._process_arabic_text("أخصائي طب وجراحة الفم والأسنان"), self.arabic_bold_style))
+        story.append(Spacer(1, 20))
+        
+        # إضافة معلومات التقرير
+        report_info = self._process_arabic_text(f"تقرير التشخيص الطبي - {processed_patient['visit_date']}")
+        story.append(Paragraph(report_info, self.section_header_style))
+        story.append(Spacer(1, 20))
+        
+        # إضافة معلومات المريض
+        story.append(Paragraph(self._process_arabic_text("معلومات المريض"), self.section_header_style))
+        story.append(Spacer(1, 10))
+        
+        patient_data = [
+            [Paragraph(self._process_arabic_text("الاسم:"), self.arabic_bold_style),
+             Paragraph(processed_patient['name'], self.arabic_style)],
+            [Paragraph(self._process_arabic_text("العمر:"), self.arabic_bold_style),
+             Paragraph(str(processed_patient['age']), self.arabic_style)],
+            [Paragraph(self._process_arabic_text("الجنس:"), self.arabic_bold_style),
+             Paragraph(processed_patient['gender'], self.arabic_style)],
+            [Paragraph(self._process_arabic_text("رقم الهاتف:"), self.arabic_bold_style),
+             Paragraph(processed_patient['phone'], self.arabic_style)]
+        ]
+        
+        if processed_patient['email']:
+            patient_data.append([
+                Paragraph(self._process_arabic_text("البريد الإلكتروني:"), self.arabic_bold_style),
+                Paragraph(processed_patient['email'], self.arabic_style)
+            ])
+        
+        # إنشاء جدول معلومات المريض
+        patient_table = Table(patient_data, colWidths=[120, 360])
+        patient_table.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F4F6F7')),  # رمادي فاتح
+            ('LEFTPADDING', (0, 0), (-1, -1), 8),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+            ('TOPPADDING', (0, 0), (-1, -1), 5),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+        ]))
+        
+        story.append(patient_table)
+        story.append(Spacer(1, 20))
+        
+        # إضافة سبب الزيارة والأعراض
+        if processed_patient['visit_reasons'] or processed_patient['symptoms']:
+            story.append(Paragraph(self._process_arabic_text("سبب الزيارة والأعراض"), self.section_header_style))
             story.append(Spacer(1, 10))
             
-            patient_data = [
-                [Paragraph(self._process_arabic_text("الاسم:"), self.arabic_bold_style),
-                 Paragraph(self._process_arabic_text(processed_patient['name']), self.arabic_style)],
-                [Paragraph(self._process_arabic_text("العمر:"), self.arabic_bold_style),
-                 Paragraph(str(processed_patient['age']), self.arabic_style)],
-                [Paragraph(self._process_arabic_text("الجنس:"), self.arabic_bold_style),
-                 Paragraph(self._process_arabic_text(processed_patient['gender']), self.arabic_style)],
-                [Paragraph(self._process_arabic_text("رقم الهاتف:"), self.arabic_bold_style),
-                 Paragraph(processed_patient['phone'], self.arabic_style)]
-            ]
+            visit_data = []
+            if processed_patient['visit_reasons']:
+                visit_data.append([
+                    Paragraph(self._process_arabic_text("سبب الزيارة:"), self.arabic_bold_style),
+                    Paragraph(processed_patient['visit_reasons'], self.arabic_style)
+                ])
             
-            if processed_patient['email']:
-                patient_data.append([
-                    Paragraph(self._process_arabic_text("البريد الإلكتروني:"), self.arabic_bold_style),
-                    Paragraph(processed_patient['email'], self.arabic_style)
+            if processed_patient['symptoms']:
+                visit_data.append([
+                    Paragraph(self._process_arabic_text("الأعراض:"), self.arabic_bold_style),
+                    Paragraph(processed_patient['symptoms'], self.arabic_style)
                 ])
             
-            # إنشاء جدول معلومات المريض
-            patient_table = Table(patient_data, colWidths=[120, 360])
-            patient_table.setStyle(TableStyle([
+            visit_table = Table(visit_data, colWidths=[120, 360])
+            visit_table.setStyle(TableStyle([
                 ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
                 ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F4F6F7')),  # رمادي فاتح
+                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F4F6F7')),
                 ('LEFTPADDING', (0, 0), (-1, -1), 8),
                 ('RIGHTPADDING', (0, 0), (-1, -1), 8),
                 ('TOPPADDING', (0, 0), (-1, -1), 5),
                 ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
             ]))
             
-            story.append(patient_table)
+            story.append(visit_table)
             story.append(Spacer(1, 20))
+        
+        # إضافة التاريخ الطبي
+        if processed_patient['medical_history']:
+            story.append(Paragraph(self._process_arabic_text("التاريخ الطبي"), self.section_header_style))
+            story.append(Spacer(1, 10))
             
-            # إضافة سبب الزيارة والأعراض
-            if processed_patient['visit_reasons'] or processed_patient['symptoms']:
-                story.append(Paragraph(self._process_arabic_text("سبب الزيارة والأعراض"), self.section_header_style))
-                story.append(Spacer(1, 10))
+            story.append(Paragraph(processed_patient['medical_history'], self.arabic_style))
+            story.append(Spacer(1, 20))
+        
+        # إضافة نتائج التحليل
+        if processed_results:
+            story.append(Paragraph(self._process_arabic_text("نتائج التحليل والتشخيص"), self.section_header_style))
+            story.append(Spacer(1, 10))
+            
+            for result in processed_results:
+                # إضافة اسم الملف
+                story.append(Paragraph(result['title'], self.arabic_bold_style))
+                story.append(Spacer(1, 5))
                 
-                visit_data = []
-                if processed_patient['visit_reasons']:
-                    visit_data.append([
-                        Paragraph(self._process_arabic_text("سبب الزيارة:"), self.arabic_bold_style),
-                        Paragraph(self._process_arabic_text(" • " + "\n • ".join(processed_patient['visit_reasons'])), self.arabic_style)
-                    ])
+                # إضافة الصورة المصغرة
+                thumbnail = self._thumbnail(result['image_id'], thumbnail_level)
+                if thumbnail is not None:
+                    story.append(thumbnail)
+                    story.append(Spacer(1, 5))
                 
-                if processed_patient['symptoms']:
-                    visit_data.append([
-                        Paragraph(self._process_arabic_text("الأعراض:"), self.arabic_bold_style),
-                        Paragraph(self._process_arabic_text(" • " + "\n • ".join(processed_patient['symptoms'])), self.arabic_style)
+                # إضافة الدرجات
+                scores_data = [
+                    [Paragraph(self._process_arabic_text("الحالة"), self.arabic_bold_style),
+                     Paragraph(self._process_arabic_text("الدرجة"), self.arabic_bold_style),
+                     Paragraph(self._process_arabic_text("التقييم"), self.arabic_bold_style)]
+                ]
+                
+                for score in result['scores']:
+                    scores_data.append([
+                        Paragraph(score['condition'], self.arabic_style),
+                        Paragraph(f"{score['score']}%", self.arabic_style),
+                        Paragraph(score['assessment'], score['style'])
                     ])
                 
-                visit_table = Table(visit_data, colWidths=[120, 360])
-                visit_table.setStyle(TableStyle([
-                    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                scores_table = Table(scores_data, colWidths=[200, 100, 180])
+                scores_table.setStyle(TableStyle([
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
                     ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F4F6F7')),
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F4F6F7')),
                     ('LEFTPADDING', (0, 0), (-1, -1), 8),
                     ('RIGHTPADDING', (0, 0), (-1, -1), 8),
                     ('TOPPADDING', (0, 0), (-1, -1), 5),
                     ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
                 ]))
                 
-                story.append(visit_table)
-                story.append(Spacer(1, 20))
-            
-            # إضافة التاريخ الطبي
-            if processed_patient['medical_history']:
-                story.append(Paragraph(self._process_arabic_text("التاريخ الطبي"), self.section_header_style))
-                story.append(Spacer(1, 10))
+                story.append(scores_table)
+                story.append(Spacer(1, 15))
                 
-                history_text = " • " + "\n • ".join(processed_patient['medical_history'])
-                story.append(Paragraph(self._process_arabic_text(history_text), self.arabic_style))
-                story.append(Spacer(1, 20))
-            
-            # إضافة نتائج التحليل
-            if processed_results:
-                story.append(Paragraph(self._process_arabic_text("نتائج التحليل والتشخيص"), self.section_header_style))
-                story.append(Spacer(1, 10))
-                
-                for result in processed_results:
-                    # إضافة اسم الملف
-                    story.append(Paragraph(
-                        self._process_arabic_text(f"تحليل الصورة: {result['filename']}"),
-                        self.arabic_bold_style
-                    ))
+                # إضافة التوصيات
+                if result['recommendations']:
+                    story.append(Paragraph(self._process_arabic_text("التوصيات:"), self.arabic_bold_style))
                     story.append(Spacer(1, 5))
-                    
-                    # إضافة الدرجات
-                    scores_data = [
-                        [Paragraph(self._process_arabic_text("الحالة"), self.arabic_bold_style),
-                         Paragraph(self._process_arabic_text("الدرجة"), self.arabic_bold_style),
-                         Paragraph(self._process_arabic_text("التقييم"), self.arabic_bold_style)]
-                    ]
-                    
-                    for condition, score in result['scores'].items():
-                        condition_name = {
-                            'cavity': 'تسوس',
-                            'gum_inflammation': 'التهاب لثة',
-                            'plaque': 'تراكم البلاك',
-                            'erosion': 'تآكل المينا',
-                            'sensitivity': 'حساسية الأسنان',
-                            'overall_health': 'الصحة العامة'
-                        }.get(condition, condition)
-                        
-                        # تحديد التقييم بناءً على الدرجة
-                        score_value = int(score * 100)
-                        if score_value >= 80:
-                            assessment = "خطير"
-                            color = colors.red
-                        elif score_value >= 60:
-                            assessment = "متوسط"
-                            color = colors.orange
-                        elif score_value >= 40:
-                            assessment = "مقبول"
-                            color = colors.yellow
-                        else:
-                            assessment = "جيد"
-                            color = colors.green
-                        
-                        scores_data.append([
-                            Paragraph(self._process_arabic_text(condition_name), self.arabic_style),
-                            Paragraph(f"{score_value}%", self.arabic_style),
-                            Paragraph(self._process_arabic_text(assessment), 
-                                    ParagraphStyle('Assessment', parent=self.arabic_style, textColor=color))
-                        ])
-                    
-                    scores_table = Table(scores_data, colWidths=[200, 100, 180])
-                    scores_table.setStyle(TableStyle([
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F4F6F7')),
-                        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-                        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-                        ('TOPPADDING', (0, 0), (-1, -1), 5),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-                    ]))
-                    
-                    story.append(scores_table)
+                    for rec in result['recommendations']:
+                        story.append(Paragraph(rec, self.arabic_style))
                     story.append(Spacer(1, 15))
-                    
-                    # إضافة التوصيات
-                    if result['recommendations']:
-                        story.append(Paragraph(self._process_arabic_text("التوصيات:"), self.arabic_bold_style))
-                        story.append(Spacer(1, 5))
-                        for rec in result['recommendations']:
-                            story.append(Paragraph(
-                                self._process_arabic_text(f"• {rec}"),
-                                self.arabic_style
-                            ))
-                        story.append(Spacer(1, 15))
-            
-            # إضافة خطة العلاج
-            if processed_patient['treatment_plans']:
-                story.append(Paragraph(self._process_arabic_text("خطة العلاج"), self.section_header_style))
-                story.append(Spacer(1, 10))
-                
-                for plan in processed_patient['treatment_plans']:
-                    story.append(Paragraph(
-                        self._process_arabic_text(plan['plan']),
-                        self.arabic_style
-                    ))
-                story.append(Spacer(1, 20))
-            
-            # إضافة ملاحظات المتابعة
-            if processed_patient['future_notes']:
-                story.append(Paragraph(self._process_arabic_text("ملاحظات المتابعة"), self.section_header_style))
-                story.append(Spacer(1, 10))
-                
-                for note in processed_patient['future_notes']:
-                    story.append(Paragraph(
-                        self._process_arabic_text(note['note']),
-                        self.arabic_style
-                    ))
-                story.append(Spacer(1, 20))
-            
-            # إضافة التذييل
-            story.append(Spacer(1, 30))
-            footer_text = f"""
-            {self._process_arabic_text('تم إنشاء هذا التقرير بواسطة نظام التحليل الذكي للأسنان')}
-            {self._process_arabic_text('تاريخ التقرير:')} {datetime.now().strftime('%Y-%m-%d %H:%M')}
-            
-            {self._process_arabic_text('ملاحظة: هذا التقرير إرشادي ويجب مراجعة الطبيب المختص للتشخيص النهائي')}
-            """
-            footer = Paragraph(footer_text, ParagraphStyle(
-                'Footer',
-                parent=self.arabic_style,
-                alignment=1,  # center alignment
-                textColor=colors.grey
-            ))
-            story.append(footer)
-            
-            # إنشاء التقرير
-            doc.build(story)
+        
+        # إضافة خطة العلاج
+        if processed_patient['treatment_plans']:
+            story.append(Paragraph(self._process_arabic_text("خطة العلاج"), self.section_header_style))
+            story.append(Spacer(1, 10))
             
-            return output_path
+            for plan in processed_patient['treatment_plans']:
+                story.append(Paragraph(plan['plan'], self.arabic_style))
+            story.append(Spacer(1, 20))
+        
+        # إضافة ملاحظات المتابعة
+        if processed_patient['future_notes']:
+            story.append(Paragraph(self._process_arabic_text("ملاحظات المتابعة"), self.section_header_style))
+            story.append(Spacer(1, 10))
             
-        except Exception as e:
-            print(f"Error generating PDF report: {str(e)}")
-            return None
+            for note in processed_patient['future_notes']:
+                story.append(Paragraph(note['note'], self.arabic_style))
+            story.append(Spacer(1, 20))
+        
+        # إضافة التذييل
+        story.append(Spacer(1, 30))
+        footer_text = f"""
+        {self._process_arabic_text('تم إنشاء هذا التقرير بواسطة نظام التحليل الذكي للأسنان')}
+        {self._process_arabic_text('تاريخ التقرير:')} {datetime.now().strftime('%Y-%m-%d %H:%M')}
+        
+        {self._process_arabic_text('ملاحظة: هذا التقرير إرشادي ويجب مراجعة الطبيب المختص للتشخيص النهائي')}
+        """
+        footer = Paragraph(footer_text, self.footer_style)
+        story.append(footer)
+        
+        observe('report_story', time.perf_counter() - story_start)
+        
+        return story
@@ -0,0 +1,220 @@
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+import report_generator
+from patient import Patient
+
+TICKET_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class QueueFullError(Exception):
+    """طابور إنشاء التقارير ممتلئ"""
+
+
+def _init_worker(metrics_dir=None):
+    # تحميل الخطوط والأنماط مرة واحدة في كل عملية من عمليات المجمع
+    report_generator.warm_up()
+    metrics.configure_worker(metrics_dir)
+
+
+def _render(data, output_dir):
+    """إنشاء تقرير في عملية منفصلة وإرجاع اسم الملف"""
+    patient = Patient.from_report_data(data)
+    output_path = report_generator.get_report_generator().generate_report(
+        patient=patient,
+        analysis_results=data.get('analysis_results', []),
+        output_dir=output_dir
+    )
+    if not output_path:
+        raise ValueError("فشل في إنشاء التقرير")
+    return os.path.basename(output_path)
+
+
+class ReportRenderPool:
+    """
+    مجمع عمليات لإنشاء تقارير PDF في الخلفية
+    حالة كل تذكرة تحفظ كملف JSON في مجلد مشترك حتى يتمكن أي عامل gunicorn من الإجابة عنها
+
+    المهلة تطبق على كل طلب حتى أثناء تنفيذه: عند انتهائها تفشل التذكرة ويحرر مكانها في الطابور،
+    وإذا كان الطلب قد بدأ يستبدل المجمع بمجمع جديد وتنهى عمليات المجمع القديم بعد انتهاء
+    باقي طلباته (حتى لا تبقى عملية معلقة تحجز مكاناً إلى الأبد)
+    """
+
+    def __init__(self, output_dir, tickets_dir, workers=2, max_pending=16, timeout=120, ticket_ttl=24 * 3600):
+        self.output_dir = output_dir
+        self.tickets_dir = tickets_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.ticket_ttl = ticket_ttl
+
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        # الطلبات غير المنتهية: future -> (التذكرة، الحالة، المجمع). من يحذف الطلب من هنا أولاً
+        # (اكتمال الطلب أو انتهاء المهلة) هو من يحرر مكانه ويكتب نتيجة التذكرة
+        self._jobs = {}
+        # المجمعات المستبدلة بسبب طلب معلق (تنهى عملياتها عند انتهاء باقي طلباتها)
+        self._retired = set()
+        self._submitted = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.tickets_dir, exist_ok=True)
+
+    def _get_executor(self):
+        # المجمع ينشأ عند أول طلب في كل عملية، و spawn يتجنب نسخ خيوط العامل الحالي
+        if self._pid != os.getpid():
+            # بعد fork لا تنتقل عمليات المجمع ولا طلباته إلى العملية الابن
+            self._executor = None
+            self._pid = os.getpid()
+            self._pending = 0
+            self._jobs = {}
+            self._retired = set()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(metrics.REGISTRY.directory,)
+            )
+        return self._executor
+
+    def _ticket_path(self, ticket):
+        return os.path.join(self.tickets_dir, f'{ticket}.json')
+
+    def _write_ticket(self, ticket, state):
+        path = self._ticket_path(ticket)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    def submit(self, data):
+        """إضافة طلب تقرير إلى المجمع وإرجاع رقم التذكرة"""
+        ticket = uuid.uuid4().hex
+        now = time.time()
+        state = {'status': 'pending', 'created': now, 'deadline': now + self.timeout}
+
+        # الإرسال داخل القفل حتى لا يستبدل المجمع بين اختياره وإرسال الطلب إليه
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= self.max_pending:
+                raise QueueFullError("طابور إنشاء التقارير ممتلئ، يرجى المحاولة لاحقاً")
+            try:
+                future = executor.submit(_render, data, self.output_dir)
+            except BrokenProcessPool:
+                self._executor = None
+                executor = self._get_executor()
+                future = executor.submit(_render, data, self.output_dir)
+            self._jobs[future] = (ticket, state, executor)
+            self._pending += 1
+            self._submitted += 1
+            purge = self._submitted % 100 == 0
+
+        # حالة التذكرة تكتب قبل إضافة done حتى لا تكتب فوق نتيجة طلب اكتمل بسرعة
+        self._write_ticket(ticket, state)
+
+        # انتهاء المهلة: إلغاء الطلب إذا لم يبدأ، أو إفشاله وإعادة تشغيل المجمع إذا كان معلقاً
+        timer = threading.Timer(self.timeout, self._expire, args=(future,))
+        timer.daemon = True
+        timer.start()
+
+        def done(future):
+            timer.cancel()
+            with self._lock:
+                job = self._jobs.pop(future, None)
+                if job is None:
+                    # انتهت المهلة قبل اكتمال الطلب وتم تحديث التذكرة
+                    return
+                self._pending -= 1
+            if future.cancelled():
+                result = dict(state, status='error', error='انتهت مهلة إنشاء التقرير')
+            elif future.exception() is not None:
+                if isinstance(future.exception(), BrokenProcessPool):
+                    # توقفت إحدى عمليات المجمع بشكل مفاجئ: إنشاء مجمع جديد عند الطلب التالي
+                    with self._lock:
+                        if self._executor is executor:
+                            self._executor = None
+                print(f"Error rendering report {ticket}: {str(future.exception())}")
+                result = dict(state, status='error', error=str(future.exception()))
+            elif time.time() > state['deadline']:
+                result = dict(state, status='error', error='انتهت مهلة إنشاء التقرير')
+            else:
+                result = dict(state, status='done', filename=future.result(), finished=time.time())
+            self._finish_ticket(ticket, result)
+            self._stop_if_retired(executor)
+
+        future.add_done_callback(done)
+
+        if purge:
+            self.purge()
+        return ticket
+
+    def _finish_ticket(self, ticket, result):
+        try:
+            self._write_ticket(ticket, result)
+        except OSError as e:
+            print(f"Error writing report ticket {ticket}: {str(e)}")
+
+    def _expire(self, future):
+        """انتهاء مهلة طلب: تحرير مكانه وإفشال التذكرة وإيقاف المجمع إذا كان الطلب قد بدأ"""
+        if future.cancel():
+            # لم يبدأ بعد: done يكمل التذكرة
+            return
+        with self._lock:
+            job = self._jobs.pop(future, None)
+            if job is None:
+                return
+            self._pending -= 1
+            ticket, state, executor = job
+            # الطلب قيد التنفيذ ولا يمكن إيقافه وحده: الطلبات الجديدة تذهب إلى مجمع جديد
+            if self._executor is executor:
+                self._executor = None
+            self._retired.add(executor)
+        print(f"Report {ticket} timed out after {self.timeout}s, restarting render pool")
+        self._finish_ticket(ticket, dict(state, status='error', error='انتهت مهلة إنشاء التقرير'))
+        self._stop_if_retired(executor)
+
+    def _stop_if_retired(self, executor):
+        # إنهاء عمليات المجمع المستبدل بعد انتهاء (أو انتهاء مهلة) كل طلباته
+        with self._lock:
+            if executor not in self._retired or any(job[2] is executor for job in self._jobs.values()):
+                return
+            self._retired.discard(executor)
+        # ProcessPoolExecutor لا يوفر طريقة لإيقاف عملية معلقة، لذلك تنهى عملياته مباشرة
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self, ticket):
+        """حالة التذكرة أو None إذا لم توجد"""
+        if not TICKET_PATTERN.fullmatch(ticket):
+            return None
+        try:
+            with open(self._ticket_path(ticket)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if state['status'] == 'pending' and time.time() > state['deadline']:
+            state = dict(state, status='error', error='انتهت مهلة إنشاء التقرير')
+        return state
+
+    def purge(self):
+        """حذف التذاكر الأقدم من مدة الاحتفاظ"""
+        cutoff = time.time() - self.ticket_ttl
+        for name in os.listdir(self.tickets_dir):
+            path = os.path.join(self.tickets_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
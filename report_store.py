@@ -0,0 +1,277 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+# إعدادات الاحتفاظ مشتركة بين الخادم ومجمع إنشاء التقارير وأداة الدفعات
+REPORTS_MAX_AGE = int(os.getenv('REPORTS_MAX_AGE', 365 * 24 * 3600))  # بالثواني
+REPORTS_MAX_BYTES = int(os.getenv('REPORTS_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+REPORTS_EVICT_INTERVAL = int(os.getenv('REPORTS_EVICT_INTERVAL', 3600))  # بالثواني
+
+# الحد الأقصى لعدد مفاتيح ذاكرة التقارير المتطابقة (يحذف الأقدم استخداماً)
+REPORT_CACHE_ENTRIES = int(os.getenv('REPORT_CACHE_ENTRIES', 10000))
+
+# التحذير عندما تقل المساحة الحرة في القرص عن هذه النسبة
+DISK_FREE_WARNING = 0.10
+
+# الفهرس يحفظ خارج مجلد التقارير حتى لا يمكن تحميله عبر /download_report (يحتوي على أسماء المرضى)
+REPORTS_INDEX_DIR = os.getenv('REPORTS_INDEX_DIR', os.path.join('cache', 'report_index'))
+
+# اسم الفهرس القديم داخل مجلد التقارير (ينقل إلى REPORTS_INDEX_DIR عند أول تشغيل)
+LEGACY_INDEX_NAME = '.index.sqlite3'
+
+# أسماء ملفات التقارير المسموح بتحميلها من المجلد الرئيسي مباشرة (التقارير القديمة)
+LEGACY_REPORT_PATTERN = re.compile(r'^dental_report_[\w-]+\.pdf$')
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def index_path(root, index_dir=REPORTS_INDEX_DIR):
+    """مسار فهرس مجلد التقارير (ملف منفصل لكل مجلد حسب بصمة مساره)"""
+    root = os.path.abspath(root)
+    digest = hashlib.sha256(root.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.abspath(index_dir), f"{os.path.basename(root) or 'reports'}-{digest}.sqlite3")
+
+
+def _migrate_legacy_index(root, path):
+    # نقل الفهرس القديم (وملفات WAL) من مجلد التقارير إذا لم يوجد الفهرس الجديد بعد
+    legacy = os.path.join(root, LEGACY_INDEX_NAME)
+    if os.path.exists(path) or not os.path.exists(legacy):
+        return
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.replace(legacy + suffix, path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def shard_for(report_id):
+    """المجلد الفرعي للتقرير (256 مجلداً موزعة بالتساوي حسب بصمة المعرف)"""
+    return hashlib.sha256(report_id.encode('utf-8')).hexdigest()[:2]
+
+
+class ReportStore:
+    """
+    مخزن ملفات التقارير في مجلدات فرعية مع فهرس SQLite
+    الفهرس يربط معرف التقرير (اسم الملف) بمساره والمريض والحجم ووقت الإنشاء،
+    ويحذف التقارير الأقدم من مدة الاحتفاظ أو الزائدة عن الحجم الأقصى في الخلفية
+    """
+
+    def __init__(self, root, max_age=REPORTS_MAX_AGE, max_bytes=REPORTS_MAX_BYTES,
+                 evict_interval=REPORTS_EVICT_INTERVAL, cache_entries=REPORT_CACHE_ENTRIES,
+                 index_dir=REPORTS_INDEX_DIR):
+        self.root = root
+        self.path = index_path(root, index_dir)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.cache_entries = cache_entries
+        self.trim_every = 100
+
+        self._local = threading.local()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._remembered = 0
+
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _migrate_legacy_index(self.root, self.path)
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                patient TEXT,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS reports_created ON reports (created)")
+        # مفتاح بيانات الطلب -> التقرير الذي تم إنشاؤه لها
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS report_cache (
+                key TEXT PRIMARY KEY,
+                report_id TEXT NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS report_cache_accessed ON report_cache (accessed)")
+        conn.execute("CREATE INDEX IF NOT EXISTS report_cache_report ON report_cache (report_id)")
+
+    def _connection(self):
+        # اتصال لكل خيط ولكل عملية (لا يجوز استخدام اتصال SQLite بعد fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def save(self, report_id, data, patient=None, cache_key=None):
+        """
+        حفظ ملف التقرير في مجلده الفرعي وتسجيله في الفهرس، وإرجاع مساره الكامل
+        cache_key يربط التقرير ببيانات الطلب حتى يعاد استخدامه للطلبات المتطابقة
+        """
+        relative_path = os.path.join(shard_for(report_id), report_id)
+        output_path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        # الكتابة في ملف مؤقت ثم إعادة التسمية حتى لا يقرأ أحد ملفاً غير مكتمل
+        temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, output_path)
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO reports (id, path, patient, size, created) VALUES (?, ?, ?, ?, ?)",
+            (report_id, relative_path, patient, len(data), time.time())
+        )
+        if cache_key and self.cache_entries:
+            self._remember(cache_key, report_id)
+        return output_path
+
+    def cached(self, cache_key):
+        """مسار التقرير الذي تم إنشاؤه لنفس بيانات الطلب، أو None (cache_entries=0 يعطل إعادة الاستخدام)"""
+        if not self.cache_entries:
+            return None
+        conn = self._connection()
+        row = conn.execute("""
+            SELECT r.path FROM report_cache c JOIN reports r ON r.id = c.report_id
+            WHERE c.key = ?
+        """, (cache_key,)).fetchone()
+        if row is None:
+            return None
+
+        output_path = os.path.join(self.root, row[0])
+        if not os.path.exists(output_path):
+            conn.execute("DELETE FROM report_cache WHERE key = ?", (cache_key,))
+            return None
+
+        conn.execute("UPDATE report_cache SET accessed = ? WHERE key = ?", (time.time(), cache_key))
+        return output_path
+
+    def _remember(self, cache_key, report_id):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO report_cache (key, report_id, accessed) VALUES (?, ?, ?)",
+            (cache_key, report_id, time.time())
+        )
+        with self._thread_lock:
+            self._remembered += 1
+            if self._remembered % self.trim_every:
+                return
+
+        # الإبقاء على أحدث المفاتيح استخداماً فقط
+        conn.execute("""
+            DELETE FROM report_cache WHERE key IN (
+                SELECT key FROM report_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.cache_entries,))
+
+    def lookup(self, report_id):
+        """مسار التقرير نسبةً إلى المجلد الرئيسي، أو None إذا لم يوجد"""
+        row = self._connection().execute("SELECT path FROM reports WHERE id = ?", (report_id,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        # التقارير القديمة المحفوظة مباشرة في المجلد الرئيسي قبل استخدام المجلدات الفرعية
+        # (ملفات التقارير فقط، وليس أي ملف آخر في المجلد)
+        if LEGACY_REPORT_PATTERN.match(report_id) and os.path.isfile(os.path.join(self.root, report_id)):
+            return report_id
+        return None
+
+    def evict(self):
+        """حذف التقارير المنتهية الصلاحية ثم الأقدم حتى يصبح الحجم ضمن الحد، وإرجاع عددها"""
+        cutoff = time.time() - self.max_age
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("SELECT id, path FROM reports WHERE created < ?", (cutoff,)).fetchall()
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM reports WHERE created >= ?", (cutoff,)
+            ).fetchone()[0]
+            oldest = []
+            if total > self.max_bytes:
+                # حذف الأقدم حتى الوصول إلى 90% من الحد
+                excess = total - int(self.max_bytes * 0.9)
+                oldest = conn.execute("""
+                    SELECT id, path FROM (
+                        SELECT id, path, size, SUM(size) OVER (
+                            ORDER BY created, id ROWS UNBOUNDED PRECEDING
+                        ) AS running
+                        FROM reports WHERE created >= ?
+                    ) WHERE running - size < ?
+                """, (cutoff, excess)).fetchall()
+            removed = expired + oldest
+            conn.executemany("DELETE FROM reports WHERE id = ?", [(report_id,) for report_id, _ in removed])
+            conn.executemany("DELETE FROM report_cache WHERE report_id = ?", [(report_id,) for report_id, _ in removed])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for _, relative_path in removed:
+            try:
+                os.remove(os.path.join(self.root, relative_path))
+            except FileNotFoundError:
+                pass
+
+        usage = shutil.disk_usage(self.root)
+        if usage.free < usage.total * DISK_FREE_WARNING:
+            print(f"Warning: low disk space for reports: {usage.free // (1024 * 1024)}MB free")
+
+        return len(removed)
+
+    def stats(self):
+        """عدد التقارير وحجمها الكلي والمساحة الحرة في القرص"""
+        count, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports"
+        ).fetchone()
+        cache_entries = self._connection().execute("SELECT COUNT(*) FROM report_cache").fetchone()[0]
+        usage = shutil.disk_usage(self.root)
+        return {
+            'reports': count,
+            'cache_entries': cache_entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'disk_free': usage.free,
+            'disk_total': usage.total
+        }
+
+    def start(self):
+        """تشغيل خيط الحذف الدوري في العملية الحالية (مرة واحدة لكل عملية)"""
+        with self._thread_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # بعد fork لا تنتقل الخيوط إلى العملية الابن
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='report-eviction', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                removed = self.evict()
+                if removed:
+                    print(f"Removed {removed} old reports")
+            except (sqlite3.Error, OSError) as e:
+                print(f"Error evicting reports: {str(e)}")
+            time.sleep(self.evict_interval)
+
+
+def get_report_store(root):
+    """مخزن التقارير المشترك داخل العملية لمجلد معين"""
+    root = os.path.abspath(root)
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = ReportStore(root)
+        return store
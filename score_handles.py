@@ -0,0 +1,223 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ScoreHandleStore:
+    """
+    مخزن الدرجات الخام لكل صورة محللة خلف معرف عشوائي، حتى يعاد حساب الدرجات والتوصيات
+    عبر /rescore عند تغيير معلومات المريض دون رفع الصور وتحليلها مرة أخرى.
+    طبقة LRU داخل العملية وطبقة SQLite مشتركة بين عمال gunicorn، والمعرفات تنتهي بعد ttl ثانية
+    من إنشائها ويحذف الأقدم عند تجاوز max_entries.
+    المعرف يرتبط بمفتاح محتوى الصورة (key) حتى تعيد الصور المخزنة نتائجها نفس المعرف
+    بدلاً من إنشاء معرف جديد في كل رفع
+    """
+
+    def __init__(self, path, memory_entries=4096, max_entries=100000, ttl=2 * 3600, evict_every=100):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+
+        self._memory = OrderedDict()  # المعرف -> (وقت الإنشاء، الدرجات، المفتاح)
+        self._keys = {}  # المفتاح -> المعرف للمعرفات الموجودة في الذاكرة
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = self._connection()
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS score_handles (
+                        handle TEXT PRIMARY KEY,
+                        key TEXT UNIQUE,
+                        scores TEXT NOT NULL,
+                        created REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS score_handles_created ON score_handles (created)")
+
+    def _connection(self):
+        # اتصال منفصل لكل خيط لأن كائنات sqlite3 لا تشارك بين الخيوط
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, scores, key=None):
+        """تخزين الدرجات الخام وإرجاع معرفها (أو المعرف الحالي لنفس المفتاح إذا لم ينته)"""
+        now = time.time()
+        if key is not None:
+            handle = self._reuse(key, now)
+            if handle is not None:
+                return handle
+
+        handle = secrets.token_urlsafe(16)
+        scores = dict(scores)
+        with self._lock:
+            self.stores += 1
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+
+        if self.path:
+            try:
+                conn = self._connection()
+                with conn:
+                    if key is not None:
+                        conn.execute(
+                            "DELETE FROM score_handles WHERE key = ? AND created < ?", (key, now - self.ttl)
+                        )
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO score_handles (handle, key, scores, created) VALUES (?, ?, ?, ?)",
+                        (handle, key, json.dumps(scores), now)
+                    )
+                if not cursor.rowcount:
+                    # عامل آخر أنشأ معرفاً لنفس المفتاح في نفس الوقت
+                    existing = self._reuse(key, now)
+                    if existing is not None:
+                        return existing
+                if evict:
+                    self.evict()
+            except sqlite3.Error as e:
+                print(f"Error writing score handle: {str(e)}")
+
+        with self._lock:
+            self._remember(handle, now, scores, key)
+        return handle
+
+    def _reuse(self, key, now):
+        # المعرف الحالي للمفتاح إذا لم ينته، مع تجديد صلاحيته إذا مضى عليه أكثر من نصف المدة
+        with self._lock:
+            handle = self._keys.get(key)
+            entry = self._memory.get(handle) if handle is not None else None
+            if entry is not None and now - entry[0] <= self.ttl:
+                created, scores = entry[0], entry[1]
+            else:
+                handle = None
+
+        if handle is None and self.path:
+            try:
+                row = self._connection().execute(
+                    "SELECT handle, scores, created FROM score_handles WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"Error reading score handles: {str(e)}")
+                row = None
+            if row is None or now - row[2] > self.ttl:
+                return None
+            handle, scores, created = row[0], json.loads(row[1]), row[2]
+
+        if handle is None:
+            return None
+        if now - created > self.ttl / 2:
+            created = now
+            if self.path:
+                try:
+                    conn = self._connection()
+                    with conn:
+                        conn.execute("UPDATE score_handles SET created = ? WHERE handle = ?", (now, handle))
+                except sqlite3.Error as e:
+                    print(f"Error refreshing score handle: {str(e)}")
+        with self._lock:
+            self._remember(handle, created, scores, key)
+        return handle
+
+    def get_many(self, handles):
+        """الدرجات الخام لكل معرف بنفس الترتيب (None للمعرفات غير الموجودة أو المنتهية)"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for handle in handles:
+                entry = self._memory.get(handle)
+                if entry is None:
+                    continue
+                created, scores, _ = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(handle)
+                    found[handle] = scores
+                else:
+                    self._forget(handle)
+
+        # المعرفات التي أنشأها عامل آخر: استعلام واحد لكل الطلب
+        missing = list({handle for handle in handles if handle not in found})
+        if missing and self.path:
+            try:
+                placeholders = ','.join('?' * len(missing))
+                rows = self._connection().execute(
+                    f"SELECT handle, key, scores, created FROM score_handles WHERE handle IN ({placeholders})",
+                    missing
+                ).fetchall()
+                with self._lock:
+                    for handle, key, scores, created in rows:
+                        if now - created <= self.ttl:
+                            found[handle] = json.loads(scores)
+                            self._remember(handle, created, found[handle], key)
+            except sqlite3.Error as e:
+                print(f"Error reading score handles: {str(e)}")
+
+        with self._lock:
+            hits = sum(1 for handle in handles if handle in found)
+            self.hits += hits
+            self.misses += len(handles) - hits
+        return [dict(found[handle]) if handle in found else None for handle in handles]
+
+    def _remember(self, handle, created, scores, key=None):
+        self._memory[handle] = (created, scores, key)
+        self._memory.move_to_end(handle)
+        if key is not None:
+            self._keys[key] = handle
+        while len(self._memory) > self.memory_entries:
+            self._forget(next(iter(self._memory)))
+
+    def _forget(self, handle):
+        _, _, key = self._memory.pop(handle)
+        if key is not None and self._keys.get(key) == handle:
+            del self._keys[key]
+
+    def evict(self):
+        """حذف المعرفات المنتهية ثم الأقدم حتى يصبح العدد ضمن الحد"""
+        if not self.path:
+            return
+        conn = self._connection()
+        removed = 0
+        with conn:
+            cursor = conn.execute("DELETE FROM score_handles WHERE created < ?", (time.time() - self.ttl,))
+            removed += cursor.rowcount
+            total = conn.execute("SELECT COUNT(*) FROM score_handles").fetchone()[0]
+            if total > self.max_entries:
+                cursor = conn.execute("""
+                    DELETE FROM score_handles WHERE handle IN (
+                        SELECT handle FROM score_handles ORDER BY created, handle LIMIT ?
+                    )
+                """, (total - self.max_entries,))
+                removed += cursor.rowcount
+        with self._lock:
+            self.evictions += removed
+
+    def stats(self):
+        """إحصائيات الإصابة والإخفاق"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,249 @@
+"""
+جدول قواعد تعديل الدرجات حسب معلومات المريض وتوليد التوصيات
+
+القواعد معرفة في ملف JSON (scoring_rules.json افتراضياً أو SCORING_RULES_PATH) وتترجم
+مرة واحدة إلى مصفوفات معاملات، ثم تطبق على مصفوفة من صفوف الدرجات ومجموعة من المرضى
+بعمليات NumPy. ترتيب تطبيق القواعد مطابق للحساب السابق (الأعراض ثم العمر ثم أسباب
+الزيارة) حتى تكون النتائج مطابقة تماماً:
+- symptoms: معاملات لكل عرض (مطابقة تامة لاسم العرض)، تطبق بترتيب الأعراض
+- age_bands: معاملات وتوصية لأول فئة عمرية مطابقة (above / below)
+- visit_reasons: أول كلمة مفتاحية (بترتيب القواعد) موجودة في نص سبب الزيارة
+- thresholds: توصية لكل حالة درجتها أقل من الحد
+- symptom_recommendations: أول كلمة مفتاحية موجودة في نص العرض
+"""
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+SCORING_RULES_PATH = os.getenv(
+    'SCORING_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scoring_rules.json')
+)
+
+OVERALL = 'overall_health'
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def keyword_matcher(keywords):
+    """
+    دالة ترجع ترتيب أول كلمة مفتاحية (حسب ترتيب القواعد) موجودة في النص أو None
+    باستخدام تعبير نمطي واحد مترجم مسبقاً بدلاً من فحص كل كلمة على حدة
+    """
+    keywords = [keyword.lower() for keyword in keywords]
+    if not keywords:
+        return lambda text: None
+    priority = {}
+    for position, keyword in enumerate(keywords):
+        priority.setdefault(keyword, position)
+    # البحث عن الأطول أولاً في كل موضع (مع السماح بالتداخل)، ثم إضافة الكلمات الموجودة
+    # داخل الكلمة المطابقة حتى تطابق النتيجة فحص 'keyword in text' لكل كلمة
+    alternatives = sorted(priority, key=len, reverse=True)
+    pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in alternatives) + '))')
+    contained = {
+        keyword: [other for other in priority if other in keyword]
+        for keyword in priority
+    }
+
+    @lru_cache(maxsize=65536)
+    def first_rule(text):
+        found = set()
+        for match in pattern.finditer(text.lower()):
+            found.update(contained[match.group(1)])
+        return min((priority[keyword] for keyword in found), default=None)
+
+    return first_rule
+
+
+class RuleTable:
+    """قواعد التعديل والتوصيات بعد ترجمتها إلى مصفوفات"""
+
+    def __init__(self, config):
+        self.conditions = list(config['conditions'])
+        # أعمدة صفوف الدرجات: الحالات ثم الصحة العامة (تحسب من متوسط الحالات)
+        self.columns = self.conditions + [OVERALL]
+        self.index = {condition: column for column, condition in enumerate(self.columns)}
+
+        self.symptom_factors = {
+            symptom: self._factors(multipliers)
+            for symptom, multipliers in config.get('symptoms', {}).items()
+        }
+
+        self.age_bands = config.get('age_bands', [])
+        self.age_factors = np.array(
+            [self._factors(band.get('multipliers', {})) for band in self.age_bands] + [self._factors({})]
+        )
+
+        reasons = config.get('visit_reasons', [])
+        self.reason_factors = np.array([self._factors(rule['multipliers']) for rule in reasons] + [self._factors({})])
+        self.reason_rule = keyword_matcher([rule['keyword'] for rule in reasons])
+
+        thresholds = config.get('thresholds', [])
+        self.threshold_columns = np.array([self._column(rule['condition']) for rule in thresholds], dtype=np.intp)
+        self.threshold_limits = np.array([rule['below'] for rule in thresholds], dtype=np.float64)
+        self.threshold_messages = [rule['recommendation'] for rule in thresholds]
+        # ترميز الحدود المتجاوزة في كل صف كرقم ثنائي
+        self._threshold_bits = np.left_shift(1, np.arange(len(thresholds), dtype=np.int64))
+
+        symptom_recommendations = config.get('symptom_recommendations', [])
+        self.symptom_messages = [rule['recommendation'] for rule in symptom_recommendations]
+        self.symptom_rule = keyword_matcher([rule['keyword'] for rule in symptom_recommendations])
+
+        self.default_recommendation = config['default_recommendation']
+        self._encode = lru_cache(maxsize=65536)(self._encode_patient)
+
+    @classmethod
+    def load(cls, path=SCORING_RULES_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _column(self, condition):
+        if condition not in self.index:
+            raise ValueError(f"حالة غير معروفة في جدول القواعد: {condition}")
+        return self.index[condition]
+
+    def _factors(self, multipliers):
+        factors = np.ones(len(self.conditions))
+        for condition, factor in multipliers.items():
+            column = self._column(condition)
+            if column >= len(self.conditions):
+                raise ValueError(f"لا يمكن تعديل {condition} مباشرة في جدول القواعد")
+            factors[column] = factor
+        return factors
+
+    def _age_band(self, age):
+        for position, band in enumerate(self.age_bands):
+            if 'above' in band and not age > band['above']:
+                continue
+            if 'below' in band and not age < band['below']:
+                continue
+            return position
+        return len(self.age_bands)
+
+    def _encode_patient(self, symptoms, age, visit_reasons):
+        """القواعد المطبقة على مريض: (الأعراض بالترتيب، الفئة العمرية، قواعد أسباب الزيارة، التوصيات)"""
+        band = self._age_band(age)
+        reasons = tuple(
+            rule for rule in (self.reason_rule(reason) for reason in visit_reasons) if rule is not None
+        )
+
+        recommendations = []
+        if band < len(self.age_bands) and self.age_bands[band].get('recommendation'):
+            recommendations.append(self.age_bands[band]['recommendation'])
+        for symptom in symptoms:
+            rule = self.symptom_rule(symptom)
+            if rule is not None:
+                recommendations.append(self.symptom_messages[rule])
+
+        return (
+            tuple(symptom for symptom in symptoms if symptom in self.symptom_factors),
+            band,
+            reasons,
+            tuple(recommendations)
+        )
+
+    def signatures(self, patients):
+        """
+        ترجمة المرضى: قائمة المرضى المختلفين (نفس الأعراض والعمر وأسباب الزيارة يترجمون مرة واحدة)
+        ورقم كل مريض في هذه القائمة
+        """
+        signatures = {}
+        ids = np.fromiter(
+            (
+                signatures.setdefault(
+                    self._encode(tuple(patient.symptoms), patient.age, tuple(patient.visit_reasons)),
+                    len(signatures)
+                )
+                for patient in patients
+            ),
+            dtype=np.intp,
+            count=len(patients)
+        )
+        return list(signatures), ids
+
+    def to_matrix(self, scores_list):
+        """مصفوفة (N, أعمدة) من قوائم درجات بشكل القاموس"""
+        return np.array([[scores[column] for column in self.columns] for scores in scores_list], dtype=np.float64)
+
+    def to_scores(self, row):
+        return dict(zip(self.columns, row.tolist()))
+
+    def adjust(self, raw, patients):
+        """تعديل صفوف الدرجات الخام (N, أعمدة) حسب المرضى وإعادة حساب الصحة العامة"""
+        return self._adjust(raw, *self.signatures(patients))
+
+    def _adjust(self, raw, unique, ids):
+        width = len(self.conditions)
+        adjusted = np.array(raw, dtype=np.float64)[:, :width].copy()
+
+        # الأعراض بالترتيب: min(x * f, x) كما في الحساب السابق
+        steps = max((len(entry[0]) for entry in unique), default=0)
+        if steps:
+            symptom_steps = np.ones((steps, len(unique), width))
+            for signature, entry in enumerate(unique):
+                for step, symptom in enumerate(entry[0]):
+                    symptom_steps[step, signature] = self.symptom_factors[symptom]
+            for factors in symptom_steps:
+                np.minimum(adjusted * factors[ids], adjusted, out=adjusted)
+
+        # الفئة العمرية
+        bands = np.array([entry[1] for entry in unique], dtype=np.intp)
+        adjusted *= self.age_factors[bands[ids]]
+
+        # أسباب الزيارة بالترتيب
+        steps = max((len(entry[2]) for entry in unique), default=0)
+        if steps:
+            no_rule = len(self.reason_factors) - 1
+            rules = np.full((len(unique), steps), no_rule, dtype=np.intp)
+            for signature, entry in enumerate(unique):
+                rules[signature, :len(entry[2])] = entry[2]
+            for step in range(steps):
+                adjusted *= self.reason_factors[rules[ids, step]]
+
+        # الصحة العامة: متوسط الحالات (الجمع بنفس ترتيب الحالات)
+        total = adjusted[:, 0].copy()
+        for column in range(1, width):
+            total += adjusted[:, column]
+        return np.column_stack([adjusted, total / width])
+
+    def recommend(self, scores, patients=None):
+        """قائمة التوصيات لكل صف درجات (مع توصيات المريض إذا تم تمريره)"""
+        if patients is None:
+            return self._recommend(scores, [((), 0, (), ())], np.zeros(len(scores), dtype=np.intp))
+        return self._recommend(scores, *self.signatures(patients))
+
+    def _recommend(self, scores, unique, ids):
+        scores = np.asarray(scores, dtype=np.float64)
+        codes = (scores[:, self.threshold_columns] < self.threshold_limits) @ self._threshold_bits
+
+        # التوصيات تعتمد فقط على الحدود المتجاوزة والمريض: تبنى مرة واحدة لكل تركيبة
+        keys, inverse = np.unique(codes * len(unique) + ids, return_inverse=True)
+        combinations = []
+        for key in keys.tolist():
+            code, signature = divmod(key, len(unique))
+            recommendations = [
+                message for position, message in enumerate(self.threshold_messages) if code >> position & 1
+            ] + list(unique[signature][3])
+            combinations.append(recommendations or [self.default_recommendation])
+        return [list(combinations[combination]) for combination in inverse.tolist()]
+
+    def rescore(self, raw, patients):
+        """تعديل الدرجات وتوليد التوصيات لمجموعة كبيرة من السجلات دفعة واحدة"""
+        unique, ids = self.signatures(patients)
+        adjusted = self._adjust(raw, unique, ids)
+        return adjusted, self._recommend(adjusted, unique, ids)
+
+
+def get_rule_table(path=SCORING_RULES_PATH):
+    """جدول القواعد المشترك داخل العملية لملف معين"""
+    path = os.path.abspath(path)
+    with _tables_lock:
+        table = _tables.get(path)
+        if table is None:
+            table = _tables[path] = RuleTable.load(path)
+        return table
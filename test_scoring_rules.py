@@ -0,0 +1,158 @@
+import itertools
+import random
+
+import pytest
+
+from dental_analyzer import DentalAnalyzer
+from patient import Patient
+
+CONDITIONS = ['cavity', 'gum_inflammation', 'plaque', 'erosion', 'sensitivity']
+
+# القواعد كما كانت مكتوبة في DentalAnalyzer قبل نقلها إلى scoring_rules.json
+SYMPTOM_CONDITIONS = {
+    'ألم': ['cavity', 'sensitivity'],
+    'نزيف': ['gum_inflammation'],
+    'حساسية': ['sensitivity', 'erosion'],
+    'تورم': ['gum_inflammation'],
+    'رائحة': ['plaque', 'gum_inflammation'],
+    'تغير لون': ['cavity', 'erosion']
+}
+
+
+def reference_adjust(scores, patient):
+    adjusted_scores = scores.copy()
+
+    for symptom in patient.symptoms:
+        if symptom in SYMPTOM_CONDITIONS:
+            for condition in SYMPTOM_CONDITIONS[symptom]:
+                adjusted_scores[condition] = min(adjusted_scores[condition] * 0.8, adjusted_scores[condition])
+
+    if patient.age > 60:
+        adjusted_scores['gum_inflammation'] *= 0.9
+        adjusted_scores['erosion'] *= 0.9
+    elif patient.age < 18:
+        adjusted_scores['cavity'] *= 0.9
+
+    for reason in patient.visit_reasons:
+        if 'ألم' in reason.lower():
+            adjusted_scores['cavity'] *= 0.8
+            adjusted_scores['sensitivity'] *= 0.8
+        elif 'نزيف' in reason.lower():
+            adjusted_scores['gum_inflammation'] *= 0.7
+        elif 'رائحة' in reason.lower():
+            adjusted_scores['plaque'] *= 0.8
+            adjusted_scores['gum_inflammation'] *= 0.8
+
+    adjusted_scores['overall_health'] = sum(
+        score for condition, score in adjusted_scores.items()
+        if condition != 'overall_health'
+    ) / (len(adjusted_scores) - 1)
+    return adjusted_scores
+
+
+def reference_basic_recommendations(scores):
+    recommendations = []
+    if scores['cavity'] < 0.7:
+        recommendations.append("ينصح بزيارة طبيب الأسنان للكشف عن التسوس المحتمل")
+    if scores['gum_inflammation'] < 0.7:
+        recommendations.append("يُنصح باستخدام غسول الفم المضاد للبكتيريا وتحسين نظافة الفم")
+    if scores['plaque'] < 0.6:
+        recommendations.append("يجب تحسين تنظيف الأسنان باستخدام الفرشاة والخيط السني بانتظام")
+    if scores['erosion'] < 0.7:
+        recommendations.append("تجنب المشروبات الحمضية وتناول الأطعمة القاسية")
+    if scores['sensitivity'] < 0.7:
+        recommendations.append("استخدم معجون أسنان مخصص للأسنان الحساسة")
+    if scores['overall_health'] < 0.6:
+        recommendations.append("يُنصح بزيارة طبيب الأسنان لفحص شامل وتنظيف احترافي")
+    return recommendations
+
+
+def reference_recommendations(scores, patient=None):
+    recommendations = reference_basic_recommendations(scores)
+    if patient:
+        if patient.age > 60:
+            recommendations.append("نظراً لعمرك، يُنصح بزيارة طبيب الأسنان كل 4-6 أشهر للفحص الدوري")
+        elif patient.age < 18:
+            recommendations.append("يُنصح بتجنب الحلويات والمشروبات الغازية وتنظيف الأسنان بعد كل وجبة")
+
+        for symptom in patient.symptoms:
+            if 'ألم' in symptom.lower():
+                recommendations.append("يُنصح بتجنب الأطعمة والمشروبات شديدة البرودة أو السخونة")
+            elif 'نزيف' in symptom.lower():
+                recommendations.append("استخدم فرشاة أسنان ناعمة وتجنب الضغط الشديد أثناء التنظيف")
+
+    if not recommendations:
+        recommendations.append("صحة أسنانك جيدة! حافظ على روتين العناية اليومي")
+    return recommendations
+
+
+def reference_basic(scores):
+    return reference_basic_recommendations(scores) or ["صحة أسنانك جيدة! حافظ على روتين العناية اليومي"]
+
+
+# كلمات متداخلة وأعراض غير معروفة وأحرف لاتينية كبيرة (lower)
+SYMPTOMS = ['ألم', 'نزيف', 'حساسية', 'تورم', 'رائحة', 'تغير لون', 'نزيف وألم', 'ألم شديد',
+            'نزيف اللثة', 'صداع', 'PAIN', '']
+VISIT_REASONS = ['ألم', 'نزيف', 'رائحة', 'نزيف وألم', 'رائحة ونزيف', 'ألم ورائحة', 'فحص دوري', 'ALM', '']
+AGES = [5, 17, 18, 30, 60, 61, 80]
+SCORE_VALUES = [0.0, 0.3, 0.59, 0.6, 0.61, 0.69, 0.7, 0.71, 0.875, 1.0]
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return DentalAnalyzer(max_workers=1)
+
+
+def random_case(rng):
+    scores = {condition: rng.choice(SCORE_VALUES + [rng.random()]) for condition in CONDITIONS}
+    scores['overall_health'] = rng.random()
+    patient = Patient(
+        'مريض', rng.choice(AGES), 'ذكر', '0500000000',
+        visit_reasons=[rng.choice(VISIT_REASONS) for _ in range(rng.randint(0, 3))],
+        symptoms=[rng.choice(SYMPTOMS) for _ in range(rng.randint(0, 4))]
+    )
+    return scores, patient
+
+
+@pytest.mark.parametrize('age', AGES)
+@pytest.mark.parametrize('symptoms, visit_reasons', [
+    ([], []),
+    (['نزيف وألم'], ['نزيف وألم']),
+    (['ألم', 'ألم'], ['ألم', 'ألم']),
+    (['رائحة', 'تغير لون', 'حساسية'], ['رائحة ونزيف']),
+    (['صداع', 'PAIN'], ['فحص دوري', 'ALM']),
+    (['نزيف اللثة', 'ألم شديد'], ['ألم ورائحة', '']),
+])
+def test_rules_match_reference(analyzer, age, symptoms, visit_reasons):
+    patient = Patient('مريض', age, 'ذكر', '0500000000', visit_reasons=visit_reasons, symptoms=symptoms)
+    for values in itertools.product([0.59, 0.6, 0.7, 0.71], repeat=2):
+        scores = dict(zip(CONDITIONS, values * 3))
+        scores['overall_health'] = values[0]
+
+        adjusted = analyzer._adjust_scores_based_on_patient(scores, patient)
+        expected = reference_adjust(scores, patient)
+        assert adjusted == expected
+        assert list(adjusted) == list(expected)
+        assert analyzer._generate_recommendations(adjusted, patient) == reference_recommendations(expected, patient)
+        assert analyzer._generate_recommendations(scores) == reference_recommendations(scores)
+        assert analyzer._generate_basic_recommendations(scores) == reference_basic(scores)
+
+
+def test_random_records_match_reference(analyzer):
+    rng = random.Random(0)
+    cases = [random_case(rng) for _ in range(3000)]
+
+    for scores, patient in cases:
+        adjusted = analyzer._adjust_scores_based_on_patient(scores, patient)
+        assert adjusted == reference_adjust(scores, patient)
+        assert analyzer._generate_recommendations(adjusted, patient) == reference_recommendations(adjusted, patient)
+        assert analyzer._generate_basic_recommendations(scores) == reference_basic(scores)
+
+    # إعادة الحساب دفعة واحدة تعطي نفس نتائج الحساب لكل سجل
+    raw_scores = [scores for scores, _ in cases]
+    patients = [patient for _, patient in cases]
+    rows, recommendations = analyzer.rescore(raw_scores, patients)
+    for row, recommended, (scores, patient) in zip(rows, recommendations, cases):
+        expected = reference_adjust(scores, patient)
+        assert analyzer.rules.to_scores(row) == expected
+        assert recommended == reference_recommendations(expected, patient)
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+import pytest
+
+from dental_analyzer import DentalAnalyzer
+
+
+def random_gray(rng, height, width):
+    """صورة رمادية عشوائية: تدرجات ناعمة ودوائر فاتحة وضوضاء (حواف ومحيطات تعبر حدود المربعات)"""
+    small = (rng.random((max(height // 8, 1), max(width // 8, 1))) * 255).astype(np.uint8)
+    gray = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(int(rng.integers(1, 12))):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(1, max(min(height, width) // 4, 2)))
+        cv2.circle(gray, center, radius, int(rng.integers(150, 256)), -1)
+    noise = rng.integers(0, 24, size=gray.shape, dtype=np.uint8)
+    return cv2.add(gray, noise)
+
+
+@pytest.mark.parametrize('tile_workers', [1, 3])
+@pytest.mark.parametrize('tile_size', [17, 64, 300])
+def test_tiled_features_match_full_image(tile_size, tile_workers):
+    rng = np.random.default_rng(tile_size * 10 + tile_workers)
+    analyzer = DentalAnalyzer(max_workers=1, tile_size=tile_size, tile_workers=tile_workers)
+
+    for _ in range(6):
+        height, width = (int(side) for side in rng.integers(1, 700, size=2))
+        gray = random_gray(rng, height, width)
+
+        expected = analyzer._extract_features(gray)
+        features, _ = analyzer._extract_features_tiled(gray)
+        assert features == expected, (height, width)
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# معرف الصورة هو بصمة SHA-256 لمحتوى الملف المرفوع
+IMAGE_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+THUMBNAIL_MAX_SIDE = 512
+THUMBNAIL_QUALITY = 75
+
+# الاحتفاظ بالصور المصغرة: تحذف بعد مدة من آخر رفع للصورة أو الأقدم عند تجاوز الحجم الأقصى
+THUMBNAILS_MAX_AGE = int(os.getenv('THUMBNAILS_MAX_AGE', 30 * 24 * 3600))  # بالثواني
+THUMBNAILS_MAX_BYTES = int(os.getenv('THUMBNAILS_MAX_BYTES', 1024 * 1024 * 1024))
+THUMBNAILS_EVICT_INTERVAL = int(os.getenv('THUMBNAILS_EVICT_INTERVAL', 3600))  # بالثواني
+
+# الملفات المؤقتة المتروكة من كتابة لم تكتمل تحذف بعد هذه المدة
+STALE_TEMP_AGE = 3600
+
+
+def image_id(data):
+    """معرف ثابت للصورة مشتق من محتواها (الصور المتطابقة تحصل على نفس المعرف)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_thumbnail(image, max_side=THUMBNAIL_MAX_SIDE, quality=THUMBNAIL_QUALITY):
+    """تصغير الصورة إلى حد أقصى للأبعاد وترميزها كـ JPEG"""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    # صور الأشعة رمادية غالباً: حفظها بقناة واحدة يقلل الحجم
+    if image.ndim == 3:
+        blue, green, red = cv2.split(image)
+        if np.array_equal(blue, green) and np.array_equal(green, red):
+            image = blue
+
+    ok, buffer = cv2.imencode('.jpg', image, [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 1
+    ])
+    if not ok:
+        raise ValueError("فشل في ترميز الصورة المصغرة")
+    return buffer.tobytes()
+
+
+@lru_cache(maxsize=256)
+def _load(path, max_side, quality):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if max_side >= THUMBNAIL_MAX_SIDE:
+        return data
+
+    # إعادة ترميز بدقة وجودة أقل لتقارير ذات حجم محدود
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return encode_thumbnail(image, max_side, quality)
+
+
+class ThumbnailStore:
+    """
+    صور مصغرة للصور المحللة محفوظة على القرص باسم بصمة المحتوى
+    كل صورة تحفظ مرة واحدة مهما تكرر رفعها، وتحذف في الخلفية بعد max_age من آخر رفع
+    أو الأقدم رفعاً عند تجاوز max_bytes
+    """
+
+    def __init__(self, directory, max_age=THUMBNAILS_MAX_AGE, max_bytes=THUMBNAILS_MAX_BYTES,
+                 evict_interval=THUMBNAILS_EVICT_INTERVAL):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.evictions = 0
+
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._pid = None
+
+    def path(self, image_id):
+        if not isinstance(image_id, str) or not IMAGE_ID_PATTERN.fullmatch(image_id):
+            return None
+        return os.path.join(self.directory, f'{image_id}.jpg')
+
+    def exists(self, image_id):
+        path = self.path(image_id)
+        return path is not None and os.path.exists(path)
+
+    def save(self, image_id, image):
+        """حفظ الصورة المصغرة إذا لم تكن محفوظة من قبل"""
+        path = self.path(image_id)
+        if path is None:
+            return
+        if os.path.exists(path):
+            # تحديث وقت آخر رفع حتى لا تحذف الصور المستخدمة حديثاً
+            try:
+                os.utime(path)
+                return
+            except FileNotFoundError:
+                pass
+
+        data = encode_thumbnail(image)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def load(self, image_id, max_side=THUMBNAIL_MAX_SIDE, quality=THUMBNAIL_QUALITY):
+        """بايتات JPEG للصورة المصغرة بالدقة المطلوبة، أو None إذا لم توجد"""
+        path = self.path(image_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            return _load(path, max_side, quality)
+        except (OSError, cv2.error) as e:
+            print(f"Error loading thumbnail {image_id}: {str(e)}")
+            return None
+
+    def evict(self):
+        """حذف الصور المنتهية الصلاحية ثم الأقدم حتى يصبح الحجم ضمن الحد، وإرجاع عددها"""
+        now = time.time()
+        entries = []
+        removed = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith('.tmp'):
+                        if now - stat.st_mtime > STALE_TEMP_AGE:
+                            removed.append(entry.path)
+                    elif entry.name.endswith('.jpg'):
+                        if now - stat.st_mtime > self.max_age:
+                            removed.append(entry.path)
+                        else:
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            return 0
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # حذف الأقدم حتى الوصول إلى 90% من الحد
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                removed.append(path)
+                total -= size
+
+        count = 0
+        for path in removed:
+            try:
+                os.remove(path)
+                count += 1
+            except FileNotFoundError:
+                pass
+        self.evictions += count
+        return count
+
+    def stats(self):
+        """عدد الصور المصغرة وحجمها الكلي"""
+        count = total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.jpg'):
+                        count += 1
+                        total += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        return {
+            'thumbnails': count,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'evictions': self.evictions
+        }
+
+    def start(self):
+        """تشغيل خيط الحذف الدوري في العملية الحالية (مرة واحدة لكل عملية)"""
+        with self._thread_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # بعد fork لا تنتقل الخيوط إلى العملية الابن
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='thumbnail-eviction', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                removed = self.evict()
+                if removed:
+                    print(f"Removed {removed} old thumbnails")
+            except OSError as e:
+                print(f"Error evicting thumbnails: {str(e)}")
+            time.sleep(self.evict_interval)
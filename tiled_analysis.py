@@ -0,0 +1,342 @@
+"""
+استخراج خصائص التحليل على شكل مربعات متداخلة بذاكرة محدودة بحجم المربع
+
+كل مربع يعالج مع هامش من البكسلات المجاورة يغطي أكبر نواة مستخدمة، ثم يتم دمج
+الإحصائيات بحيث تكون النتيجة مطابقة تماماً للتحليل على الصورة كاملة:
+- عتبة أوتسو تحسب من المدرج التكراري الكلي
+- المحيطات الخارجية وحواف Canny (التتبع بالعتبتين) تدمج عبر حدود المربعات بربط المكونات المتصلة
+- الانحراف المعياري يحسب من مدرجات تكرارية صحيحة قابلة للجمع
+"""
+import math
+
+import cv2
+import numpy as np
+
+# أكبر نصف قطر نواة مستخدم (تمويه 15x15) مع هامش لـ Sobel وكبت القيم غير العظمى في Canny
+TILE_HALO = 8
+
+# عدد الصفوف في كل دفعة عند حساب المدرجات التكرارية للمصفوفات الكبيرة
+HISTOGRAM_CHUNK_ROWS = 256
+
+CANNY_LOW = 100
+CANNY_HIGH = 200
+
+# مدى قيم لابلاسيان (نواة 3x3) لصور uint8
+LAPLACIAN_OFFSET = 4 * 255
+
+
+def histogram(values, minlength, offset=0):
+    """مدرج تكراري صحيح للقيم على دفعات من الصفوف (بدون مصفوفة فهارس بحجم الصورة)"""
+    counts = np.zeros(minlength, dtype=np.int64)
+    for start in range(0, values.shape[0], HISTOGRAM_CHUNK_ROWS):
+        chunk = values[start:start + HISTOGRAM_CHUNK_ROWS]
+        if offset:
+            chunk = chunk.astype(np.int32) + offset
+        counts += np.bincount(chunk.ravel(), minlength=minlength)
+    return counts
+
+
+def histogram_std(counts, offset=0):
+    """الانحراف المعياري من مدرج تكراري (المجاميع صحيحة تماماً فالنتيجة لا تعتمد على ترتيب الجمع)"""
+    values = np.arange(len(counts), dtype=np.int64) - offset
+    count = int(counts.sum())
+    if count == 0:
+        return 0.0
+    total = int(np.dot(counts, values))
+    squares = int(np.dot(counts, values * values))
+    return math.sqrt(count * squares - total * total) / count
+
+
+def otsu_threshold(counts):
+    """عتبة أوتسو من المدرج التكراري (نفس خطوات OpenCV بنفس ترتيب العمليات)"""
+    scale = 1.0 / float(counts.sum())
+    mu = 0.0
+    for i in range(256):
+        mu += i * float(counts[i])
+    mu *= scale
+
+    epsilon = float(np.finfo(np.float32).eps)
+    mu1 = q1 = 0.0
+    max_sigma = max_value = 0.0
+    for i in range(256):
+        p_i = float(counts[i]) * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_value = i
+    return max_value
+
+
+def tile_bounds(height, width, tile_size):
+    """حدود المربعات (بدون التداخل) بترتيب الصفوف"""
+    return [
+        (y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+        for y0 in range(0, height, tile_size)
+        for x0 in range(0, width, tile_size)
+    ]
+
+
+def _border_labels(labels, y0, x0, height, width):
+    """تسميات المكونات التي تلمس حافة الصورة الحقيقية"""
+    rows, cols = labels.shape
+    parts = []
+    if y0 == 0:
+        parts.append(labels[0])
+    if y0 + rows == height:
+        parts.append(labels[-1])
+    if x0 == 0:
+        parts.append(labels[:, 0])
+    if x0 + cols == width:
+        parts.append(labels[:, -1])
+    if not parts:
+        return np.zeros(0, dtype=np.int64)
+    labels = np.unique(np.concatenate(parts))
+    return labels[labels > 0].astype(np.int64)
+
+
+def _adjacent_pairs(fg, bg, bg_count):
+    """
+    أزواج (مكون أمامي، مكون خلفية) المتجاورة أفقياً أو رأسياً
+    فقط لمكونات الخلفية التي تلمس إطار المنطقة، لأن غيرها لا يمكن أن يتصل بحافة الصورة
+    """
+    candidates = np.zeros(bg_count, dtype=bool)
+    candidates[np.concatenate([bg[0], bg[-1], bg[:, 0], bg[:, -1]])] = True
+    candidates[0] = False
+
+    keys = []
+    for a_fg, a_bg, b_fg, b_bg in (
+        (fg[:, :-1], bg[:, :-1], fg[:, 1:], bg[:, 1:]),
+        (fg[:-1], bg[:-1], fg[1:], bg[1:])
+    ):
+        for near_fg, near_bg in ((a_fg, b_bg), (b_fg, a_bg)):
+            mask = candidates[near_bg]
+            mask &= near_fg > 0
+            keys.append(near_fg[mask].astype(np.int64) * bg_count + near_bg[mask])
+    keys = np.unique(np.concatenate(keys))
+    return np.stack([keys // bg_count, keys % bg_count], axis=1)
+
+
+def _seams(labels, has_top, has_left, has_bottom, has_right):
+    """
+    تسميات صفوف وأعمدة الحدود المشتركة مع المربعات المجاورة
+    (نسخ وليست عروضاً حتى لا تبقى مصفوفة التسميات الكاملة للمربع في الذاكرة)
+    """
+    return {
+        'top': labels[0].copy() if has_top else None,
+        'left': labels[:, 0].copy() if has_left else None,
+        'bottom': labels[-1].copy() if has_bottom else None,
+        'right': labels[:, -1].copy() if has_right else None
+    }
+
+
+def tile_features(gray, bounds, threshold):
+    """
+    الإحصائيات المحلية لمربع واحد
+    المنطقة الموسعة تشمل صفاً وعموداً من المربع التالي لربط المكونات عبر الحدود،
+    والمنطقة المبطنة تضيف هامش TILE_HALO لحساب المرشحات بدقة
+    """
+    height, width = gray.shape
+    y0, y1, x0, x1 = bounds
+    ey1, ex1 = min(y1 + 1, height), min(x1 + 1, width)
+    py0, py1 = max(y0 - TILE_HALO, 0), min(ey1 + TILE_HALO, height)
+    px0, px1 = max(x0 - TILE_HALO, 0), min(ex1 + TILE_HALO, width)
+
+    padded = gray[py0:py1, px0:px1]
+    ext = (slice(y0 - py0, ey1 - py0), slice(x0 - px0, ex1 - px0))
+    core = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+    core_rows, core_cols = y1 - y0, x1 - x0
+    seam_flags = (y0 > 0, x0 > 0, ey1 > y1, ex1 > x1)
+
+    # المحيطات الخارجية: مكونات أمامية باتصال 8 وخلفية باتصال 4 (نفس قواعد findContours)
+    _, binary = cv2.threshold(gray[y0:ey1, x0:ex1], threshold, 255, cv2.THRESH_BINARY)
+    fg_count, fg = cv2.connectedComponents(binary, connectivity=8, ltype=cv2.CV_32S)
+    bg_count, bg = cv2.connectedComponents(cv2.bitwise_not(binary), connectivity=4, ltype=cv2.CV_32S)
+    del binary
+    fg_core = np.unique(fg[:core_rows, :core_cols])
+
+    contours = {
+        'fg_count': fg_count,
+        'bg_count': bg_count,
+        'fg_border': _border_labels(fg, y0, x0, height, width),
+        'bg_border': _border_labels(bg, y0, x0, height, width),
+        'pairs': _adjacent_pairs(fg, bg, bg_count),
+        'fg_core': fg_core[fg_core > 0].astype(np.int64),
+        'fg_seams': _seams(fg, *seam_flags),
+        'bg_seams': _seams(bg, *seam_flags)
+    }
+    del fg, bg
+
+    # Canny: كل نقطة تتجاوز العتبة الدنيا (بعد كبت القيم غير العظمى) مرشحة، والمكون المتصل
+    # من المرشحات يعتبر حافة إذا احتوى نقطة تتجاوز العتبة العليا
+    weak = cv2.Canny(padded, CANNY_LOW, CANNY_LOW)[ext]
+    strong = cv2.Canny(padded, CANNY_HIGH, CANNY_HIGH)[ext]
+    edge_count, edge_labels = cv2.connectedComponents(weak, connectivity=8, ltype=cv2.CV_32S)
+    strong_labels = np.unique(edge_labels[strong > 0]).astype(np.int64)
+    del weak, strong
+
+    edges = {
+        'count': edge_count,
+        'core_sizes': np.bincount(edge_labels[:core_rows, :core_cols].ravel(), minlength=edge_count).astype(np.int64),
+        'strong': strong_labels,
+        'seams': _seams(edge_labels, *seam_flags)
+    }
+    del edge_labels
+
+    # البلاك: الفرق عن التمويه الواسع بحساب uint8 (مع الالتفاف كما في التحليل الكامل)
+    residual = np.subtract(padded[core], cv2.GaussianBlur(padded, (15, 15), 0)[core])
+    residual_hist = histogram(residual, 256)
+    del residual
+
+    # تآكل المينا: لابلاسيان بدقة int16
+    laplacian = cv2.Laplacian(padded, cv2.CV_16S)[core]
+    laplacian_hist = histogram(laplacian, 2 * LAPLACIAN_OFFSET + 1, LAPLACIAN_OFFSET)
+    del laplacian
+
+    return {
+        'bounds': bounds,
+        'contours': contours,
+        'edges': edges,
+        'residual_hist': residual_hist,
+        'laplacian_hist': laplacian_hist
+    }
+
+
+def _resolve(count, edges):
+    """ربط المعرفات المتصلة وإرجاع الجذر (أصغر معرف) لكل معرف"""
+    parent = np.arange(count, dtype=np.int64)
+    if not edges:
+        return parent
+    edges = np.unique(np.concatenate(edges), axis=0)
+    a, b = edges[:, 0], edges[:, 1]
+    while True:
+        root_a, root_b = parent[a], parent[b]
+        if np.array_equal(root_a, root_b):
+            return parent
+        low = np.minimum(root_a, root_b)
+        np.minimum.at(parent, root_a, low)
+        np.minimum.at(parent, root_b, low)
+        # ضغط المسارات حتى يشير كل معرف إلى جذره مباشرة
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+
+def _seam_edges(tiles, offsets, key, grid_cols):
+    """أزواج المعرفات العامة لنفس البكسل في المربعات المتجاورة"""
+    edges = []
+    for index, tile in enumerate(tiles):
+        seams = key(tile)
+        below = index + grid_cols
+        if seams['bottom'] is not None and below < len(tiles):
+            edges.append(_link(seams['bottom'], key(tiles[below])['top'], offsets[index], offsets[below]))
+        if seams['right'] is not None:
+            edges.append(_link(seams['right'], key(tiles[index + 1])['left'], offsets[index], offsets[index + 1]))
+    return edges
+
+
+def _link(labels, other_labels, offset, other_offset):
+    mask = labels > 0
+    return np.stack([labels[mask].astype(np.int64) + offset, other_labels[mask].astype(np.int64) + other_offset], axis=1)
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    return offsets
+
+
+def merge_features(tiles, shape, grid_cols):
+    """
+    دمج إحصائيات المربعات في خصائص الصورة الكاملة وخصائص كل منطقة
+    """
+    height, width = shape
+
+    # المحيطات الخارجية: المكون الأمامي خارجي إذا لمس حافة الصورة أو جاور خلفية متصلة بالحافة
+    fg_offsets = _offsets([tile['contours']['fg_count'] for tile in tiles])
+    bg_offsets = _offsets([tile['contours']['bg_count'] for tile in tiles])
+    fg_total = int(fg_offsets[-1] + tiles[-1]['contours']['fg_count'])
+    bg_total = int(bg_offsets[-1] + tiles[-1]['contours']['bg_count'])
+    fg_root = _resolve(fg_total, _seam_edges(tiles, fg_offsets, lambda tile: tile['contours']['fg_seams'], grid_cols))
+    bg_root = _resolve(bg_total, _seam_edges(tiles, bg_offsets, lambda tile: tile['contours']['bg_seams'], grid_cols))
+
+    outer_background = np.zeros(bg_total, dtype=bool)
+    external = np.zeros(fg_total, dtype=bool)
+    for tile, fg_offset, bg_offset in zip(tiles, fg_offsets, bg_offsets):
+        outer_background[bg_root[tile['contours']['bg_border'] + bg_offset]] = True
+        external[fg_root[tile['contours']['fg_border'] + fg_offset]] = True
+    for tile, fg_offset, bg_offset in zip(tiles, fg_offsets, bg_offsets):
+        pairs = tile['contours']['pairs']
+        touching = outer_background[bg_root[pairs[:, 1] + bg_offset]]
+        external[fg_root[pairs[touching, 0] + fg_offset]] = True
+    contour_count = int(np.count_nonzero(external[np.unique(fg_root)]))
+
+    # حواف Canny: المكونات المتصلة عبر المربعات التي تحتوي نقطة قوية
+    edge_offsets = _offsets([tile['edges']['count'] for tile in tiles])
+    edge_total = int(edge_offsets[-1] + tiles[-1]['edges']['count'])
+    edge_root = _resolve(edge_total, _seam_edges(tiles, edge_offsets, lambda tile: tile['edges']['seams'], grid_cols))
+    is_edge = np.zeros(edge_total, dtype=bool)
+    for tile, offset in zip(tiles, edge_offsets):
+        is_edge[edge_root[tile['edges']['strong'] + offset]] = True
+
+    regions = []
+    edge_pixels = 0
+    residual_hist = np.zeros(256, dtype=np.int64)
+    laplacian_hist = np.zeros(2 * LAPLACIAN_OFFSET + 1, dtype=np.int64)
+    for tile, fg_offset, edge_offset in zip(tiles, fg_offsets, edge_offsets):
+        y0, y1, x0, x1 = tile['bounds']
+        sizes = tile['edges']['core_sizes']
+        # التسمية 0 هي الخلفية في كل مربع
+        tile_edges = int(sizes[1:][is_edge[edge_root[np.arange(1, len(sizes)) + edge_offset]]].sum())
+        roots = np.unique(fg_root[tile['contours']['fg_core'] + fg_offset])
+
+        edge_pixels += tile_edges
+        residual_hist += tile['residual_hist']
+        laplacian_hist += tile['laplacian_hist']
+
+        regions.append({
+            'x': x0,
+            'y': y0,
+            'width': x1 - x0,
+            'height': y1 - y0,
+            'features': {
+                'contour_count': int(np.count_nonzero(external[roots])),
+                'edge_density': tile_edges / ((y1 - y0) * (x1 - x0)),
+                'residual_std': histogram_std(tile['residual_hist']),
+                'laplacian_std': histogram_std(tile['laplacian_hist'], LAPLACIAN_OFFSET)
+            }
+        })
+
+    features = {
+        'contour_count': contour_count,
+        'edge_density': edge_pixels / (height * width),
+        'residual_std': histogram_std(residual_hist),
+        'laplacian_std': histogram_std(laplacian_hist, LAPLACIAN_OFFSET)
+    }
+    return features, regions
+
+
+def extract_features_tiled(gray, tile_size, executor=None):
+    """
+    خصائص الصورة الكاملة وخصائص كل منطقة بمعالجة مربعات بحجم tile_size
+    (بالتوازي إذا تم تمرير مجمع خيوط)
+    """
+    height, width = gray.shape
+    threshold = otsu_threshold(histogram(gray, 256))
+    bounds = tile_bounds(height, width, tile_size)
+    grid_cols = -(-width // tile_size)
+
+    if executor is None:
+        tiles = [tile_features(gray, tile, threshold) for tile in bounds]
+    else:
+        tiles = list(executor.map(lambda tile: tile_features(gray, tile, threshold), bounds))
+
+    return merge_features(tiles, (height, width), grid_cols)